@@ -0,0 +1,68 @@
+from core import pins
+
+
+class Frame:
+    """ LED overrides shown for a duration (seconds) """
+
+    def __init__(self, duration, leds):
+        self.duration = duration
+        self.leds = leds
+
+
+class Animation:
+    """ Sequence of frames, played by the DMA engine """
+
+    def __init__(self, name, frames, repeat=1, forever=False, stateless=True):
+        self.name = name
+        self.frames = frames
+        self.repeat = repeat
+        self.forever = forever
+        self.stateless = stateless
+
+
+# volume bar from left to right (row, col)
+VolumeBar = [
+    (pins.Q12, pins.Q1),
+    (pins.Q12, pins.Q2),
+    (pins.Q12, pins.Q3),
+    (pins.Q12, pins.Q5),
+    (pins.Q12, pins.Q6),
+    (pins.Q12, pins.Q7),
+    (pins.Q12, pins.Q8),
+    (pins.Q12, pins.Q10),
+    (pins.Q13, pins.Q1),
+    (pins.Q13, pins.Q2),
+    (pins.Q13, pins.Q3),
+]
+
+
+def _bar(lit):
+    """ Override the volume bar with the given lit LEDs """
+    return {led: (led in lit) for led in VolumeBar}
+
+
+def _spinner():
+    frames = []
+    for index, led in enumerate(VolumeBar):
+        trail = VolumeBar[index - 1]
+        frames.append(Frame(0.06, {
+            **_bar([led]),
+            trail: 0.5,
+        }))
+    return frames
+
+
+# running light while the main unit boots
+Spinner = Animation('spinner', _spinner(), forever=True)
+
+# whole bar flashes (e.g. volume limit reached)
+Flash = Animation('flash', [
+    Frame(0.08, _bar(VolumeBar)),
+    Frame(0.08, _bar([])),
+], repeat=2)
+
+# volume bar blinks while muted
+Blink = Animation('blink', [
+    Frame(0.5, {}),
+    Frame(0.5, _bar([])),
+], forever=True, stateless=False)
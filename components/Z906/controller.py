@@ -1,11 +1,14 @@
 from core.component import ConsumingComponent
+from core.limiter import Shaper
+from core.logs import Traffic
+from core.validation import Validator
+from core import trace
 from core.types import Input, Speakers, Effect, Stage, Commands
 from core.service import Worker
 from core import pins
 
 import logging
 import serial
-import pigpio
 import time
 
 
@@ -45,22 +48,29 @@ class Mappings:
 class Reader(Worker):
     """ Receives incoming data """
 
-    def __init__(self, delegate, serial):
-        super().__init__(self._read, 'serial thread')
+    def __init__(self, delegate, serial, traffic):
+        super().__init__(
+            self._read, f'serial thread ({serial.port})', critical=True)
 
         self._delegate = delegate
         self._serial = serial
+        self._traffic = traffic
 
-    def _log(self, *params):
+    def _log(self, label, *params):
         """ Logs the given message """
 
-        data = b'|'.join(params)
-        logging.debug(f'<< {data}')
+        data = b''.join(params)
+        self._traffic.record('<<', label, data)
+        logging.debug('<< %s %s', label, data)
 
     def _read(self, cycle, worker):
         """ Receives incoming serial commands """
 
+        # interrupt pending reads when stopped
+        worker.token.on_cancel(self._serial.cancel_read)
+
         while cycle == worker.cycle:
+            worker.heartbeat()
 
             data = self._serial.read()
             if not data:
@@ -81,7 +91,8 @@ class Reader(Worker):
             elif data == b'\x18':
                 pass
             else:
-                logging.warning(f'unknown byte {data}')
+                self._traffic.record('<<', 'unknown', data)
+                logging.warning('unknown byte %s', data)
 
     def _message(self):
         """ Read a well-formed message """
@@ -99,26 +110,30 @@ class Reader(Worker):
         if len(content) < length:
             return
 
+        checksum = self._serial.read()
+        if not checksum:
+            return
+
         # message parsed successfully
         if marker == b'\x0a':
             self._state(content)
         else:
-            logging.warning(f'unknown marker: {marker}')
+            logging.warning('unknown marker: %s', marker)
 
     def _on(self):
         data = self._serial.read(6)
 
-        self._log(b'on', data)
+        self._log('on', data)
         self._delegate._notify_on()
 
     def _off(self):
 
-        self._log(b'off')
+        self._log('off')
         self._delegate._notify_off()
 
     def _volume_up(self, data):
 
-        self._log(b'volume up', data)
+        self._log('volume up', data)
         for speakers, command in Mappings.VolumeUp.items():
             if command == data:
                 self._delegate._notify_volume_up(speakers)
@@ -126,7 +141,7 @@ class Reader(Worker):
 
     def _volume_down(self, data):
 
-        self._log(b'volume down', data)
+        self._log('volume down', data)
         for speakers, command in Mappings.VolumeDown.items():
             if command == data:
                 self._delegate._notify_volume_down(speakers)
@@ -134,7 +149,7 @@ class Reader(Worker):
 
     def _input_selected(self, data):
 
-        self._log(b'input selected', data)
+        self._log('input selected', data)
         for input, command in Mappings.Inputs.items():
             if command == data:
                 self._delegate._notify_input_selected(input)
@@ -142,7 +157,7 @@ class Reader(Worker):
 
     def _state(self, content):
 
-        self._log(b'state', content)
+        self._log('state', content)
         self._delegate._notify_state(
             volumes={
                 Speakers.Master: int(content[0]),
@@ -161,8 +176,9 @@ class Reader(Worker):
 class Writer:
     """ Transmits outgoing data """
 
-    def __init__(self, serial):
+    def __init__(self, serial, traffic):
         self._serial = serial
+        self._traffic = traffic
 
     @staticmethod
     def checksum(data):
@@ -178,9 +194,9 @@ class Writer:
         """ Format a well-formed message """
 
         # calculate missing bytes
-        length = bytes(len(content))
+        length = bytes([len(content)])
         message = marker + length + content
-        checksum = Commands.checksum(message)
+        checksum = bytes([Writer.checksum(message)])
 
         # build complete message
         return b'\xaa' + message + checksum
@@ -211,60 +227,115 @@ class Writer:
 
     @staticmethod
     def select_effect(effect, input):
-        pass
+        return Writer.select_input(input, effect)
 
     @staticmethod
     def set_state(volumes, input, effects):
         content = \
-            bytes(volumes[Speakers.Master]) + \
-            bytes(volumes[Speakers.Rear]) + \
-            bytes(volumes[Speakers.Center]) + \
-            bytes(volumes[Speakers.Sub]) + \
-            bytes(input) + \
+            bytes([
+                int(volumes[Speakers.Master]),
+                int(volumes[Speakers.Rear]),
+                int(volumes[Speakers.Center]),
+                int(volumes[Speakers.Sub]),
+                int(input),
+            ]) + \
             b'\x00\x00\x00' + \
-            bytes(effects[Input.Chinch]) + \
-            bytes(effects[Input.Aux]) + \
-            bytes(effects[Input.Input1]) + \
+            bytes([
+                int(effects[Input.Chinch]),
+                int(effects[Input.Aux]),
+                int(effects[Input.Input1]),
+            ]) + \
             b'\x00\x00\x00' + \
             b'\x06\x01\x03' + \
             b'\x00\x00\x00'
-        return Commands.message(b'\x0a', content)
+        return Writer.message(b'\x0a', content)
+
+    @staticmethod
+    def raw(data):
+        """ Precompiled command sequence """
+        return data
 
     def write(self, command, **kwargs):
         """ Transfer command (an log) """
 
         # build command and log it
         data = command(**kwargs)
-        logging.debug(f">> {data}")
+        self._traffic.record('>>', command.__name__, data)
+        logging.debug('>> %s', data)
 
-        # send command to device
-        self._serial.write(data)
+        # send command to device (unit may be disconnected)
+        try:
+            self._serial.write(data)
+        except serial.SerialTimeoutException:
+            logging.warning('write timed out on %s', self._serial.port)
 
 
 class Controller(ConsumingComponent):
     """ Provides serial communication with the Z906 main unit """
 
-    def __init__(self, pi, state, queue):
+    # command classes for rate limiting
+    Classes = {
+        Commands.TurnOn: 'power',
+        Commands.TurnOff: 'power',
+        Commands.Mute: 'volume',
+        Commands.Unmute: 'volume',
+        Commands.VolumeUp: 'volume',
+        Commands.VolumeDown: 'volume',
+        Commands.SelectInput: 'input',
+        Commands.SelectEffect: 'input',
+        Commands.ApplyPreset: 'input',
+        Commands.RequestState: 'request',
+    }
+
+    # (policy, commands per second, burst) per command class
+    Limits = {
+        'power': (Shaper.Pass, None, None),
+        'volume': (Shaper.Shape, 25.0, 4),
+        'input': (Shaper.Shape, 10.0, 2),
+        'request': (Shaper.Drop, 2.0, 1),
+    }
+
+    def __init__(self, pi, state, queue,
+                 device='/dev/ttyAMA0', on_signal=pins.ON_SIGNAL, limits=None,
+                 baudrate=57600, timeout=1.0):
         super().__init__(pi, state, queue)
 
-        # connect to main unit
-        self._serial = serial.Serial(
-            '/dev/ttyAMA0',
-            baudrate=57600,
-            bytesize=serial.EIGHTBITS,
-            parity=serial.PARITY_ODD,
-            stopbits=serial.STOPBITS_ONE,
-            xonxoff=False,
-            rtscts=False,
-            dsrdtr=False,
-            timeout=1.0)
-
-        # must stay at ground
-        self._pi.write(pins.ON_SIGNAL, 0)
+        # shape output to what the main unit can process
+        self._shaper = Shaper(
+            Controller.Classes, limits or Controller.Limits)
+
+        # skip commands that would not change anything
+        self._validator = Validator(state)
+
+        # drift statistics
+        self._requests = 0
+        self._drifted = 0
+
+        # connect to main unit (or use given port, e.g. for replay)
+        port = device
+        if isinstance(device, str):
+            port = serial.Serial(
+                device,
+                baudrate=baudrate,
+                bytesize=serial.EIGHTBITS,
+                parity=serial.PARITY_ODD,
+                stopbits=serial.STOPBITS_ONE,
+                xonxoff=False,
+                rtscts=False,
+                dsrdtr=False,
+                timeout=timeout,
+                write_timeout=timeout)
+        self._serial = trace.Tap(port)
+
+        # must stay at ground (only wired for the primary unit, pigpio's
+        # write also switches the pin to an output)
+        if on_signal is not None:
+            self._pi.write(on_signal, 0)
 
         # initialize communication helpers
-        self._reader = Reader(self, self._serial)
-        self._writer = Writer(self._serial)
+        self._traffic = Traffic()
+        self._reader = Reader(self, self._serial, self._traffic)
+        self._writer = Writer(self._serial, self._traffic)
 
         # build list of supported commands
         self._handlers = {
@@ -277,15 +348,50 @@ class Controller(ConsumingComponent):
             Commands.SelectInput: self._select_input,
             Commands.SelectEffect: self._select_effect,
             Commands.RequestState: self._request_state,
+            Commands.ApplyPreset: self._apply_preset,
+        }
+
+    @property
+    def workers(self):
+        return [self._reader]
+
+    @property
+    def cap(self):
+        """ Master volume cap (or None) """
+        return self._state.cap
+
+    @cap.setter
+    def cap(self, cap):
+        self._state.cap = cap
+
+    @property
+    def traffic(self):
+        return self._traffic
+
+    @property
+    def statistics(self):
+        return {
+            'shaping': self._shaper.statistics,
+            'validation': self._validator.statistics,
+            'reconciliation': {
+                'requests': self._requests,
+                'drifted': self._drifted,
+            },
         }
 
     def _execute(self, command, *params, **kwargs):
-        if command in self._handlers:
-            self._handlers[command](*params, **kwargs)
+        if command not in self._handlers:
+            return
+
+        if not self._shaper.admit(command):
+            logging.debug('dropped %s', command)
+            return
+
+        self._handlers[command](*params, **kwargs)
 
     def _turn_on(self):
         self._reader.start()
-        self._state._stage = Stage.Booting
+        self._state.change('stage', Stage.Booting)
         self._writer.write(Writer.on)
 
     def _turn_off(self):
@@ -315,11 +421,66 @@ class Controller(ConsumingComponent):
             input = self._state.input
         self._writer.write(Writer.select_effect, effect=effect, input=input)
 
+        # effects are not echoed
+        self._writer.write(Writer.request_state)
+
     def _request_state(self):
-        pass
+        if not self._state.powered:
+            return
+
+        self._requests += 1
+        self._writer.write(Writer.request_state)
+
+    def _compile_preset(self, preset):
+        """ Compile preset into the shortest serial sequence """
+
+        (volumes, input, effects) = preset.resolve(self._state)
+        for speakers, volume in volumes.items():
+            limit = self._state.limit(speakers)
+            volumes[speakers] = min(max(volume, 0), limit)
+        frame = Writer.set_state(volumes, input, effects)
+
+        # effects of inactive inputs can only be set by a state frame
+        changed = [
+            other for other, effect in effects.items()
+            if effect != self._state.effects.get(other)]
+        if any(other != input for other in changed):
+            return frame
+
+        # otherwise use single steps if they are shorter
+        steps = []
+        for speakers, volume in volumes.items():
+            if speakers not in Mappings.VolumeUp:
+                continue
+            delta = volume - int(self._state.volumes.get(speakers, volume))
+            if delta > 0:
+                steps.append(Writer.volume_up(speakers) * delta)
+            if delta < 0:
+                steps.append(Writer.volume_down(speakers) * -delta)
+        if input != self._state.input or changed:
+            steps.append(Writer.select_input(
+                input, effects.get(input, Effect.Dolby)))
+
+        sequence = b''.join(steps)
+        if len(sequence) < len(frame):
+            return sequence
+        return frame
+
+    def _apply_preset(self, preset):
+        data = self._compile_preset(preset)
+        if not data:
+            return
+
+        logging.debug(
+            'applying preset %s (%d bytes)', preset.name, len(data))
+        self._writer.write(Writer.raw, data=data)
+
+        # state frames are not echoed
+        if data[0] == 0xaa:
+            self._writer.write(Writer.request_state)
 
     def _notify_on(self):
-        self._state._stage = Stage.Booted
+        self._state.change('stage', Stage.Booted)
         self._state._event.set()
 
         # request initial state
@@ -327,31 +488,64 @@ class Controller(ConsumingComponent):
 
     def _notify_off(self):
         self._reader.stop()
-        self._state._stage = Stage.Off
+        self._state.change('stage', Stage.Off)
         self._state._event.set()
 
     def _notify_volume_up(self, speakers):
-        self._state._volumes[speakers] += 1
+        volume = self._state.volumes[speakers]
+        self._state.change(('volume', speakers), volume + 1)
         self._state._event.set()
 
     def _notify_volume_down(self, speakers):
-        self._state._volumes[speakers] -= 1
+        volume = self._state.volumes[speakers]
+        self._state.change(('volume', speakers), volume - 1)
         self._state._event.set()
 
     def _notify_input_selected(self, input):
-        self._state._input = input
+        self._state.change('input', input)
         self._state._event.set()
 
+    def _drift(self, volumes, input, effects):
+        """ Fields of the local state that differ from the device """
+
+        # changes of pending commands are confirmed by state frames only
+        pending = self._state.pending
+
+        drift = [
+            speakers.name for speakers, volume in volumes.items()
+            if int(self._state.volumes.get(speakers, -1)) != volume and
+            ('volume', speakers) not in pending]
+        if input != self._state.input and 'input' not in pending:
+            drift.append('input')
+        drift.extend(
+            other.name for other, effect in effects.items()
+            if self._state.effects.get(other) != effect and
+            ('effect', other) not in pending)
+        return drift
+
     def _notify_state(self, volumes, input, effects):
-        self._state._stage = Stage.Ready
-        self._state._volumes = volumes
-        self._state._input = input
-        self._state._effects = effects
+
+        # reconcile local state (only once initialized)
+        if self._state.ready:
+            drift = self._drift(volumes, input, effects)
+            if drift:
+                self._drifted += 1
+                logging.warning('state drifted: %s', ', '.join(drift))
+
+        for speakers, volume in volumes.items():
+            self._state.change(('volume', speakers), volume)
+        for other, effect in effects.items():
+            self._state.change(('effect', other), effect)
+        self._state.change('input', input)
+        self._state.change('stage', Stage.Ready)
         self._state._event.set()
 
     def consume(self):
         """ Execute all commands from queue """
 
+        batch = []
         while not self._queue.drained:
-            (command, params, kwargs) = self._queue.dequeue()
+            batch.append(self._queue.dequeue())
+
+        for (command, params, kwargs) in self._validator.filter(batch):
             self._execute(command, *params, **kwargs)
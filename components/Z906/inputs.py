@@ -1,8 +1,11 @@
 from core.component import PollingComponent
-from core.types import Commands, Stage, Input
+from core.buttons import Buttons
+from core.types import Commands, Stage, Input, Effect, Speakers
 from core import pins
+from core import trace
 
 import logging
+import struct
 import pigpio
 import board
 import busio
@@ -12,46 +15,36 @@ import adafruit_ads1x15.ads1015 as ADS
 from adafruit_ads1x15.analog_in import AnalogIn
 
 
-class AnalogButton:
-    """ Handles a single button """
-
-    def __init__(self, levels, command, limit=2):
-        self._levels = levels
-        self._command = command
-        self._limit = limit
-        self._counter = 0
-
-    def probe(self, voltage, parent):
-        """ Probe button and execute """
-
-        # check if pressed
-        toggled = self._levels[0] < voltage < self._levels[1]
-
-        # flood bin (press)
-        if toggled and self._counter < self._limit:
-            self._counter += 1
-            if self._counter == self._limit:
-                self._command(parent)
-
-        # drain bin (release)
-        elif not toggled and self._counter > 0:
-            self._counter -= 1
-
-
 class Inputs(PollingComponent):
     """ Handles the inputs """
 
-    AnalogButtons = [
-        AnalogButton((0.150, 0.170), (lambda self: self._toggle_input())),
-        AnalogButton((1.320, 1.380), (lambda self: self._toggle_mute())),
-        AnalogButton((1.895, 1.955), (lambda self: self._toggle_speakers())),
-        AnalogButton((2.495, 2.555), (lambda self: self._toggle_effect())),
-    ]
-
-    def __init__(self, pi, state, queue):
-        super().__init__(pi, state, queue)
+    # sampling intervals (fast while a button is held)
+    ActiveInterval = 0.02
+    IdleInterval = 0.2
+
+    # analog button actions (short press, long press)
+    Actions = {
+        'input': (
+            (lambda self: self._toggle_input()),
+            (lambda self: self._cycle_preset())),
+        'mute': ((lambda self: self._toggle_mute()), None),
+        'speakers': ((lambda self: self._toggle_speakers()), None),
+        'effect': ((lambda self: self._toggle_effect()), None),
+    }
+
+    # buttons without long press action that repeat while held
+    Repeating = ('effect',)
+
+    # milliseconds of GPIO debouncing
+    Debounce = {'power': 200, 'rotary': 20}
+
+    def __init__(self, pi, state, queue, buttons=None, presets=None,
+                 debounce=None):
+        super().__init__(pi, state, queue, Inputs.IdleInterval)
         self.callbacks = {}
         self.levels = {}
+        self._setup_buttons(buttons, presets)
+        debounce = {**Inputs.Debounce, **(debounce or {})}
 
         # analog inputs
         self.i2c = busio.I2C(board.SCL, board.SDA)
@@ -63,7 +56,7 @@ class Inputs(PollingComponent):
         gpio.add_event_detect(
             pins.ON_BUTTON, gpio.RISING,
             callback=self._toggle_power,
-            bouncetime=200)
+            bouncetime=debounce['power'])
 
         # analog (multiplexed) buttons
         self.buttons = AnalogIn(self.ads, ADS.P0)
@@ -75,7 +68,22 @@ class Inputs(PollingComponent):
             gpio.add_event_detect(
                 button, gpio.BOTH,
                 callback=self._rotary,
-                bouncetime=20)
+                bouncetime=debounce['rotary'])
+
+    def close(self):
+        """ Release the GPIO callbacks and the I2C bus (e.g. before being
+            replaced) """
+
+        for pin in (pins.ON_BUTTON, pins.POTI_1, pins.POTI_2):
+            gpio.remove_event_detect(pin)
+        self.i2c.deinit()
+
+    def _setup_buttons(self, buttons=None, presets=None):
+        """ Button classification (without hardware) """
+
+        self._buttons = buttons or Buttons()
+        self._presets = presets
+        self._preset = None
 
     def _toggle_power(self, channel):
         logging.info('pressed: power button')
@@ -85,25 +93,82 @@ class Inputs(PollingComponent):
             self.command(Commands.TurnOn)
 
     def _toggle_input(self):
-        input = Input.toggle(self._state.input)
+        input = Input.toggle(self._state.predicted.input)
         self.command(Commands.SelectInput, input)
 
     def _toggle_mute(self):
-        if self._state.mute:
+        if self._state.predicted.mute:
             self.command(Commands.Unmute)
         else:
             self.command(Commands.Mute)
 
     def _toggle_speakers(self):
-        pass
+        """ Select the speakers adjusted by the rotary encoder """
+
+        if not self._state.ready:
+            return
+
+        # skip speakers without separate volume
+        speakers = Speakers.toggle(self._state.speakers)
+        while speakers not in self._state.volumes:
+            speakers = Speakers.toggle(speakers)
+        self._state.change('speakers', Speakers(speakers), type(self).__name__)
+        self._state._event.set()
 
     def _toggle_effect(self):
-        pass
+        if not self._state.ready:
+            return
+
+        effect = Effect.toggle(self._state.predicted.effect)
+        self.command(Commands.SelectEffect, Effect(effect))
+
+    def _cycle_preset(self):
+        """ Apply the next stored preset """
+
+        if self._presets is None or not self._state.ready:
+            return
+
+        preset = self._presets.following(self._preset)
+        if preset is not None:
+            self._preset = preset.name
+            logging.info('applying preset %s', preset.name)
+            self.command(Commands.ApplyPreset, preset)
+
+    def _handle(self, event, name, held):
+        """ Execute button actions """
+
+        (press, long) = Inputs.Actions[name]
+        if long is not None and self._presets is None:
+            long = None
+
+        if event == 'press':
+            logging.info('pressed: %s button', name)
+
+            # short press is only known on release if there is a long press
+            if long is None:
+                press(self)
+        elif event == 'release':
+            if long is not None and not held:
+                press(self)
+        elif event == 'hold':
+            if long is not None:
+                long(self)
+            elif name in Inputs.Repeating:
+                press(self)
+        elif event == 'repeat':
+            if long is None and name in Inputs.Repeating:
+                press(self)
 
     def _rotary(self, channel):
         """ Rotary encoder ticked """
+        self._tick(channel, gpio.input(channel))
+
+    def _tick(self, channel, level):
+        """ Handle rotary encoder edge """
 
-        self.levels[channel] = gpio.input(channel)
+        trace.record(trace.Kind.Rotary, struct.pack('<BB', channel, level))
+
+        self.levels[channel] = level
         if all(self.levels.values()):
             if channel == pins.POTI_1:
                 self.command(Commands.VolumeUp)
@@ -115,8 +180,12 @@ class Inputs(PollingComponent):
 
         # read voltage and identify pressed buttons
         voltage = self.buttons.voltage
-        for button in Inputs.AnalogButtons:
-            button.probe(voltage, self)
+        trace.record(trace.Kind.Voltage, struct.pack('<f', voltage))
+        for (event, name, held) in self._buttons.sample(voltage):
+            self._handle(event, name, held)
 
         if voltage < 3.0:
-            logging.debug(f'input: {voltage}')
+            logging.debug('input: %.3f', voltage)
+            self.interval = Inputs.ActiveInterval
+        else:
+            self.interval = Inputs.IdleInterval
@@ -1,9 +1,13 @@
 from core.component import Component
-from core.types import Commands, Stage, Input
+from core.config import Config
+from core.types import Commands, Stage, Input, Effect
 from core.service import Worker
+from core import trace
+from components.timers import Timers
 
 import evdev
 import logging
+import struct
 import time
 
 
@@ -33,28 +37,67 @@ class LircCommand:
 class Lirc(Component, Worker):
     """ Handles the IR controller """
 
-    def __init__(self, pi, state, queue):
+    def __init__(self, pi, state, queue, presets=None, device=None,
+                 codes=None):
         Component.__init__(self, pi, state, queue)
-        Worker.__init__(self, self._loop, "IR thread")
-
-        # known command list
-        self._commands = {
-            172160: LircCommand(self._toggle_power, 2.0),
-            172040: LircCommand(self._toggle_input, 0.25),
-            172266: LircCommand(self._toggle_mute, 0.25),
-            172042: LircCommand(self._toggle_level, 0.25),
-            172046: LircCommand(self._toggle_effect, 0.25),
-            172202: LircCommand(self._volume_up, 0.1, repeatable=True),
-            172138: LircCommand(self._volume_down, 0.1, repeatable=True),
+        Worker.__init__(self, self._loop, "IR thread", critical=True)
+
+        self._presets = presets
+        self._actions = {
+            'power': self._toggle_power,
+            'input': self._toggle_input,
+            'mute': self._toggle_mute,
+            'level': self._toggle_level,
+            'effect': self._toggle_effect,
+            'volume_up': self._volume_up,
+            'volume_down': self._volume_down,
         }
+        self.configure(Config().ir if codes is None else codes)
 
-        # connect to LIRC
-        self._lirc = evdev.InputDevice('/dev/input/event1')
+        # presets stored at runtime may bind new codes
+        if presets is not None:
+            presets.listen(self._rebind)
+
+        # connect to LIRC (or use given device, e.g. for replay)
+        self._lirc = device
+        if device is None or isinstance(device, str):
+            self._lirc = evdev.InputDevice(device or '/dev/input/event1')
         logging.info(self._lirc)
 
         # start event loop
         self.start()
 
+    @property
+    def workers(self):
+        return [self]
+
+    def configure(self, codes):
+        """ Bind IR codes (code -> (action, delay, repeatable)) """
+
+        self._codes = codes
+        commands = {
+            code: LircCommand(self._actions[action], delay, repeatable)
+            for code, (action, delay, repeatable) in codes.items()
+        }
+
+        # presets may be bound to (otherwise unused) IR codes
+        if self._presets is not None:
+            for name, preset in self._presets.items():
+                if preset.ir is None:
+                    continue
+                if preset.ir in commands:
+                    logging.warning(
+                        f'IR code {preset.ir} of preset {name} is already bound')
+                    continue
+                commands[preset.ir] = LircCommand(
+                    (lambda preset=preset: self._apply_preset(preset)), 0.5)
+
+        # swapped at once (dispatched from the IR thread)
+        self._commands = commands
+
+    def _rebind(self):
+        self.configure(self._codes)
+
     def _toggle_power(self):
         if self._state.stage == Stage.Ready:
             self.command(Commands.TurnOff)
@@ -62,20 +105,32 @@ class Lirc(Component, Worker):
             self.command(Commands.TurnOn)
 
     def _toggle_input(self):
-        input = Input.toggle(self._state.input)
+        input = Input.toggle(self._state.predicted.input)
         self.command(Commands.SelectInput, input)
 
     def _toggle_mute(self):
-        if self._state.mute:
+        if self._state.predicted.mute:
             self.command(Commands.Unmute)
         else:
             self.command(Commands.Mute)
 
     def _toggle_level(self):
-        pass
+        """ Step through sleep timers """
+
+        timers = None
+        if self._service is not None:
+            timers = self._service.find(Timers)
+        if timers is not None and self._state.stage == Stage.Ready:
+            timers.toggle_sleep()
 
     def _toggle_effect(self):
-        pass
+        if self._state.stage == Stage.Ready:
+            effect = Effect.toggle(self._state.predicted.effect)
+            self.command(Commands.SelectEffect, Effect(effect))
+
+    def _apply_preset(self, preset):
+        if self._state.stage == Stage.Ready:
+            self.command(Commands.ApplyPreset, preset)
 
     def _volume_up(self):
         if self._state.stage == Stage.Ready:
@@ -89,15 +144,24 @@ class Lirc(Component, Worker):
         """ Check for IR commands and forward them """
 
         while cycle == worker.cycle:
+            worker.heartbeat()
+
             event = self._lirc.read_one()
             if event is None:
-                time.sleep(0.1)
+                worker.token.wait(0.1)
                 continue
 
-            # map received command
-            logging.info(f'received IR command: {event.value}')
-            command = self._commands.get(event.value)
+            self._dispatch(event.value)
+
+    def _dispatch(self, value):
+        """ Execute received IR command """
+
+        trace.record(trace.Kind.Ir, struct.pack('<I', value))
+
+        # map received command
+        logging.debug('received IR command: %s', value)
+        command = self._commands.get(value)
 
-            # execute received command
-            if command is not None:
-                command.execute()
\ No newline at end of file
+        # execute received command
+        if command is not None:
+            command.execute()
@@ -1,6 +1,7 @@
 from core.component import Component
 from core.types import Input, Effect, Speakers, Stage
 from core import pins
+from . import animations
 
 import pigpio
 import copy
@@ -59,6 +60,9 @@ class Panel(Component):
         pins.Q13,
     ]
 
+    # duration of a single row (microseconds)
+    Slot = 1500
+
     Cols = [
         pins.Q1,
         pins.Q2,
@@ -74,106 +78,240 @@ class Panel(Component):
         super().__init__(pi, state, queue)
 
         # references to the waves
-        self._wave = None
-        self._old = None
+        self._waves = []
+        self._old = []
+        self._chained = False
+        self._playing = None
+        self._volume = None
 
-        # prepare power LED
-        pi.set_mode(pins.Q4, pigpio.OUTPUT)
+        # global brightness (e.g. night mode)
+        self._brightness = 1.0
 
-        # reset any previous states
-        pi.wave_tx_stop()
-        pi.write(pins.Q4, 0)
+        # statistics of the current wave
+        self._pulses = 0
+        self._cbs = 0
 
-        # prepare all cols (+)
+        # prepare all cols (+) and rows (-)
         self.all_cols_mask = 0
         for col in Panel.Cols:
             self.all_cols_mask |= 1 << col
-            pi.set_mode(col, pigpio.OUTPUT)
-            pi.write(col, 0)
-
-        # prepare all rows (-)
         self.all_rows_mask = 0
         for row in Panel.Rows:
             self.all_rows_mask |= 1 << row
-            pi.set_mode(row, pigpio.OUTPUT)
-            pi.write(row, 1)
+
+        # levels of a dark matrix
+        self._dark = {
+            **dict.fromkeys(Panel.Cols, 0),
+            **dict.fromkeys(Panel.Rows, 1),
+        }
+
+        # reset any previous states (including power LED)
+        pi.wave_tx_stop()
+        pi.outputs({pins.Q4: 0, **self._dark}, pigpio.OUTPUT)
+
+    @property
+    def brightness(self):
+        return self._brightness
+
+    @brightness.setter
+    def brightness(self, brightness):
+        self._brightness = max(0.0, min(float(brightness), 1.0))
+
+        # redraw
+        self._state._event.set()
+
+    @property
+    def statistics(self):
+        return {
+            'pulses': self._pulses,
+            'control_blocks': self._cbs,
+            'brightness': self._brightness,
+            'gpio': self._pi.statistics,
+        }
 
     def _write_all_low(self):
-        """ Power down all LEDs """
+        """ Power down all LEDs (including power LED) """
 
         self._pi.wave_tx_stop()
-        for col in Panel.Cols:
-            self._pi.write(col, 0)
-        for row in Panel.Rows:
-            self._pi.write(row, 1)
-
-    def row_mask(self, row, state):
-        """ Generate the LED bitmask (on) for the given row """
+        self._pi.write_bank({pins.Q4: 0, **self._dark})
 
-        mask = self.all_rows_mask & ~(1 << row)
-        factor = None
-        dim = 0
+    def row_levels(self, row, state, overrides=None):
+        """ Brightness (0.0 - 1.0) of every LED in the given row """
 
+        levels = {}
         for col, func in Panel.Leds[row].items():
-            value = func(state)
+            if overrides and (row, col) in overrides:
+                func = overrides[(row, col)]
+            value = func(state) if callable(func) else func
 
             # non-dimmable LED
-            if value is False:
+            if value is False or value is True:
+                levels[col] = float(value)
                 continue
-            if value is True:
-                mask |= 1 << col
+
+            # dimmable LED (perceived brightness is roughly quadratic)
+            if value < 0.01:
+                levels[col] = 0.0
+            elif value > 0.99:
+                levels[col] = 1.0
+            else:
+                levels[col] = value * value
+
+        return levels
+
+    def row_pulses(self, row, levels):
+        """ Generate the pulses of a row slot from sorted switch-off edges """
+
+        select = self.all_rows_mask & ~(1 << row)
+        edges = {}
+        lit = 0
+
+        for col, level in levels.items():
+            duration = int(Panel.Slot * level * self._brightness)
+            if duration <= 0:
                 continue
+            lit |= 1 << col
+            if duration < Panel.Slot:
+                edges[duration] = edges.get(duration, 0) | 1 << col
 
-            # dimmable LED
-            if value >= 0.01:
-                mask |= 1 << col
+        # light all LEDs, then switch them off at their edges
+        turn_on = select | lit
+        turn_off = ~turn_on & (self.all_rows_mask | self.all_cols_mask)
+        pulses = []
+        start = 0
+        for edge in sorted(edges):
+            pulses.append((turn_on, turn_off, edge - start))
+            (turn_on, turn_off) = (0, edges[edge])
+            start = edge
+        pulses.append((turn_on, turn_off, Panel.Slot - start))
+        return pulses
 
-                if value <= 0.99:
-                    dim = 1 << col
-                    factor = value * value
+    @staticmethod
+    def merge(pulses):
+        """ Merge adjacent pulses with identical masks """
 
-        return (mask, dim, factor)
+        merged = []
+        for (on, off, delay) in pulses:
+            if merged and merged[-1][0] == on and merged[-1][1] == off:
+                merged[-1] = (on, off, merged[-1][2] + delay)
+            else:
+                merged.append((on, off, delay))
+        return merged
 
-    def create_wave(self, state):
+    def create_wave(self, state, overrides=None):
         """ Create wave for LED multiplexing """
 
         pulses = []
         for row in Panel.Rows:
-            (turn_on, dim_off, factor) = self.row_mask(row, state)
-            turn_off = ~turn_on & (self.all_rows_mask | self.all_cols_mask)
+            levels = self.row_levels(row, state, overrides)
+            pulses.extend(self.row_pulses(row, levels))
+        pulses = Panel.merge(pulses)
 
-            if factor is None:
-                # no dimmed LEDs
-                pulses.append(pigpio.pulse(turn_on, turn_off, 1500))
-            else:
-                # single dimmed LED
-                pulses.extend([
-                    pigpio.pulse(turn_on, turn_off, int(1500 * factor)),
-                    pigpio.pulse(0, dim_off, int(1500 * (1.0 - factor)))
-                ])
+        self._pi.wave_add_generic([
+            pigpio.pulse(on, off, delay) for (on, off, delay) in pulses])
+        wave = self._pi.wave_create()
+
+        # wave statistics (pigpio uses a control block per level change
+        # and per delay, counted here to save the wave_get_cbs round trip)
+        self._pulses = len(pulses)
+        self._cbs = sum(
+            bool(on) + bool(off) + bool(delay) for (on, off, delay) in pulses)
+        return wave
+
+    def chain(self, animation, frames, static=None):
+        """ Build the wave chain that plays an animation """
+
+        # a frame wave shows all rows once
+        cycle = Panel.Slot * len(Panel.Rows)
+
+        body = []
+        for frame, wave in zip(animation.frames, frames):
+            repeats = max(1, min(round(frame.duration * 1e6 / cycle), 0xffff))
+            body += [255, 0, wave, 255, 1, repeats & 0xff, repeats >> 8]
+
+        if animation.forever:
+            return [255, 0] + body + [255, 3]
+
+        # return to the static state afterwards
+        repeat = animation.repeat
+        return [255, 0] + body + [255, 1, repeat & 0xff, repeat >> 8] + \
+            [255, 0, static, 255, 3]
+
+    def animation(self, state):
+        """ Animation to play for the given state (or None) """
+
+        volume = self._volume
+        self._volume = state.volume
 
-        self._pi.wave_add_generic(pulses)
-        return self._pi.wave_create()
+        if state.mute:
+            return animations.Blink
+        if volume is not None and volume != state.volume:
+            if state.volume in (0, state.max_volume):
+                return animations.Flash
+
+    def _replace(self, waves):
+        """ Delete current waves with the next update """
+
+        self._old = self._waves
+        self._waves = waves
+
+    def _show(self, state, animation=None):
+        """ Show static state, optionally after or within an animation """
+
+        # stateless animations keep running untouched
+        if animation is not None and animation.stateless and \
+                self._playing == animation.name:
+            return
+
+        if animation is None:
+            wave = self.create_wave(state)
+            if self._chained:
+                self._pi.wave_tx_stop()
+            self._pi.wave_send_repeat(wave)
+            self._replace([wave])
+            self._chained = False
+            self._playing = None
+            return
+
+        # precompute all frames, the DMA engine plays them
+        frames = [
+            self.create_wave(state, frame.leds)
+            for frame in animation.frames]
+        static = [] if animation.forever else [self.create_wave(state)]
+        chain = self.chain(animation, frames, *static)
+
+        self._pi.wave_tx_stop()
+        self._pi.wave_chain(chain)
+        self._replace(static + frames)
+        self._chained = True
+        self._playing = animation.name if animation.forever else None
 
     def update(self):
         """ Update the panel to display given state """
 
-        if self._old:
-            # delete wave from last update cycle
-            self._pi.wave_delete(self._old)
-            self._old = None
+        # delete waves from last update cycle
+        for wave in self._old:
+            self._pi.wave_delete(wave)
+        self._old = []
 
-        # show power state
-        self._pi.write(pins.Q4, self._state.powered)
+        # show power state (part of the bank write when powering down)
+        if self._state.powered or not self._waves:
+            self._pi.write(pins.Q4, self._state.powered)
+
+        state = self._state.predicted
 
         # update wave
         if self._state.ready:
-            self._old = self._wave
-            self._wave = self.create_wave(self._state)
-            self._pi.wave_send_repeat(self._wave)
+            self._show(state, self.animation(state))
+
+        # main unit is booting
+        elif self._state.powered:
+            self._show(state, animations.Spinner)
 
         # power down
-        elif self._wave:
+        elif self._waves:
             self._write_all_low()
-            self._old = self._wave
-            self._wave = None
+            self._replace([])
+            self._chained = False
+            self._playing = None
+            self._volume = None
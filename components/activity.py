@@ -0,0 +1,139 @@
+from core.component import Component
+from core.service import Worker
+from core.types import Commands, Stage
+
+import errno
+import logging
+import os
+import select
+import time
+
+
+class Activity(Component, Worker):
+    """ Powers the device by audio activity (e.g. librespot events) """
+
+    # events written to the FIFO (one per line, librespot names)
+    Playing = ('playing', 'started')
+    Preparing = ('preparing', 'loading', 'session_connected')
+    Stopped = ('stopped', 'paused', 'session_disconnected')
+
+    def __init__(self, pi, state, queue, path='/tmp/z906.activity',
+                 idle=600.0, prewarm=True):
+        Component.__init__(self, pi, state, queue)
+        Worker.__init__(self, self._loop, f'activity thread ({path})')
+
+        self._path = path
+        self._idle = idle
+        self._prewarm = prewarm
+
+        # power off deadline (monotonic, None while playing)
+        self._deadline = None
+        self._playing = False
+        self._events = {}
+
+        # start event loop
+        self.start()
+
+    @property
+    def workers(self):
+        return [self]
+
+    @property
+    def statistics(self):
+        return {
+            'playing': self._playing,
+            'events': dict(self._events),
+            'idle': None if self._deadline is None
+            else max(self._deadline - time.monotonic(), 0),
+        }
+
+    def _open(self):
+        """ Open the FIFO without blocking on missing writers """
+
+        try:
+            os.mkfifo(self._path)
+        except FileExistsError:
+            pass
+
+        reader = os.open(self._path, os.O_RDONLY | os.O_NONBLOCK)
+
+        # keep a writer open, otherwise closed writers make it readable forever
+        writer = os.open(self._path, os.O_WRONLY | os.O_NONBLOCK)
+        return (reader, writer)
+
+    def _loop(self, cycle, worker):
+        """ Reads events and powers off when idle """
+
+        (reader, writer) = self._open()
+        (wakeup, waker) = os.pipe()
+        worker.token.on_cancel(lambda: os.write(waker, b'\x00'))
+
+        buffer = b''
+        try:
+            while cycle == worker.cycle:
+                worker.heartbeat()
+
+                timeout = 1.0
+                if self._deadline is not None:
+                    timeout = min(max(self._deadline - time.monotonic(), 0), 1.0)
+
+                (readable, _, _) = select.select([reader, wakeup], [], [], timeout)
+                if reader in readable:
+                    try:
+                        buffer += os.read(reader, 4096)
+                    except OSError as e:
+                        if e.errno != errno.EAGAIN:
+                            raise
+
+                    *lines, buffer = buffer.split(b'\n')
+                    for line in lines:
+                        self.event(line.decode(errors='replace').strip())
+
+                self._check()
+
+        finally:
+            for fd in (reader, writer, wakeup, waker):
+                os.close(fd)
+
+    def event(self, name):
+        """ Handle a single activity event """
+
+        if not name:
+            return
+        self._events[name] = self._events.get(name, 0) + 1
+
+        if name in Activity.Playing:
+            self._playing = True
+            self._deadline = None
+            self._power_on()
+
+        elif name in Activity.Preparing:
+            if self._prewarm and not self._playing:
+                self._power_on()
+
+                # warm up only, power off again if nothing plays
+                self._deadline = time.monotonic() + self._idle
+
+        elif name in Activity.Stopped:
+            self._playing = False
+            self._deadline = time.monotonic() + self._idle
+
+        else:
+            logging.debug('unknown activity event %s', name)
+
+    def _power_on(self):
+        if self._state.stage == Stage.Off:
+            logging.info('activity powers on')
+            self.command(Commands.TurnOn)
+
+    def _check(self):
+        """ Power off after the idle timeout """
+
+        deadline = self._deadline
+        if deadline is None or time.monotonic() < deadline:
+            return
+
+        self._deadline = None
+        if self._state.stage == Stage.Ready:
+            logging.info(f'idle for {self._idle} seconds, powering off')
+            self.command(Commands.TurnOff)
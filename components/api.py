@@ -1,6 +1,17 @@
 from core.component import Component
-from core.types import Commands, Stage, Input
+from core import trace
+from core.history import History
+from core.presets import Preset
+from core.schedules import Schedule
+from core.types import Commands, Stage, Input, Speakers
+from components.group import Group
+from components.ramp import Ramps
+from components.timers import Timers
+from components.Z906.controller import Controller
+from components.Z906.panel import Panel
 
+import datetime
+import json
 import logging
 import flask
 
@@ -8,14 +19,48 @@ import flask
 class Api(Component):
     app = None
 
-    def __init__(self, pi, state, queue, app):
+    def __init__(self, pi, state, queue, app, units=None, presets=None,
+                 schedules=None, buttons=None, reload=None):
         super().__init__(pi, state, queue)
+        self._units = units
+        self._presets = presets
+        self._schedules = schedules
+        self._buttons = buttons
+        self._reload = reload
 
         # register all known endpoints
-        app.add_url_rule("/state", view_func=self._get_state, methods=['GET'])
-        app.add_url_rule("/command", view_func=self._post_command, methods=['POST'])
-        app.add_url_rule("/power", view_func=self._post_power, methods=['POST'])
-        app.add_url_rule("/input", view_func=self._post_input, methods=['POST'])
+        self._route(app, "/state", self._get_state, ['GET'])
+        self._route(app, "/health", self._get_health, ['GET'])
+        self._route(app, "/command", self._post_command, ['POST'])
+        self._route(app, "/power", self._post_power, ['POST'])
+        self._route(app, "/input", self._post_input, ['POST'])
+        self._route(app, "/preset", self._post_preset, ['POST'])
+        self._route(app, "/traffic", self._get_traffic, ['GET'])
+        self._route(app, "/history", self._get_history, ['GET'])
+        self._route(app, "/brightness", self._post_brightness, ['POST'])
+        self._route(app, "/ramp", self._get_ramp, ['GET'])
+        self._route(app, "/ramp", self._post_ramp, ['POST'])
+        self._route(app, "/ramp", self._delete_ramp, ['DELETE'])
+        app.add_url_rule("/presets", view_func=self._get_presets, methods=['GET'])
+        app.add_url_rule("/presets/<name>", view_func=self._put_preset, methods=['PUT'])
+        app.add_url_rule("/presets/<name>", view_func=self._delete_preset, methods=['DELETE'])
+        self._route(app, "/sleep", self._get_sleep, ['GET'])
+        self._route(app, "/sleep", self._post_sleep, ['POST'])
+        self._route(app, "/sleep", self._delete_sleep, ['DELETE'])
+        app.add_url_rule("/schedules", view_func=self._get_schedules, methods=['GET'])
+        app.add_url_rule("/schedules/<name>", view_func=self._put_schedule, methods=['PUT'])
+        app.add_url_rule("/schedules/<name>", view_func=self._delete_schedule, methods=['DELETE'])
+        app.add_url_rule("/buttons", view_func=self._get_buttons, methods=['GET'])
+        app.add_url_rule("/buttons/calibrate", view_func=self._post_calibrate, methods=['POST'])
+        app.add_url_rule("/buttons/calibrate", view_func=self._delete_calibrate, methods=['DELETE'])
+        app.add_url_rule("/devices", view_func=self._get_devices, methods=['GET'])
+        app.add_url_rule("/group", view_func=self._get_group, methods=['GET'])
+        app.add_url_rule("/group/command", view_func=self._post_group_command, methods=['POST'])
+        app.add_url_rule("/group/preset", view_func=self._post_group_preset, methods=['POST'])
+        app.add_url_rule("/config/reload", view_func=self._post_reload, methods=['POST'])
+        app.add_url_rule("/trace", view_func=self._post_trace, methods=['POST'])
+        app.add_url_rule("/trace", view_func=self._delete_trace, methods=['DELETE'])
+        app.before_request(self._trace_request)
 
         # register known commands
         self._commands = {
@@ -27,43 +72,470 @@ class Api(Component):
             'volume-down': Commands.VolumeDown,
         }
 
-    def _get_state(self):
+    @staticmethod
+    def _route(app, rule, view_func, methods):
+        """ Register endpoint for the default and for addressed devices """
+
+        app.add_url_rule(rule, view_func=view_func, methods=methods)
+        app.add_url_rule(
+            "/devices/<device>" + rule,
+            endpoint=f'device_{view_func.__name__}',
+            view_func=view_func,
+            methods=methods)
+
+    def _unit(self, device):
+        """ Resolve the service of the addressed device """
+
+        if self._units is None:
+            return self._service if device is None else None
+        return self._units.get(device)
+
+    def _trace_request(self):
+        """ Record API calls while tracing """
+
+        if trace.active() is None:
+            return
+
+        # never fail the request that is observed
+        try:
+            trace.record(trace.Kind.Api, json.dumps({
+                'method': flask.request.method,
+                'path': flask.request.path,
+                'body': flask.request.get_json(silent=True),
+            }).encode())
+        except:
+            logging.exception('failed to trace request')
+
+    def _post_trace(self):
+        """ Start recording a trace """
+
+        try:
+            data = flask.request.get_json(silent=True) or {}
+            recorder = trace.start(data.get('path', 'z906.trace'))
+            return flask.jsonify({'path': recorder.path})
+
+        except:
+            logging.exception('invalid request')
+            return flask.jsonify({}), 400
+
+    def _delete_trace(self):
+        """ Stop recording a trace """
+
+        recorder = trace.stop()
+        if recorder is None:
+            return flask.jsonify({}), 404
+        return flask.jsonify({'path': recorder.path, 'records': recorder.count})
+
+    def _get_buttons(self):
+        """ Get analog button levels and pending calibration """
+
+        if self._buttons is None:
+            return flask.jsonify({}), 404
+        return flask.jsonify(self._buttons.serialize())
+
+    def _post_calibrate(self):
+        """ Learn button levels from the next presses (in the given order) """
+
+        if self._buttons is None:
+            return flask.jsonify({}), 404
+
+        try:
+            data = flask.request.get_json(silent=True) or {}
+            self._buttons.calibrate(data.get('buttons'))
+            return flask.jsonify(self._buttons.serialize())
+
+        except:
+            logging.exception('invalid request')
+            return flask.jsonify({}), 400
+
+    def _delete_calibrate(self):
+
+        if self._buttons is None:
+            return flask.jsonify({}), 404
+        self._buttons.cancel()
+        return flask.jsonify(self._buttons.serialize())
+
+    def _post_reload(self):
+        """ Reload the configuration file (serial sessions are kept) """
+
+        if self._reload is None:
+            return flask.jsonify({}), 404
+
+        try:
+            return flask.jsonify(self._reload())
+
+        except ValueError as e:
+            return flask.jsonify({'error': str(e)}), 400
+
+    def _get_devices(self):
+        """ List all hosted devices """
+
+        if self._units is None:
+            return flask.jsonify({'devices': [], 'default': None})
+
+        return flask.jsonify({
+            'devices': self._units.ids,
+            'default': self._units.default,
+        })
+
+    def _group(self):
+        service = self._unit(None)
+        if service is not None:
+            return service.find(Group)
+
+    def _get_group(self):
+        """ Aggregated state, latency and failures of group members """
+
+        group = self._group()
+        if group is None:
+            return flask.jsonify({}), 404
+        return flask.jsonify(group.serialize())
+
+    def _post_group_command(self):
+        """ Execute a command on all group members in parallel """
+
+        group = self._group()
+        if group is None:
+            return flask.jsonify({}), 404
+
+        try:
+            command = self._commands[flask.request.json['command']]
+            return flask.jsonify(group.send(command))
+
+        except:
+            logging.exception('invalid request')
+            return flask.jsonify({}), 400
+
+    def _post_group_preset(self):
+        """ Apply a stored preset on all group members """
+
+        group = self._group()
+        if group is None:
+            return flask.jsonify({}), 404
+
+        try:
+            return flask.jsonify(group.preset(flask.request.json['preset']))
+
+        except:
+            logging.exception('invalid request')
+            return flask.jsonify({}), 400
+
+    def _get_state(self, device=None):
         """ Get device state """
 
+        service = self._unit(device)
+        if service is None:
+            return flask.jsonify({}), 404
+
         return flask.jsonify({
-            'power': self._state.stage == Stage.Ready,
+            'power': service.state.stage == Stage.Ready,
+            'pending': [str(key) for key in service.state.pending],
         })
 
-    def _post_command(self):
+    def _get_health(self, device=None):
+        """ Get worker and polling health """
+
+        service = self._unit(device)
+        if service is None:
+            return flask.jsonify({}), 404
+
+        return flask.jsonify({
+            'workers': service.health,
+            'polling': service.scheduler.statistics,
+            'components': service.statistics,
+            'history': service.state.history.statistics,
+        })
+
+    def _get_traffic(self, device=None):
+        """ Get recent serial traffic (newest last) """
+
+        service = self._unit(device)
+        controller = None if service is None else service.find(Controller)
+        if controller is None:
+            return flask.jsonify({}), 404
+
+        limit = flask.request.args.get('limit', type=int)
+        return flask.jsonify(controller.traffic.entries(limit))
+
+    @staticmethod
+    def _time(value):
+        """ Parse epoch seconds or an ISO timestamp (local time) """
+
+        if value is None:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return datetime.datetime.fromisoformat(value).timestamp()
+
+    def _get_history(self, device=None):
+        """ Get recorded state changes (oldest first, paginated) """
+
+        service = self._unit(device)
+        if service is None:
+            return flask.jsonify({}), 404
+
+        try:
+            args = flask.request.args
+            field = args.get('field')
+            offset = max(args.get('offset', 0, type=int), 0)
+            limit = min(max(args.get('limit', 100, type=int), 0), 1000)
+            history = service.state.history
+            result = history.query(
+                Api._time(args.get('since')),
+                Api._time(args.get('until')),
+                None if field is None else History.parse(field),
+                offset,
+                limit)
+
+        except:
+            logging.exception('invalid request')
+            return flask.jsonify({}), 400
+
+        return flask.jsonify({
+            **result,
+            'offset': offset,
+            'limit': limit,
+            **history.statistics,
+        })
+
+    def _post_brightness(self, device=None):
+        """ Set panel brightness (0.0 - 1.0, e.g. for night mode) """
+
+        service = self._unit(device)
+        panel = None if service is None else service.find(Panel)
+        if panel is None:
+            return flask.jsonify({}), 404
+
+        try:
+            panel.brightness = flask.request.json['brightness']
+            return flask.jsonify({'brightness': panel.brightness})
+
+        except:
+            logging.exception('invalid request')
+            return flask.jsonify({}), 400
+
+    def _post_command(self, device=None):
         """ Execute arbitrary command """
+
+        service = self._unit(device)
+        if service is None:
+            return flask.jsonify({}), 404
+
         try:
             command = flask.request.json['command']
-            self.command(self._commands[command])
+            service.queue.submit(self, self._commands[command])
             return flask.jsonify({})
 
         except:
             logging.exception('invalid request')
             return flask.jsonify({}), 400
 
-    def _post_power(self):
+    def _post_power(self, device=None):
+
+        service = self._unit(device)
+        if service is None:
+            return flask.jsonify({}), 404
+
         try:
             power = flask.request.json.get('power', True)
-            if self._state.stage == Stage.Off and power:
-                self.command(Commands.TurnOn)
-            if self._state.stage == Stage.Ready and not power:
-                self.command(Commands.TurnOff)
+            if service.state.stage == Stage.Off and power:
+                service.queue.submit(self, Commands.TurnOn)
+            if service.state.stage == Stage.Ready and not power:
+                service.queue.submit(self, Commands.TurnOff)
             return flask.jsonify({})
 
         except:
             logging.exception('invalid request')
             return flask.jsonify({}), 400
 
-    def _post_input(self):
+    def _post_input(self, device=None):
+
+        service = self._unit(device)
+        if service is None:
+            return flask.jsonify({}), 404
+
         try:
             input = flask.request.json['input']
-            self.command(Commands.SelectInput, Input(input))
+            service.queue.submit(self, Commands.SelectInput, Input(input))
+            return flask.jsonify({})
+
+        except:
+            logging.exception('invalid request')
+            return flask.jsonify({}), 400
+
+    def _get_presets(self):
+        """ List stored presets """
+
+        if self._presets is None:
+            return flask.jsonify({})
+
+        return flask.jsonify({
+            name: preset.serialize()
+            for name, preset in self._presets.items()
+        })
+
+    def _put_preset(self, name):
+        """ Store preset (captures the default device if no body given) """
+
+        if self._presets is None:
+            return flask.jsonify({}), 404
+
+        try:
+            data = flask.request.get_json(silent=True)
+            if data:
+                preset = Preset.parse(name, data)
+            else:
+                preset = Preset.capture(name, self._unit(None).state)
+            self._presets.store(preset)
+            return flask.jsonify(preset.serialize())
+
+        except:
+            logging.exception('invalid request')
+            return flask.jsonify({}), 400
+
+    def _delete_preset(self, name):
+
+        if self._presets is None or not self._presets.remove(name):
+            return flask.jsonify({}), 404
+        return flask.jsonify({})
+
+    def _post_preset(self, device=None):
+        """ Apply stored preset """
+
+        service = self._unit(device)
+        if service is None or self._presets is None:
+            return flask.jsonify({}), 404
+
+        try:
+            preset = self._presets.get(flask.request.json['preset'])
+            if preset is None:
+                return flask.jsonify({}), 404
+            service.queue.submit(self, Commands.ApplyPreset, preset)
+            return flask.jsonify({})
+
+        except:
+            logging.exception('invalid request')
+            return flask.jsonify({}), 400
+
+    def _ramps(self, device):
+        service = self._unit(device)
+        if service is not None:
+            return service.find(Ramps)
+
+    def _get_ramp(self, device=None):
+        """ Get progress of running volume ramps """
+
+        ramps = self._ramps(device)
+        if ramps is None:
+            return flask.jsonify({}), 404
+        return flask.jsonify(ramps.ramps)
+
+    def _post_ramp(self, device=None):
+        """ Fade volume to target within duration (seconds) """
+
+        ramps = self._ramps(device)
+        if ramps is None:
+            return flask.jsonify({}), 404
+
+        try:
+            data = flask.request.json
+            ramp = ramps.fade(
+                data['target'],
+                float(data.get('duration', 0)),
+                Speakers[data.get('speakers', 'Master')],
+                data.get('start'))
+            return flask.jsonify(ramp.serialize())
+
+        except:
+            logging.exception('invalid request')
+            return flask.jsonify({}), 400
+
+    def _delete_ramp(self, device=None):
+
+        ramps = self._ramps(device)
+        if ramps is None:
+            return flask.jsonify({}), 404
+        ramps.abort()
+        return flask.jsonify({})
+
+    def _timers(self, device=None):
+        service = self._unit(device)
+        if service is not None:
+            return service.find(Timers)
+
+    def _get_sleep(self, device=None):
+        """ Get remaining seconds of the sleep timer """
+
+        timers = self._timers(device)
+        if timers is None:
+            return flask.jsonify({}), 404
+        return flask.jsonify({'remaining': timers.sleep_remaining})
+
+    def _post_sleep(self, device=None):
+        """ Power off after the given minutes """
+
+        timers = self._timers(device)
+        if timers is None:
+            return flask.jsonify({}), 404
+
+        try:
+            timers.sleep(float(flask.request.json['minutes']) * 60)
+            return flask.jsonify({'remaining': timers.sleep_remaining})
+
+        except:
+            logging.exception('invalid request')
+            return flask.jsonify({}), 400
+
+    def _delete_sleep(self, device=None):
+
+        timers = self._timers(device)
+        if timers is None:
+            return flask.jsonify({}), 404
+        timers.sleep(None)
+        return flask.jsonify({})
+
+    def _get_schedules(self):
+        """ List schedules with their next run """
+
+        if self._schedules is None:
             return flask.jsonify({})
 
+        timers = self._timers()
+        planned = {} if timers is None else timers.planned
+        return flask.jsonify({
+            name: {
+                **self._schedules.get(name).serialize(),
+                'next': planned.get(name),
+            }
+            for name in self._schedules.names
+        })
+
+    def _put_schedule(self, name):
+        """ Store schedule (e.g. {"at": "07:00", "action": "on"}) """
+
+        if self._schedules is None:
+            return flask.jsonify({}), 404
+
+        try:
+            schedule = Schedule.parse(name, flask.request.json)
+            self._schedules.store(schedule)
+
         except:
             logging.exception('invalid request')
             return flask.jsonify({}), 400
+
+        timers = self._timers()
+        if timers is not None:
+            timers.reload()
+        return flask.jsonify(schedule.serialize())
+
+    def _delete_schedule(self, name):
+
+        if self._schedules is None or not self._schedules.remove(name):
+            return flask.jsonify({}), 404
+
+        timers = self._timers()
+        if timers is not None:
+            timers.reload()
+        return flask.jsonify({})
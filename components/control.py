@@ -0,0 +1,492 @@
+from core.component import Component
+from core.service import Worker
+from core.types import Commands, Speakers, Input, Effect
+
+import collections
+import logging
+import os
+import selectors
+import socket
+import struct
+
+
+class Protocol:
+    """ Compact framing of the control socket
+
+        Every frame is a header (payload length, opcode) followed by the
+        payload. Requests may be pipelined, every request is answered in
+        order. Subscribed clients additionally receive state events. """
+
+    Header = struct.Struct('<BB')
+
+    # requests
+    Command = 0x01
+    Subscribe = 0x02
+    Unsubscribe = 0x03
+    State = 0x04
+    Ping = 0x05
+    Preset = 0x06
+
+    # responses and events
+    Ack = 0x81
+    Event = 0x90
+
+    # acknowledge status
+    Ok = 0
+    Unknown = 1
+    Invalid = 2
+
+    # stage, mute, input, speakers, effect, volumes (master, rear, center,
+    # sub) and number of pending predictions
+    Snapshot = struct.Struct('<10B')
+
+    # commands accepted from clients and their (minimum, maximum) number of
+    # parameters, others (e.g. ApplyPreset) are answered as invalid
+    Allowed = {
+        Commands.TurnOn: (0, 0),
+        Commands.TurnOff: (0, 0),
+        Commands.Mute: (0, 0),
+        Commands.Unmute: (0, 0),
+        Commands.VolumeUp: (0, 1),
+        Commands.VolumeDown: (0, 1),
+        Commands.SelectInput: (1, 1),
+        Commands.SelectEffect: (1, 1),
+        Commands.RequestState: (0, 0),
+    }
+
+    # parameter type of commands (a single byte)
+    Params = {
+        Commands.VolumeUp: Speakers,
+        Commands.VolumeDown: Speakers,
+        Commands.SelectInput: Input,
+        Commands.SelectEffect: Effect,
+    }
+
+    @staticmethod
+    def address(value):
+        """ TCP (host, port) of 'host:port', otherwise a socket path """
+
+        if isinstance(value, tuple) or '/' in value or ':' not in value:
+            return value
+        (host, _, port) = value.rpartition(':')
+        return (host, int(port))
+
+    @staticmethod
+    def connect(address, timeout=None):
+        """ Connected socket for a path or (host, port) """
+
+        if isinstance(address, tuple):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        else:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect(address)
+        return sock
+
+    @staticmethod
+    def frame(opcode, payload=b''):
+        return Protocol.Header.pack(len(payload), opcode) + payload
+
+    @staticmethod
+    def parse(buffer):
+        """ Split complete frames off the buffer, yields (opcode, payload) """
+
+        while len(buffer) >= Protocol.Header.size:
+            (length, opcode) = Protocol.Header.unpack_from(buffer)
+            end = Protocol.Header.size + length
+            if len(buffer) < end:
+                return
+            payload = bytes(buffer[Protocol.Header.size:end])
+            del buffer[:end]
+            yield (opcode, payload)
+
+    @staticmethod
+    def snapshot(state):
+        """ Encode the (predicted) state """
+
+        predicted = state.predicted
+        volumes = predicted.volumes
+        return Protocol.Snapshot.pack(
+            int(state.stage),
+            int(predicted.mute),
+            int(predicted.input),
+            int(state.speakers),
+            int(predicted.effect),
+            int(volumes.get(Speakers.Master, 0)),
+            int(volumes.get(Speakers.Rear, 0)),
+            int(volumes.get(Speakers.Center, 0)),
+            int(volumes.get(Speakers.Sub, 0)),
+            min(len(state.pending), 255))
+
+    @staticmethod
+    def decode(payload):
+        (stage, mute, input, speakers, effect,
+         master, rear, center, sub, pending) = Protocol.Snapshot.unpack(payload)
+        return {
+            'stage': stage,
+            'mute': bool(mute),
+            'input': input,
+            'speakers': speakers,
+            'effect': effect,
+            'volumes': {
+                Speakers.Master.name: master,
+                Speakers.Rear.name: rear,
+                Speakers.Center.name: center,
+                Speakers.Sub.name: sub,
+            },
+            'pending': pending,
+        }
+
+
+class Connection:
+    """ Buffers of a single client """
+
+    def __init__(self, sock):
+        self.socket = sock
+        self.inbox = bytearray()
+        self.outbox = bytearray()
+        self.subscribed = False
+        self.last = None
+
+
+class Control(Component, Worker):
+    """ Unix domain socket for local low-latency control (and TCP for peers) """
+
+    def __init__(self, pi, state, queue, path='/tmp/z906.sock', presets=None,
+                 listen=None):
+        Component.__init__(self, pi, state, queue)
+        Worker.__init__(self, self._serve, f'control thread ({path})')
+
+        self._path = path
+        self._presets = presets
+        self._listen_address = listen
+        self._snapshot = None
+
+        # update thread wakes the server to push state events
+        (self._waker, self._wakeup) = socket.socketpair()
+        self._waker.setblocking(False)
+        self._wakeup.setblocking(False)
+
+        self._connections = {}
+        self._requests = 0
+        self._events = 0
+
+        self._handlers = {
+            Protocol.Command: self._command,
+            Protocol.Subscribe: self._subscribe,
+            Protocol.Unsubscribe: self._unsubscribe,
+            Protocol.State: self._get_state,
+            Protocol.Ping: self._ping,
+            Protocol.Preset: self._preset,
+        }
+
+        # start event loop
+        self.start()
+
+    @property
+    def workers(self):
+        return [self]
+
+    @property
+    def statistics(self):
+        return {
+            'clients': len(self._connections),
+            'requests': self._requests,
+            'events': self._events,
+        }
+
+    def close(self):
+        self._waker.close()
+        self._wakeup.close()
+
+    def _wake(self):
+        try:
+            self._waker.send(b'\x00')
+        except (BlockingIOError, OSError):
+            pass
+
+    def update(self):
+        """ Push changed state to subscribers """
+
+        self._snapshot = Protocol.snapshot(self._state)
+        self._wake()
+
+    def _listen(self):
+        if os.path.exists(self._path):
+            os.unlink(self._path)
+
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            listener.bind(self._path)
+            listener.listen()
+        except OSError:
+            listener.close()
+            raise
+        listener.setblocking(False)
+        return listener
+
+    def _listen_tcp(self):
+        """ Listener for peer instances (e.g. a group coordinator) """
+
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            listener.bind(self._listen_address)
+            listener.listen()
+        except OSError:
+            listener.close()
+            raise
+        listener.setblocking(False)
+        return listener
+
+    def _serve(self, cycle, worker):
+        """ Serves all clients from a single thread """
+
+        worker.token.on_cancel(self._wake)
+
+        selector = selectors.DefaultSelector()
+        listeners = []
+
+        try:
+            # a failing bind (e.g. port in use) restarts without leaks
+            listeners.append(self._listen())
+            if self._listen_address is not None:
+                listeners.append(self._listen_tcp())
+            for listener in listeners:
+                selector.register(listener, selectors.EVENT_READ)
+            selector.register(self._wakeup, selectors.EVENT_READ)
+
+            while cycle == worker.cycle:
+                worker.heartbeat()
+
+                for (key, events) in selector.select(1.0):
+                    if key.fileobj in listeners:
+                        self._accept(selector, key.fileobj)
+                    elif key.fileobj is self._wakeup:
+                        self._drain()
+                        self._push(selector)
+                    else:
+                        self._handle(selector, key.data, events)
+
+        finally:
+            for connection in list(self._connections.values()):
+                self._close(selector, connection)
+            selector.close()
+            for listener in listeners:
+                listener.close()
+            if os.path.exists(self._path):
+                os.unlink(self._path)
+
+    def _accept(self, selector, listener):
+        try:
+            (sock, _) = listener.accept()
+        except BlockingIOError:
+            return
+
+        sock.setblocking(False)
+        if sock.family == socket.AF_INET:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection = Connection(sock)
+        self._connections[sock.fileno()] = connection
+        selector.register(sock, selectors.EVENT_READ, connection)
+
+    def _close(self, selector, connection):
+        self._connections.pop(connection.socket.fileno(), None)
+        selector.unregister(connection.socket)
+        connection.socket.close()
+
+    def _drain(self):
+        try:
+            while self._wakeup.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _handle(self, selector, connection, events):
+        if events & selectors.EVENT_READ:
+            try:
+                data = connection.socket.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                data = None
+            except OSError:
+                data = b''
+
+            if data == b'':
+                return self._close(selector, connection)
+
+            if data:
+                connection.inbox += data
+                for (opcode, payload) in Protocol.parse(connection.inbox):
+                    self._requests += 1
+                    self._respond(connection, opcode, payload)
+
+        self._flush(selector, connection)
+
+    def _respond(self, connection, opcode, payload):
+        handler = self._handlers.get(opcode)
+        if handler is None:
+            connection.outbox += Protocol.frame(
+                Protocol.Ack, bytes([Protocol.Unknown]))
+            return
+
+        try:
+            response = handler(connection, payload)
+        except (KeyError, ValueError, IndexError):
+            logging.debug('invalid control request %02x', opcode)
+            response = Protocol.frame(Protocol.Ack, bytes([Protocol.Invalid]))
+        connection.outbox += response
+
+    def _flush(self, selector, connection):
+        """ Send as much as possible, wait for writability otherwise """
+
+        if connection.outbox:
+            try:
+                sent = connection.socket.send(connection.outbox)
+                del connection.outbox[:sent]
+            except (BlockingIOError, InterruptedError):
+                pass
+            except OSError:
+                return self._close(selector, connection)
+
+        events = selectors.EVENT_READ
+        if connection.outbox:
+            events |= selectors.EVENT_WRITE
+        selector.modify(connection.socket, events, connection)
+
+    def _push(self, selector):
+        snapshot = self._snapshot
+        if snapshot is None:
+            return
+
+        for connection in list(self._connections.values()):
+            if connection.subscribed and connection.last != snapshot:
+                connection.last = snapshot
+                connection.outbox += Protocol.frame(Protocol.Event, snapshot)
+                self._events += 1
+                self._flush(selector, connection)
+
+    def _ack(self, status=Protocol.Ok):
+        return Protocol.frame(Protocol.Ack, bytes([status]))
+
+    def _command(self, connection, payload):
+        command = Commands(payload[0])
+
+        # malformed frames must never reach the queue
+        (minimum, maximum) = Protocol.Allowed[command]
+        if not minimum <= len(payload) - 1 <= maximum:
+            raise ValueError(f'{command} with {len(payload) - 1} parameters')
+
+        params = [
+            Protocol.Params[command](value) for value in payload[1:]]
+
+        self.command(command, *params)
+        return self._ack()
+
+    def _preset(self, connection, payload):
+        preset = None
+        if self._presets is not None:
+            preset = self._presets.get(payload.decode())
+        if preset is None:
+            return self._ack(Protocol.Unknown)
+
+        self.command(Commands.ApplyPreset, preset)
+        return self._ack()
+
+    def _subscribe(self, connection, payload):
+        connection.subscribed = True
+
+        # current state first
+        connection.last = Protocol.snapshot(self._state)
+        return self._ack() + Protocol.frame(Protocol.Event, connection.last)
+
+    def _unsubscribe(self, connection, payload):
+        connection.subscribed = False
+        return self._ack()
+
+    def _get_state(self, connection, payload):
+        return Protocol.frame(Protocol.State, Protocol.snapshot(self._state))
+
+    def _ping(self, connection, payload):
+        return Protocol.frame(Protocol.Ping, payload)
+
+
+class Client:
+    """ Blocking client of the control socket (path or 'host:port') """
+
+    def __init__(self, path='/tmp/z906.sock', timeout=1.0):
+        self._socket = Protocol.connect(Protocol.address(path), timeout)
+        self._buffer = bytearray()
+        self._frames = collections.deque()
+        self._events = collections.deque()
+
+    def close(self):
+        self._socket.close()
+
+    def send(self, opcode, payload=b''):
+        """ Send a request without waiting (pipelining) """
+        self._socket.sendall(Protocol.frame(opcode, payload))
+
+    def _read(self):
+        data = self._socket.recv(65536)
+        if not data:
+            raise ConnectionError('control socket closed')
+
+        self._buffer += data
+        for (opcode, payload) in Protocol.parse(self._buffer):
+            if opcode == Protocol.Event:
+                self._events.append(Protocol.decode(payload))
+            else:
+                self._frames.append((opcode, payload))
+
+    def receive(self):
+        """ Next response (events are kept for events()) """
+
+        while not self._frames:
+            self._read()
+        return self._frames.popleft()
+
+    def event(self):
+        """ Next state event (blocks until one arrives) """
+
+        while not self._events:
+            self._read()
+        return self._events.popleft()
+
+    def status(self):
+        """ Whether the next response acknowledges success """
+
+        (opcode, payload) = self.receive()
+        return opcode == Protocol.Ack and payload[0] == Protocol.Ok
+
+    @staticmethod
+    def encode(command, param=None):
+        payload = bytes([command.value])
+        if param is not None:
+            payload += bytes([int(param)])
+        return payload
+
+    def command(self, command, param=None):
+        self.send(Protocol.Command, Client.encode(command, param))
+        return self.status()
+
+    def preset(self, name):
+        self.send(Protocol.Preset, name.encode())
+        return self.status()
+
+    def subscribe(self):
+        self.send(Protocol.Subscribe)
+        return self.status()
+
+    def unsubscribe(self):
+        self.send(Protocol.Unsubscribe)
+        return self.status()
+
+    def state(self):
+        self.send(Protocol.State)
+        (_, payload) = self.receive()
+        return Protocol.decode(payload)
+
+    def ping(self, payload=b''):
+        self.send(Protocol.Ping, payload)
+        return self.receive()
@@ -0,0 +1,402 @@
+from core.component import Component
+from core.service import Worker
+from core.types import Commands, Stage
+from components.control import Protocol, Client
+
+import collections
+import errno
+import logging
+import selectors
+import socket
+import threading
+import time
+
+
+class Request:
+    """ Pending request to a single member """
+
+    def __init__(self, tracked=True):
+        self.tracked = tracked
+        self.event = threading.Event()
+        self.start = time.perf_counter()
+        self.status = None
+        self.latency = None
+
+    def complete(self, status):
+        self.status = status
+        self.latency = time.perf_counter() - self.start
+        self.event.set()
+
+
+class Member:
+    """ Persistent connection to a peer instance """
+
+    def __init__(self, name, address):
+        self.name = name
+        self.address = Protocol.address(address)
+        self.socket = None
+        self.connecting = False
+        self.inbox = bytearray()
+        self.outbox = bytearray()
+        self.pending = collections.deque()
+
+        # latest state event of the peer
+        self.state = None
+        self.updated = None
+
+        # reconnect schedule (monotonic)
+        self.retry = 0.0
+        self.backoff = Group.BackoffInitial
+
+        # statistics
+        self.requests = 0
+        self.failures = 0
+        self.connects = 0
+        self.latency = None
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.error = None
+
+    @property
+    def connected(self):
+        return self.socket is not None and not self.connecting
+
+    def serialize(self):
+        succeeded = self.requests - self.failures
+        return {
+            'address': self.address if isinstance(self.address, str)
+            else f'{self.address[0]}:{self.address[1]}',
+            'connected': self.connected,
+            'state': self.state,
+            'age': None if self.updated is None
+            else time.monotonic() - self.updated,
+            'requests': self.requests,
+            'failures': self.failures,
+            'connects': self.connects,
+            'latency_ms': {
+                'last': None if self.latency is None else self.latency * 1000,
+                'mean': self.latency_sum / succeeded * 1000
+                if succeeded > 0 else None,
+                'max': self.latency_max * 1000,
+            },
+            'error': self.error,
+        }
+
+
+class Group(Component, Worker):
+    """ Forwards commands to peer instances in parallel (multi-room)
+
+        Every member is a peer running the control socket with a TCP
+        listener. Connections are kept open and subscribed, so the states
+        of all members are known without polling. """
+
+    # reconnect delays of unreachable members
+    BackoffInitial = 0.5
+    BackoffMaximum = 30.0
+
+    def __init__(self, pi, state, queue, members, timeout=1.0, local=True,
+                 presets=None):
+        Component.__init__(self, pi, state, queue)
+        Worker.__init__(self, self._loop, 'group thread')
+
+        self._members = {
+            name: Member(name, address) for name, address in members.items()}
+        self._timeout = timeout
+        self._local = local
+        self._presets = presets
+        self._lock = threading.Lock()
+
+        # callers wake the thread to send queued frames
+        (self._waker, self._wakeup) = socket.socketpair()
+        self._waker.setblocking(False)
+        self._wakeup.setblocking(False)
+
+        # start event loop
+        self.start()
+
+    @property
+    def workers(self):
+        return [self]
+
+    @property
+    def members(self):
+        return list(self._members)
+
+    @property
+    def statistics(self):
+        return {
+            'members': len(self._members),
+            'connected': sum(
+                member.connected for member in self._members.values()),
+            'requests': sum(
+                member.requests for member in self._members.values()),
+            'failures': sum(
+                member.failures for member in self._members.values()),
+        }
+
+    def serialize(self):
+        """ Aggregated state and statistics of all members """
+
+        with self._lock:
+            members = {
+                name: member.serialize()
+                for name, member in self._members.items()}
+
+        states = [
+            member['state'] for member in members.values()
+            if member['connected'] and member['state'] is not None]
+        return {
+            'members': members,
+            'reachable': len(states),
+            'on': sum(state['stage'] != int(Stage.Off) for state in states),
+            'muted': sum(state['mute'] for state in states),
+        }
+
+    def close(self):
+        self._waker.close()
+        self._wakeup.close()
+
+    def _wake(self):
+        try:
+            self._waker.send(b'\x00')
+        except (BlockingIOError, OSError):
+            pass
+
+    def send(self, command, param=None):
+        """ Command all members (and the local unit), see _fan_out """
+
+        def local():
+            self.command(command, *([] if param is None else [param]))
+
+        return self._fan_out(
+            Protocol.Command, Client.encode(command, param), local)
+
+    def preset(self, name):
+        """ Apply a preset (by name) on all members """
+
+        def local():
+            preset = None if self._presets is None else self._presets.get(name)
+            if preset is None:
+                raise KeyError(name)
+            self.command(Commands.ApplyPreset, preset)
+
+        return self._fan_out(Protocol.Preset, name.encode(), local)
+
+    def _fan_out(self, opcode, payload, local):
+        """ Send to all members at once, wait for their acknowledges """
+
+        start = time.perf_counter()
+        frame = Protocol.frame(opcode, payload)
+        requests = {}
+
+        with self._lock:
+            for member in self._members.values():
+                request = Request()
+                requests[member.name] = request
+                member.requests += 1
+                if not member.connected:
+                    self._fail(member, request, 'disconnected')
+                    continue
+                member.pending.append(request)
+                member.outbox += frame
+        self._wake()
+
+        results = {}
+        if self._local:
+            name = 'local' if self._service is None or \
+                self._service.name is None else self._service.name
+            try:
+                local()
+                results[name] = {'status': 'ok', 'latency_ms': 0.0}
+            except KeyError:
+                results[name] = {'status': 'unknown', 'latency_ms': 0.0}
+
+        # all requests are in flight, the slowest member bounds the wait
+        deadline = time.monotonic() + self._timeout
+        for name, request in requests.items():
+            if not request.event.wait(max(deadline - time.monotonic(), 0)):
+                with self._lock:
+                    if request.status is None:
+                        self._fail(self._members[name], request, 'timeout')
+
+            results[name] = {
+                'status': request.status,
+                'latency_ms': request.latency * 1000,
+            }
+
+        return {
+            'members': results,
+            'failed': [
+                name for name, result in results.items()
+                if result['status'] != 'ok'],
+            'elapsed_ms': (time.perf_counter() - start) * 1000,
+        }
+
+    def _fail(self, member, request, status):
+        if request.tracked:
+            member.failures += 1
+        request.complete(status)
+
+    def _succeed(self, member, request, status):
+
+        # late answers of timed out requests only keep the order
+        if request.status is not None:
+            return
+        if status != 'ok':
+            return self._fail(member, request, status)
+
+        request.complete(status)
+        if not request.tracked:
+            return
+
+        member.latency = request.latency
+        member.latency_sum += request.latency
+        member.latency_max = max(member.latency_max, request.latency)
+
+    def _connect(self, selector, member):
+        """ Start a non-blocking connect """
+
+        member.retry = time.monotonic() + member.backoff
+        member.backoff = min(member.backoff * 2, Group.BackoffMaximum)
+
+        if isinstance(member.address, tuple):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        else:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.setblocking(False)
+
+        code = sock.connect_ex(member.address)
+        if code not in (0, errno.EINPROGRESS, errno.EAGAIN):
+            member.error = errno.errorcode.get(code, str(code))
+            sock.close()
+            return
+
+        member.socket = sock
+        member.connecting = True
+        member.inbox.clear()
+        member.outbox.clear()
+        selector.register(sock, selectors.EVENT_WRITE, member)
+
+    def _connected(self, selector, member):
+        code = member.socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if code != 0:
+            member.error = errno.errorcode.get(code, str(code))
+            return self._disconnect(selector, member)
+
+        logging.info(f'group member {member.name} connected')
+        member.connecting = False
+        member.error = None
+        member.backoff = Group.BackoffInitial
+        member.connects += 1
+
+        # state events keep the aggregated state current
+        with self._lock:
+            member.pending.appendleft(Request(tracked=False))
+            member.outbox[:0] = Protocol.frame(Protocol.Subscribe)
+        self._flush(selector, member)
+
+    def _disconnect(self, selector, member):
+        if member.connected:
+            logging.warning(f'group member {member.name} disconnected')
+
+        selector.unregister(member.socket)
+        member.socket.close()
+        member.socket = None
+        member.connecting = False
+        member.state = None
+
+        with self._lock:
+            while member.pending:
+                request = member.pending.popleft()
+                if request.status is None:
+                    self._fail(member, request, 'disconnected')
+            member.outbox.clear()
+
+    def _receive(self, selector, member):
+        try:
+            data = member.socket.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            member.error = repr(e)
+            data = b''
+
+        if data == b'':
+            return self._disconnect(selector, member)
+
+        member.inbox += data
+        with self._lock:
+            for (opcode, payload) in Protocol.parse(member.inbox):
+                if opcode == Protocol.Event:
+                    member.state = Protocol.decode(payload)
+                    member.updated = time.monotonic()
+                elif member.pending:
+                    # empty acknowledges (faulty or older peers) are rejects
+                    ok = opcode == Protocol.Ack and len(payload) > 0 and \
+                        payload[0] == Protocol.Ok
+                    self._succeed(
+                        member, member.pending.popleft(),
+                        'ok' if ok else 'rejected')
+
+    def _flush(self, selector, member):
+        with self._lock:
+            if member.outbox:
+                try:
+                    sent = member.socket.send(member.outbox)
+                    del member.outbox[:sent]
+                except (BlockingIOError, InterruptedError):
+                    pass
+                except OSError as e:
+                    member.error = repr(e)
+                    member.outbox.clear()
+            events = selectors.EVENT_READ
+            if member.outbox:
+                events |= selectors.EVENT_WRITE
+
+        selector.modify(member.socket, events, member)
+
+    def _drain(self):
+        try:
+            while self._wakeup.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _loop(self, cycle, worker):
+        """ Serves all member connections from a single thread """
+
+        worker.token.on_cancel(self._wake)
+
+        selector = selectors.DefaultSelector()
+        selector.register(self._wakeup, selectors.EVENT_READ)
+
+        try:
+            while cycle == worker.cycle:
+                worker.heartbeat()
+
+                now = time.monotonic()
+                for member in self._members.values():
+                    if member.socket is None and now >= member.retry:
+                        self._connect(selector, member)
+
+                for (key, events) in selector.select(0.5):
+                    member = key.data
+                    if key.fileobj is self._wakeup:
+                        self._drain()
+                        for member in self._members.values():
+                            if member.connected and member.outbox:
+                                self._flush(selector, member)
+                    elif member.connecting:
+                        self._connected(selector, member)
+                    else:
+                        if events & selectors.EVENT_READ:
+                            self._receive(selector, member)
+                        if member.socket is not None:
+                            self._flush(selector, member)
+
+        finally:
+            for member in self._members.values():
+                if member.socket is not None:
+                    self._disconnect(selector, member)
+            selector.close()
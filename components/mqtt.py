@@ -0,0 +1,289 @@
+from core.component import Component
+from core.presets import Preset
+from core.service import Worker
+from core.types import Commands, Input, Effect, Speakers, Stage
+
+import json
+import logging
+import threading
+import time
+
+
+class Mqtt(Component, Worker):
+    """ Bridges state and commands to an MQTT broker """
+
+    # seconds to collect state changes before publishing
+    Batch = 0.05
+
+    # reconnect delays (reset once a session was accepted or stayed up)
+    BackoffInitial = 1.0
+    BackoffMaximum = 60.0
+    Stable = 30.0
+
+    # command topic payloads (as on the HTTP API)
+    Names = {
+        'on': Commands.TurnOn,
+        'off': Commands.TurnOff,
+        'mute': Commands.Mute,
+        'unmute': Commands.Unmute,
+        'volume-up': Commands.VolumeUp,
+        'volume-down': Commands.VolumeDown,
+    }
+
+    def __init__(self, pi, state, queue, host='localhost', port=1883,
+                 prefix='z906', discovery='homeassistant', client=None):
+        Component.__init__(self, pi, state, queue)
+        Worker.__init__(self, self._loop, f'mqtt thread ({host}:{port})')
+
+        self._host = host
+        self._port = port
+        self._prefix = prefix
+        self._discovery = discovery
+
+        # paho client (or given stand-in, e.g. for tests)
+        self._client = client or self._create()
+        self._client.on_connect = self._on_connect
+        self._client.on_message = self._on_message
+        self._accepted = False
+        self._client.will_set(
+            self._topic('availability'), 'offline', qos=1, retain=True)
+
+        # published and pending field values (topic -> payload)
+        self._lock = threading.Lock()
+        self._published = {}
+        self._pending = {}
+        self._event = threading.Event()
+
+        self._setters = {
+            'power': self._set_power,
+            'mute': self._set_mute,
+            'input': self._set_input,
+            'effect': self._set_effect,
+            'volume': self._set_volume,
+        }
+
+        self._connects = 0
+        self._publishes = 0
+        self._changes = 0
+
+        # start event loop
+        self.start()
+
+    def _create(self):
+        import paho.mqtt.client as mqtt
+
+        # callback versions differ between paho 1.x and 2.x (on_connect takes both)
+        if hasattr(mqtt, 'CallbackAPIVersion'):
+            return mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        return mqtt.Client()
+
+    @property
+    def workers(self):
+        return [self]
+
+    @property
+    def statistics(self):
+        return {
+            'connects': self._connects,
+            'changes': self._changes,
+            'publishes': self._publishes,
+        }
+
+    def _topic(self, *parts):
+        return '/'.join((self._prefix,) + parts)
+
+    def fields(self):
+        """ Payload of every state topic """
+
+        state = self._state
+        fields = {
+            'power': 'ON' if state.ready else 'OFF',
+            'stage': state.stage.name,
+            'mute': 'ON' if state.mute else 'OFF',
+            'input': Input(state.input).name,
+            'effect': Effect(state.effect).name,
+            'speakers': Speakers(state.speakers).name,
+            'volume': str(int(state.volume)),
+        }
+        for speakers, volume in state.volumes.items():
+            fields[f'volume/{speakers.name.lower()}'] = str(int(volume))
+
+        return {
+            self._topic('state', field): payload
+            for field, payload in fields.items()
+        }
+
+    def update(self):
+        """ Queue changed fields for the next batch """
+
+        with self._lock:
+            for topic, payload in self.fields().items():
+                if self._published.get(topic) != payload:
+                    self._pending[topic] = payload
+                    self._changes += 1
+                else:
+                    self._pending.pop(topic, None)
+            if self._pending:
+                self._event.set()
+
+    def _discovery_config(self):
+        """ Home Assistant discovery messages (topic -> config) """
+
+        # node ids must not contain slashes
+        node = self._prefix.replace('/', '_')
+        device = {
+            'identifiers': [node],
+            'name': 'Logitech Z906',
+            'manufacturer': 'Logitech',
+            'model': 'Z906',
+        }
+
+        def entity(kind, field, name, **config):
+            topic = f'{self._discovery}/{kind}/{node}/{field}/config'
+            return (topic, {
+                'name': name,
+                'unique_id': f'{node}_{field}',
+                'availability_topic': self._topic('availability'),
+                'state_topic': self._topic('state', field),
+                'device': device,
+                **config,
+            })
+
+        return dict([
+            entity('switch', 'power', 'Power',
+                   command_topic=self._topic('set', 'power')),
+            entity('switch', 'mute', 'Mute',
+                   command_topic=self._topic('set', 'mute')),
+            entity('select', 'input', 'Input',
+                   command_topic=self._topic('set', 'input'),
+                   options=[input.name for input in Input]),
+            entity('select', 'effect', 'Effect',
+                   command_topic=self._topic('set', 'effect'),
+                   options=[effect.name for effect in Effect]),
+            entity('number', 'volume', 'Volume',
+                   command_topic=self._topic('set', 'volume'),
+                   min=0, max=self._state.max_volume, step=1),
+        ])
+
+    def _publish(self, topic, payload):
+        self._client.publish(topic, payload, qos=1, retain=True)
+        self._publishes += 1
+
+    def _connect(self):
+        """ Connect and announce (returns False if the broker is down) """
+
+        self._accepted = False
+        try:
+            self._client.connect(self._host, self._port)
+        except OSError as e:
+            logging.warning(f'mqtt broker unavailable: {e}')
+            return False
+
+        self._connects += 1
+        self._client.subscribe(self._topic('command'), qos=1)
+        self._client.subscribe(self._topic('set', '+'), qos=1)
+
+        for topic, config in self._discovery_config().items():
+            self._publish(topic, json.dumps(config))
+        self._publish(self._topic('availability'), 'online')
+
+        # the broker may have lost retained state, publish everything again
+        with self._lock:
+            self._published = {}
+        self.update()
+        return True
+
+    def _flush(self):
+        """ Publish the latest value of all changed fields """
+
+        with self._lock:
+            self._event.clear()
+            pending, self._pending = self._pending, {}
+            self._published.update(pending)
+
+        for topic, payload in pending.items():
+            self._publish(topic, payload)
+
+    def _loop(self, cycle, worker):
+        """ Runs the network loop, reconnects with backoff """
+
+        worker.token.on_cancel(self._event.set)
+
+        backoff = Mqtt.BackoffInitial
+        connected = False
+        since = None
+        try:
+            while cycle == worker.cycle:
+                worker.heartbeat()
+
+                if not connected:
+                    connected = self._connect()
+                    if not connected:
+                        worker.token.wait(backoff)
+                        backoff = min(backoff * 2, Mqtt.BackoffMaximum)
+                        continue
+                    since = time.monotonic()
+
+                # network traffic (and incoming commands) within the batch
+                if self._client.loop(Mqtt.Batch) != 0:
+                    logging.warning(
+                        f'mqtt connection lost, reconnecting in {backoff:.0f} s')
+                    connected = False
+                    worker.token.wait(backoff)
+                    backoff = min(backoff * 2, Mqtt.BackoffMaximum)
+                    continue
+
+                # a TCP connect alone does not prove the broker accepts us
+                if self._accepted or time.monotonic() - since > Mqtt.Stable:
+                    backoff = Mqtt.BackoffInitial
+
+                if self._event.is_set():
+                    self._flush()
+
+        finally:
+            if connected:
+                self._publish(self._topic('availability'), 'offline')
+                self._client.loop(Mqtt.Batch)
+                self._client.disconnect()
+
+    def _on_connect(self, client, userdata, flags, reason, *args):
+        """ CONNACK (reason is an int or a paho 2.x reason code) """
+
+        self._accepted = reason == 0
+        if not self._accepted:
+            logging.warning(f'mqtt broker refused the session: {reason}')
+
+    def _on_message(self, client, userdata, message):
+        """ Map command topics onto commands """
+
+        payload = message.payload.decode(errors='replace').strip()
+        try:
+            if message.topic == self._topic('command'):
+                self.command(Mqtt.Names[payload])
+                return
+
+            field = message.topic.rsplit('/', 1)[-1]
+            self._setters[field](payload)
+
+        except (KeyError, ValueError):
+            logging.warning(f'invalid mqtt command {message.topic}: {payload}')
+
+    def _set_power(self, payload):
+        if payload == 'ON' and self._state.stage == Stage.Off:
+            self.command(Commands.TurnOn)
+        if payload == 'OFF' and self._state.stage == Stage.Ready:
+            self.command(Commands.TurnOff)
+
+    def _set_mute(self, payload):
+        self.command(Commands.Mute if payload == 'ON' else Commands.Unmute)
+
+    def _set_input(self, payload):
+        self.command(Commands.SelectInput, Input[payload])
+
+    def _set_effect(self, payload):
+        self.command(Commands.SelectEffect, Effect[payload])
+
+    def _set_volume(self, payload):
+        volume = max(0, min(int(float(payload)), self._state.max_volume))
+        self.command(Commands.ApplyPreset, Preset(
+            'mqtt', volumes={Speakers.Master: volume}))
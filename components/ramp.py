@@ -0,0 +1,195 @@
+from core.component import Component
+from core.presets import Preset
+from core.service import Worker
+from core.types import Commands, Speakers
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+
+class Ramp:
+    """ Linear volume fade of a single speakers channel """
+
+    def __init__(self, speakers, start, target, duration, interval):
+        self.speakers = speakers
+        self.start = start
+        self.target = target
+        self.duration = duration
+        self.interval = interval
+        self.begin = time.monotonic()
+        self.volume = start
+        self.cancelled = False
+
+    @property
+    def done(self):
+        return self.cancelled or self.volume == self.target
+
+    @property
+    def progress(self):
+        if self.target == self.start:
+            return 1.0
+        return (self.volume - self.start) / (self.target - self.start)
+
+    def desired(self, now):
+        """ Volume the ramp should have reached by now """
+
+        if self.duration <= 0:
+            return self.target
+
+        fraction = min((now - self.begin) / self.duration, 1.0)
+        return round(self.start + (self.target - self.start) * fraction)
+
+    def serialize(self):
+        return {
+            'speakers': self.speakers.name,
+            'start': self.start,
+            'target': self.target,
+            'duration': self.duration,
+            'volume': self.volume,
+            'progress': self.progress,
+            'elapsed': time.monotonic() - self.begin,
+        }
+
+
+class Ramps(Component, Worker):
+    """ Fades volumes over time (alarms, sleep timers) """
+
+    # fastest step rate the device reliably follows
+    StepInterval = 0.1
+
+    # commands that do not count as manual input
+    Passive = (Commands.RequestState,)
+
+    def __init__(self, pi, state, queue):
+        Component.__init__(self, pi, state, queue)
+        Worker.__init__(self, self._loop, 'ramp thread')
+
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._sequence = itertools.count()
+        self._timers = []
+        self._ramps = {}
+
+        # manual input cancels running ramps
+        queue.listen(self._on_command)
+
+        # start event loop
+        self.start()
+
+    @property
+    def workers(self):
+        return [self]
+
+    @property
+    def ramps(self):
+        return {
+            speakers.name: ramp.serialize()
+            for speakers, ramp in self._ramps.items()
+        }
+
+    def fade(self, target, duration, speakers=Speakers.Master, start=None):
+        """ Start fading the given speakers to the target volume """
+
+        current = int(self._state.volumes.get(speakers, 0))
+        target = max(0, min(int(target), self._state.max_volume))
+
+        # jump to the start volume first
+        if start is not None and start != current:
+            self.command(Commands.ApplyPreset, Preset(
+                'ramp', volumes={speakers: int(start)}))
+            current = int(start)
+
+        steps = abs(target - current)
+        interval = Ramps.StepInterval
+        if steps:
+            interval = max(duration / steps, Ramps.StepInterval)
+
+        ramp = Ramp(speakers, current, target, duration, interval)
+        with self._lock:
+            previous = self._ramps.get(speakers)
+            if previous is not None:
+                previous.cancelled = True
+            self._ramps[speakers] = ramp
+            self._schedule(ramp, ramp.begin + interval)
+
+        logging.info('fading %s %s to %s', speakers.name, current, target)
+        return ramp
+
+    def abort(self, speakers=None):
+        """ Abort ramps (of the given speakers or all) """
+
+        with self._lock:
+            for ramp in list(self._ramps.values()):
+                if speakers is None or ramp.speakers == speakers:
+                    ramp.cancelled = True
+                    del self._ramps[ramp.speakers]
+
+    def _schedule(self, ramp, deadline):
+        heapq.heappush(self._timers, (deadline, next(self._sequence), ramp))
+        self._event.set()
+
+    def _on_command(self, source, command, params, kwargs):
+        if source is self or command in Ramps.Passive:
+            return
+        if self._ramps:
+            logging.info('manual input cancels ramps: %s', command)
+            self.abort()
+
+    def _step(self, ramp, now):
+        """ Issue commands to catch up with the ramp """
+
+        desired = ramp.desired(now)
+        delta = desired - ramp.volume
+        if not delta:
+            return
+
+        # single steps are cheapest, larger gaps are left to the preset compiler
+        if delta == 1:
+            self.command(Commands.VolumeUp, ramp.speakers)
+        elif delta == -1:
+            self.command(Commands.VolumeDown, ramp.speakers)
+        else:
+            self.command(Commands.ApplyPreset, Preset(
+                'ramp', volumes={ramp.speakers: desired}))
+        ramp.volume = desired
+
+    def _loop(self, cycle, worker):
+        """ Advance ramps at their deadlines """
+
+        worker.token.on_cancel(self._event.set)
+
+        while cycle == worker.cycle:
+            worker.heartbeat()
+
+            self._event.clear()
+            with self._lock:
+                timeout = None
+                if self._timers:
+                    timeout = self._timers[0][0] - time.monotonic()
+
+            if timeout is None or timeout > 0:
+                self._event.wait(timeout)
+                continue
+
+            now = time.monotonic()
+            with self._lock:
+                (_, _, ramp) = heapq.heappop(self._timers)
+                if ramp.cancelled:
+                    continue
+
+                # abort if the device went down
+                if not self._state.ready:
+                    ramp.cancelled = True
+                    del self._ramps[ramp.speakers]
+                    continue
+
+                self._step(ramp, now)
+                if ramp.done:
+                    logging.info(
+                        'faded %s to %s', ramp.speakers.name, ramp.volume)
+                    del self._ramps[ramp.speakers]
+                else:
+                    self._schedule(ramp, now + ramp.interval)
@@ -0,0 +1,50 @@
+from core.component import PollingComponent
+from core.types import Commands
+
+import time
+
+
+class Reconciler(PollingComponent):
+    """ Requests the device state to correct drifted local state """
+
+    # delay after the last command before requesting the state
+    Settle = 0.5
+
+    # request intervals (doubling from fast to idle)
+    Fast = 2.0
+    Idle = 60.0
+
+    def __init__(self, pi, state, queue):
+        super().__init__(pi, state, queue, Reconciler.Idle)
+        self._activity = None
+        self._backoff = Reconciler.Fast
+
+        queue.listen(self._on_command)
+
+    def _on_command(self, source, command, params, kwargs):
+        if source is self or command == Commands.RequestState:
+            return
+
+        # reconcile soon after bursts of activity
+        self._activity = time.monotonic()
+        self._backoff = Reconciler.Fast
+        self.interval = Reconciler.Settle
+
+    def poll(self):
+        """ Request state if due """
+
+        # wait until the burst settled
+        activity = self._activity
+        if activity is not None:
+            remaining = activity + Reconciler.Settle - time.monotonic()
+            if remaining > 0:
+                self.interval = remaining
+                return
+
+        if self._state.ready:
+            self.command(Commands.RequestState)
+
+        # requests become rare while idle
+        self._activity = None
+        self.interval = self._backoff
+        self._backoff = min(self._backoff * 2, Reconciler.Idle)
@@ -0,0 +1,252 @@
+from core.component import Component
+from core.presets import Preset
+from core.service import Worker
+from core.types import Commands, Speakers, Stage
+from components.Z906.controller import Controller
+
+import datetime
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+
+class Timer:
+    """ Single deadline (sleep timer or next run of a schedule) """
+
+    def __init__(self, deadline, schedule=None, wall=None):
+        self.deadline = deadline
+        self.schedule = schedule
+        self.wall = wall
+        self.cancelled = False
+
+
+class Timers(Component, Worker):
+    """ Sleep timer, recurring schedules and quiet hours """
+
+    # sleep timer steps selected by IR (minutes)
+    SleepSteps = [15, 30, 60, 90]
+
+    # longest sleep, wall-clock jumps (e.g. NTP sync) are noticed after it
+    MaxSleep = 60.0
+
+    def __init__(self, pi, state, queue, schedules=None, presets=None):
+        Component.__init__(self, pi, state, queue)
+        Worker.__init__(self, self._loop, 'timer thread')
+
+        self._schedules = schedules
+        self._presets = presets
+
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._sequence = itertools.count()
+        self._timers = []
+        self._planned = {}
+        self._sleep = None
+        self._cap = None
+        self._offset = None
+
+        # start event loop
+        self.start()
+
+    @property
+    def workers(self):
+        return [self]
+
+    @property
+    def statistics(self):
+        return {
+            'timers': len(self._timers),
+            'sleep': self.sleep_remaining,
+            'cap': self._cap,
+        }
+
+    @property
+    def cap(self):
+        """ Volume cap of active quiet hours (or None) """
+        return self._cap
+
+    @property
+    def sleep_remaining(self):
+        timer = self._sleep
+        if timer is None or timer.cancelled:
+            return None
+        return max(timer.deadline - time.monotonic(), 0)
+
+    @property
+    def planned(self):
+        """ Next run of every schedule """
+
+        return {
+            name: timer.wall.isoformat(timespec='minutes')
+            for name, timer in self._planned.items()
+        }
+
+    def _push(self, timer):
+        heapq.heappush(
+            self._timers, (timer.deadline, next(self._sequence), timer))
+        self._event.set()
+
+    def sleep(self, seconds):
+        """ Power off after the given seconds (None cancels) """
+
+        with self._lock:
+            if self._sleep is not None:
+                self._sleep.cancelled = True
+                self._sleep = None
+
+            if seconds:
+                self._sleep = Timer(time.monotonic() + seconds)
+                self._push(self._sleep)
+                logging.info(f'sleep timer set to {seconds / 60:.0f} minutes')
+
+    def toggle_sleep(self):
+        """ Step through the sleep timer steps, then cancel """
+
+        remaining = self.sleep_remaining or 0
+        for minutes in Timers.SleepSteps:
+            if minutes * 60 > remaining + 1:
+                self.sleep(minutes * 60)
+                return minutes
+
+        self.sleep(None)
+        logging.info('sleep timer cancelled')
+
+    def _plan(self, schedule, after=None):
+        """ Schedule the next run (called with the lock held) """
+
+        now = datetime.datetime.now()
+        wall = schedule.next(now if after is None else max(now, after))
+        if wall is None:
+            return
+
+        deadline = time.monotonic() + (wall - now).total_seconds()
+        timer = Timer(deadline, schedule, wall)
+        self._planned[schedule.name] = timer
+        self._push(timer)
+
+    def reload(self):
+        """ Replan all schedules (after changes or wall-clock jumps) """
+
+        with self._lock:
+            for timer in self._planned.values():
+                timer.cancelled = True
+            self._planned = {}
+
+            if self._schedules is not None:
+                for name in self._schedules.names:
+                    self._plan(self._schedules.get(name))
+
+        self._offset = time.time() - time.monotonic()
+        self._quiet()
+
+    def _quiet(self, at=None):
+        """ Recalculate the volume cap of quiet hours """
+
+        cap = None
+        if self._schedules is not None:
+            now = datetime.datetime.now()
+            if at is not None:
+                now = max(now, at)
+            caps = [
+                schedule.volume
+                for schedule in map(self._schedules.get, self._schedules.names)
+                if schedule.action == 'quiet' and schedule.active(now)]
+            cap = min(caps, default=None)
+
+        if cap != self._cap:
+            logging.info(f'volume cap: {cap}')
+            self._cap = cap
+
+            # enforced with the next update
+            self._state._event.set()
+
+    def update(self):
+        """ Enforce the volume cap """
+
+        controller = None
+        if self._service is not None:
+            controller = self._service.find(Controller)
+        if controller is not None:
+            controller.cap = self._cap
+
+        cap = self._cap
+        if cap is None or not self._state.ready:
+            return
+
+        # lower the volume once (prediction holds the lowered volume)
+        if self._state.predicted.volumes.get(Speakers.Master, 0) > cap:
+            self.command(Commands.ApplyPreset, Preset(
+                'quiet', volumes={Speakers.Master: cap}))
+
+    def _fire(self, timer):
+        schedule = timer.schedule
+
+        # sleep timer
+        if schedule is None:
+            self._sleep = None
+            if self._state.stage != Stage.Off:
+                logging.info('sleep timer expired')
+                self.command(Commands.TurnOff)
+            return
+
+        # wall-clock went back, wait for the planned time again
+        if datetime.datetime.now() < timer.wall - datetime.timedelta(seconds=1):
+            with self._lock:
+                self._plan(schedule)
+            return
+
+        logging.info(f'running schedule {schedule.name} ({schedule.action})')
+        if schedule.action == 'on' and self._state.stage == Stage.Off:
+            self.command(Commands.TurnOn)
+        elif schedule.action == 'off' and self._state.stage == Stage.Ready:
+            self.command(Commands.TurnOff)
+        elif schedule.action == 'preset' and self._state.ready:
+            preset = None
+            if self._presets is not None:
+                preset = self._presets.get(schedule.preset)
+            if preset is None:
+                logging.warning(f'unknown preset {schedule.preset}')
+            else:
+                self.command(Commands.ApplyPreset, preset)
+
+        # timers may fire slightly before the wall-clock time
+        self._quiet(timer.wall)
+        with self._lock:
+            if self._planned.get(schedule.name) is timer:
+                self._plan(schedule, timer.wall)
+
+    def _loop(self, cycle, worker):
+        """ Sleeps until the next deadline """
+
+        worker.token.on_cancel(self._event.set)
+        self.reload()
+
+        while cycle == worker.cycle:
+            worker.heartbeat()
+            self._event.clear()
+
+            # wall-clock jumped (all wall-clock deadlines are off)
+            offset = time.time() - time.monotonic()
+            if abs(offset - self._offset) > 1.0:
+                logging.info('wall-clock changed, replanning schedules')
+                self.reload()
+
+            due = []
+            with self._lock:
+                now = time.monotonic()
+                while self._timers and self._timers[0][0] <= now:
+                    (_, _, timer) = heapq.heappop(self._timers)
+                    if not timer.cancelled:
+                        due.append(timer)
+
+                timeout = Timers.MaxSleep
+                if self._timers:
+                    timeout = min(self._timers[0][0] - now, timeout)
+
+            for timer in due:
+                self._fire(timer)
+
+            if not due:
+                self._event.wait(timeout)
@@ -0,0 +1,219 @@
+from . import store
+
+import bisect
+import logging
+import statistics
+import threading
+
+
+class Ladder:
+    """ Classifies voltages of a resistor ladder (one level per button) """
+
+    def __init__(self, levels, tolerance):
+        ordered = sorted(levels.items(), key=lambda item: item[1])
+
+        # windows around every level, shrunk to not overlap their neighbours
+        self._bounds = []
+        self._names = []
+        for index, (name, level) in enumerate(ordered):
+            width = tolerance
+            if index > 0:
+                width = min(width, (level - ordered[index - 1][1]) / 2)
+            if index < len(ordered) - 1:
+                width = min(width, (ordered[index + 1][1] - level) / 2)
+            self._bounds += [level - width, level + width]
+            self._names.append(name)
+
+    def classify(self, voltage):
+        """ Name of the pressed button (or None) """
+
+        # odd positions lie within a window
+        position = bisect.bisect_right(self._bounds, voltage)
+        if position % 2:
+            return self._names[position // 2]
+
+
+class Tracker:
+    """ Press, hold and repeat detection by counting samples """
+
+    def __init__(self, press=2, release=2, hold=25, repeat=10):
+        self._press = press
+        self._release = release
+        self._hold = hold
+        self._repeat = repeat
+
+        self._candidate = None
+        self._count = 0
+        self._pressed = None
+        self._held = 0
+
+    @property
+    def pressed(self):
+        return self._pressed
+
+    def sample(self, name):
+        """ Feed a classified sample, returns (event, name, held) tuples """
+
+        if name == self._candidate:
+            self._count += 1
+        else:
+            self._candidate = name
+            self._count = 1
+
+        if self._pressed is None:
+            if name is not None and self._count >= self._press:
+                self._pressed = name
+                self._held = 0
+                return [('press', name, False)]
+            return []
+
+        if name == self._pressed:
+            self._held += 1
+            if self._held == self._hold:
+                return [('hold', name, True)]
+            if self._held > self._hold and \
+                    (self._held - self._hold) % self._repeat == 0:
+                return [('repeat', name, True)]
+            return []
+
+        # other samples (released or neighbouring level) end the press
+        if self._count >= self._release:
+            pressed = self._pressed
+            self._pressed = None
+            return [('release', pressed, self._held >= self._hold)]
+        return []
+
+
+class Buttons:
+    """ Analog buttons with calibrated levels (stored on disk) """
+
+    # ladder voltages of the reference unit
+    Defaults = {
+        'input': 0.160,
+        'mute': 1.350,
+        'speakers': 1.925,
+        'effect': 2.525,
+    }
+
+    # allowed deviation from a level (shrunk between close levels)
+    Tolerance = 0.1
+
+    # voltage of released buttons (pull-up)
+    Idle = 3.0
+
+    # smallest distance of calibrated levels
+    Separation = 0.05
+
+    def __init__(self, path=None, tracker=None, tolerance=Tolerance):
+        self._path = path
+        self._lock = threading.Lock()
+        self._levels = dict(Buttons.Defaults)
+        self._tracker = tracker or Tracker()
+        self._tolerance = tolerance
+        self._calibrating = []
+        self._samples = []
+        self.load()
+        self._ladder = Ladder(self._levels, tolerance)
+
+    @property
+    def levels(self):
+        return dict(self._levels)
+
+    @property
+    def calibrating(self):
+        """ Buttons still to be pressed for calibration """
+        return list(self._calibrating)
+
+    def configure(self, tolerance, **tracker):
+        """ Replace tolerance and hysteresis (takes effect immediately) """
+
+        with self._lock:
+            self._tolerance = tolerance
+            self._tracker = Tracker(**tracker)
+            self._ladder = Ladder(self._levels, tolerance)
+
+    def serialize(self):
+        return {
+            'levels': self.levels,
+            'calibrating': self.calibrating,
+        }
+
+    def load(self):
+        try:
+            data = store.load(self._path)
+            if data is None:
+                return
+            self._levels.update({
+                name: float(level)
+                for name, level in data.items()
+                if name in Buttons.Defaults
+            })
+        except (OSError, ValueError):
+            logging.exception(f'invalid buttons file: {self._path}')
+
+    def save(self):
+        if self._path is None:
+            return
+
+        with self._lock:
+            store.save(self._path, self._levels)
+
+    def calibrate(self, names=None):
+        """ Learn the levels of the given buttons from the next presses """
+
+        names = list(Buttons.Defaults) if names is None else list(names)
+        for name in names:
+            if name not in Buttons.Defaults:
+                raise KeyError(name)
+
+        with self._lock:
+            self._calibrating = names
+            self._samples = []
+        logging.info(f'calibrating buttons: press {", ".join(names)}')
+
+    def cancel(self):
+        with self._lock:
+            self._calibrating = []
+            self._samples = []
+
+    def _learn(self, voltage):
+        """ Collect a press, learn its level once released """
+
+        if voltage < Buttons.Idle:
+            self._samples.append(voltage)
+            return False
+
+        # ignore bounces
+        samples = self._samples
+        self._samples = []
+        if len(samples) < 2 * self._tracker._press:
+            return False
+
+        name = self._calibrating[0]
+        level = round(statistics.median(samples), 3)
+        others = [
+            other for other, value in self._levels.items()
+            if other != name and other not in self._calibrating and
+            abs(value - level) < Buttons.Separation]
+        if others:
+            logging.warning(
+                f'{name} at {level:.3f} V is too close to {others[0]}')
+            return False
+
+        logging.info(f'calibrated {name} at {level:.3f} V')
+        self._levels[name] = level
+        self._calibrating.pop(0)
+        self._ladder = Ladder(self._levels, self._tolerance)
+        return True
+
+    def sample(self, voltage):
+        """ Classify a voltage, returns (event, name, held) tuples """
+
+        if self._calibrating:
+            with self._lock:
+                learned = self._calibrating and self._learn(voltage)
+            if learned:
+                self.save()
+            return []
+
+        return self._tracker.sample(self._ladder.classify(voltage))
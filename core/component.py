@@ -1,3 +1,4 @@
+import time
 
 
 class Component:
@@ -8,6 +9,17 @@ class Component:
         self._state = state
         self._queue = queue
         self._asleep = False
+        self._service = None
+
+    @property
+    def workers(self):
+        """ Workers owned by this component """
+        return []
+
+    @property
+    def statistics(self):
+        """ Counters exposed for monitoring (or None) """
+        return None
 
     @property
     def asleep(self):
@@ -19,17 +31,51 @@ class Component:
 
     def command(self, command, *params, **kwargs):
         """ Shorthand to fire a command """
-        self._queue.enqueue(command, *params, **kwargs)
+        self._queue.submit(self, command, *params, **kwargs)
 
     def update(self):
         """ Called upon state changes """
         pass
 
+    def close(self):
+        """ Release resources once removed (workers are stopped before) """
+        pass
+
 
 class PollingComponent(Component):
 
-    def __init__(self, pi, state, queue):
+    def __init__(self, pi, state, queue, interval=0.05):
         super().__init__(pi, state, queue)
+        self._interval = interval
+        self._scheduler = None
+
+    @property
+    def asleep(self):
+        return self._asleep
+
+    @asleep.setter
+    def asleep(self, asleep):
+        self._asleep = asleep
+
+        # resume polling immediately
+        if not asleep and self._scheduler is not None:
+            self._scheduler.schedule(self, time.monotonic(), earlier=True)
+
+    @property
+    def interval(self):
+        """ Seconds until the next poll """
+        return self._interval
+
+    @interval.setter
+    def interval(self, interval):
+        if interval == self._interval:
+            return
+        self._interval = interval
+
+        # pull in the next deadline if the interval shrinks
+        if self._scheduler is not None:
+            self._scheduler.schedule(
+                self, time.monotonic() + interval, earlier=True)
 
     def poll(self):
         """ Called in main polling loop (if not asleep) """
@@ -0,0 +1,404 @@
+from . import pins
+
+import copy
+import json
+import logging
+import os
+
+
+def _merge(base, override):
+    """ Merge nested dicts (other values are replaced) """
+
+    merged = dict(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def _require(condition, message):
+    if not condition:
+        raise ValueError(message)
+
+
+def _address(value):
+    """ (host, port) of 'host:port' """
+
+    _require(isinstance(value, str), f'{value!r} must be host:port')
+    (host, _, port) = value.rpartition(':')
+    _require(host and port.isdigit(), f'{value!r} must be host:port')
+    return (host, int(port))
+
+
+def _describe(expected):
+    names = {
+        dict: 'an object', str: 'a string', int: 'an integer',
+        type(None): 'null'}
+    if isinstance(expected, tuple):
+        return ' or '.join(names[type] for type in expected)
+    return names[expected]
+
+
+class Device:
+    """ Serial connection to a single main unit """
+
+    def __init__(self, id, port, max_volume):
+        self.id = id
+        self.port = port
+        self.max_volume = max_volume
+
+
+class Config:
+    """ Validated configuration, compiled into lookups once loaded """
+
+    Defaults = {
+        # first device is the primary one (panel, IR, timers)
+        'devices': {'main': {'port': '/dev/ttyAMA0'}},
+        'serial': {'baudrate': 57600, 'timeout': 1.0},
+        'max_volume': 43,
+
+        # GPIO wiring (BCM numbers, see core/pins.py)
+        'pins': {},
+
+        # remote codes per action and seconds until an action is repeated
+        'ir': {
+            'device': '/dev/input/event1',
+            'codes': {
+                'power': 172160,
+                'input': 172040,
+                'mute': 172266,
+                'level': 172042,
+                'effect': 172046,
+                'volume_up': 172202,
+                'volume_down': 172138,
+            },
+            'delays': {
+                'power': 2.0,
+                'input': 0.25,
+                'mute': 0.25,
+                'level': 0.25,
+                'effect': 0.25,
+                'volume_up': 0.1,
+                'volume_down': 0.1,
+            },
+            'repeatable': ['volume_up', 'volume_down'],
+        },
+
+        # analog buttons (samples until press, release, hold and repeat)
+        'buttons': {
+            'path': 'buttons.json',
+            'tolerance': 0.1,
+            'press': 2,
+            'release': 2,
+            'hold': 25,
+            'repeat': 10,
+        },
+
+        # milliseconds of GPIO debouncing
+        'debounce': {'power': 200, 'rotary': 20},
+
+        'presets': 'presets.json',
+        'schedules': 'schedules.json',
+        'history': 4096,
+        'socket': '/tmp/z906.sock',
+
+        # TCP address of the control socket for peers (e.g. '0.0.0.0:9060')
+        'listen': None,
+
+        # peers commanded together, e.g. {'members': {'kitchen': 'host:9060'}}
+        'group': None,
+
+        'mqtt': None,
+        'activity': None,
+        'log_level': 'INFO',
+        'trace': None,
+        'realtime': None,
+    }
+
+    # type of every section (optional ones may be null)
+    Types = {
+        'devices': dict,
+        'serial': dict,
+        'max_volume': int,
+        'pins': dict,
+        'ir': dict,
+        'buttons': dict,
+        'debounce': dict,
+        'presets': str,
+        'schedules': str,
+        'history': int,
+        'socket': str,
+        'listen': (str, type(None)),
+        'group': (dict, type(None)),
+        'mqtt': (str, type(None)),
+        'activity': (dict, type(None)),
+        'log_level': str,
+        'trace': (str, type(None)),
+        'realtime': (dict, type(None)),
+    }
+
+    # sections applied without restarting the service (devices, ir and
+    # buttons only as long as ports and paths stay the same)
+    Reloadable = (
+        'devices', 'max_volume', 'ir', 'buttons', 'debounce', 'socket',
+        'listen', 'group', 'mqtt', 'activity', 'log_level')
+
+    def __init__(self, data=None):
+        self._data = _merge(Config.Defaults, data or {})
+        if data and 'devices' in data:
+            self._data['devices'] = data['devices']
+        self._compile()
+
+    @staticmethod
+    def environment(environ):
+        """ Configuration given by (legacy) environment variables """
+
+        data = {}
+        if 'Z906_DEVICES' in environ:
+            data['devices'] = {
+                id: {'port': port}
+                for (id, port) in (
+                    entry.split('=', 1)
+                    for entry in environ['Z906_DEVICES'].split(','))
+            }
+        if 'Z906_PRESETS' in environ:
+            data['presets'] = environ['Z906_PRESETS']
+        if 'Z906_SCHEDULES' in environ:
+            data['schedules'] = environ['Z906_SCHEDULES']
+        if 'Z906_BUTTONS' in environ:
+            data['buttons'] = {'path': environ['Z906_BUTTONS']}
+        if 'Z906_HISTORY' in environ:
+            data['history'] = int(environ['Z906_HISTORY'])
+        if 'Z906_SOCKET' in environ:
+            data['socket'] = environ['Z906_SOCKET']
+        if 'Z906_LISTEN' in environ:
+            data['listen'] = environ['Z906_LISTEN']
+        if 'Z906_GROUP' in environ:
+            data['group'] = {'members': dict(
+                entry.split('=', 1)
+                for entry in environ['Z906_GROUP'].split(','))}
+        if 'Z906_MQTT' in environ:
+            data['mqtt'] = environ['Z906_MQTT']
+        if 'Z906_ACTIVITY' in environ:
+            data['activity'] = {
+                'path': environ['Z906_ACTIVITY'],
+                'idle': float(environ.get('Z906_IDLE', 600)),
+            }
+        if 'Z906_LOG_LEVEL' in environ:
+            data['log_level'] = environ['Z906_LOG_LEVEL']
+        if 'Z906_TRACE' in environ:
+            data['trace'] = environ['Z906_TRACE']
+        realtime = {
+            key: environ[name]
+            for key, name in (
+                ('priority', 'Z906_REALTIME'),
+                ('nice', 'Z906_NICE'),
+                ('cpus', 'Z906_CPUS'))
+            if name in environ
+        }
+        if realtime:
+            data['realtime'] = realtime
+        return data
+
+    @staticmethod
+    def load(path, environ=None):
+        """ Environment overridden by the file (raises ValueError if invalid) """
+
+        data = Config.environment(os.environ if environ is None else environ)
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path) as file:
+                    content = json.load(file)
+            except OSError as e:
+                raise ValueError(f'unreadable config {path}: {e}')
+            _require(isinstance(content, dict), 'config must be an object')
+            devices = content.get('devices', data.get('devices'))
+            data = _merge(data, content)
+            if devices is not None:
+                data['devices'] = devices
+        return Config(data)
+
+    def _compile(self):
+        """ Validate and build lookups (raises ValueError naming the section) """
+
+        data = self._data
+        unknown = set(data) - set(Config.Defaults)
+        _require(not unknown, f'unknown sections: {", ".join(sorted(unknown))}')
+
+        # booleans are integers in python but not in a config file
+        for name, expected in Config.Types.items():
+            value = data[name]
+            if not isinstance(value, expected) or isinstance(value, bool):
+                raise ValueError(f'{name} must be {_describe(expected)}')
+
+        for name in Config.Defaults:
+            try:
+                getattr(self, f'_compile_{name}')(data[name])
+            except ValueError as e:
+                raise ValueError(f'{name}: {e}') from e
+            except KeyError as e:
+                raise ValueError(f'{name}: missing {e}') from e
+            except (TypeError, AttributeError) as e:
+                raise ValueError(f'{name}: invalid value ({e})') from e
+
+    def _compile_devices(self, devices):
+        max_volume = self._data['max_volume']
+        _require(devices, 'at least one device is required')
+        self.devices = []
+        for id, device in devices.items():
+            if isinstance(device, str):
+                device = {'port': device}
+            _require(isinstance(device, dict), f'{id} must be a port or object')
+            _require(isinstance(device.get('port'), str), f'{id} needs a port')
+            volume = device.get('max_volume', max_volume)
+            _require(
+                isinstance(volume, int) and not isinstance(volume, bool)
+                and 0 < volume <= 255,
+                f'max_volume of {id} must be within 1..255')
+            self.devices.append(Device(id, device['port'], volume))
+
+    def _compile_serial(self, serial):
+        self.baudrate = int(serial['baudrate'])
+        self.timeout = float(serial['timeout'])
+        _require(self.baudrate > 0, 'baudrate must be positive')
+        _require(self.timeout > 0, 'timeout must be positive')
+
+    def _compile_max_volume(self, max_volume):
+        _require(0 < max_volume <= 255, 'must be within 1..255')
+
+    def _compile_pins(self, wiring):
+        """ Rewired pins (names of core/pins.py) """
+
+        self.pins = {}
+        for name, pin in wiring.items():
+            _require(name.upper() in pins.Names, f'unknown pin {name}')
+            _require(
+                isinstance(pin, int) and 0 <= pin <= 27,
+                f'{name} must be within 0..27')
+            self.pins[name.upper()] = pin
+
+        merged = {**pins.Defaults, **self.pins}
+        _require(len(set(merged.values())) == len(merged), 'must be unique')
+
+    def _compile_ir(self, ir):
+        """ IR code -> (action, delay, repeatable) """
+
+        _require(isinstance(ir['device'], str), 'device must be a path')
+        _require(isinstance(ir['codes'], dict), 'codes must be an object')
+        _require(isinstance(ir['delays'], dict), 'delays must be an object')
+        _require(isinstance(ir['repeatable'], list), 'repeatable must be a list')
+
+        self.ir_device = ir['device']
+        self.ir = {}
+        for action, code in ir['codes'].items():
+            _require(
+                action in Config.Defaults['ir']['codes'],
+                f'unknown action {action}')
+            code = int(code)
+            _require(code not in self.ir, f'duplicate code {code}')
+            delay = float(ir['delays'].get(action, 0.25))
+            _require(delay >= 0, f'negative delay of {action}')
+            self.ir[code] = (action, delay, action in ir['repeatable'])
+
+    def _compile_buttons(self, buttons):
+        _require(isinstance(buttons['path'], str), 'path must be a string')
+        self.buttons_path = buttons['path']
+        self.tolerance = float(buttons['tolerance'])
+        _require(0 < self.tolerance < 1, 'tolerance must be within 0..1')
+        self.tracker = {
+            key: int(buttons[key])
+            for key in ('press', 'release', 'hold', 'repeat')
+        }
+        _require(
+            all(value > 0 for value in self.tracker.values()),
+            'sample counts must be positive')
+
+    def _compile_debounce(self, debounce):
+        self.debounce = {key: int(value) for key, value in debounce.items()}
+        _require(
+            all(value >= 0 for value in self.debounce.values()),
+            'must not be negative')
+
+    def _compile_presets(self, path):
+        self.presets = path
+
+    def _compile_schedules(self, path):
+        self.schedules = path
+
+    def _compile_history(self, history):
+        _require(history > 0, 'must be positive')
+        self.history = history
+
+    def _compile_socket(self, path):
+        self.socket = path
+
+    def _compile_listen(self, listen):
+        self.listen = None if listen is None else _address(listen)
+
+    def _compile_group(self, group):
+        """ name -> (host, port) of peer instances """
+
+        self.group = None
+        if group is None:
+            return
+
+        members = group['members']
+        _require(
+            isinstance(members, dict) and members, 'members must be an object')
+        self.group = (
+            {name: _address(address) for name, address in members.items()},
+            float(group.get('timeout', 1.0)),
+            bool(group.get('local', True)))
+        _require(self.group[1] > 0, 'timeout must be positive')
+
+    def _compile_mqtt(self, mqtt):
+        self.mqtt = None
+        if mqtt:
+            (host, _, port) = mqtt.partition(':')
+            self.mqtt = (host, int(port or 1883))
+
+    def _compile_activity(self, activity):
+        self.activity = None
+        if activity is not None:
+            _require(isinstance(activity['path'], str), 'path must be a string')
+            self.activity = (
+                activity['path'], float(activity.get('idle', 600)))
+
+    def _compile_log_level(self, level):
+        _require(
+            isinstance(logging.getLevelName(level), int),
+            f'unknown level {level}')
+        self.log_level = level
+
+    def _compile_trace(self, path):
+        self.trace = path
+
+    def _compile_realtime(self, realtime):
+        """ (priority, nice, cpus) of latency-critical threads """
+
+        self.realtime = None
+        if realtime is None:
+            return
+
+        cpus = realtime.get('cpus')
+        if isinstance(cpus, str):
+            cpus = cpus.split(',')
+        self.realtime = (
+            None if realtime.get('priority') is None
+            else int(realtime['priority']),
+            None if realtime.get('nice') is None
+            else int(realtime['nice']),
+            None if cpus is None else [int(cpu) for cpu in cpus])
+
+    def section(self, name):
+        return copy.deepcopy(self._data[name])
+
+    def changed(self, other):
+        """ Sections that differ from another configuration """
+
+        return [
+            name for name in Config.Defaults
+            if self._data[name] != other._data[name]
+        ]
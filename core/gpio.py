@@ -0,0 +1,69 @@
+import collections
+
+
+class Gpio:
+    """ pigpio proxy that groups pin operations and counts round trips """
+
+    def __init__(self, pi):
+        self._pi = pi
+        self._modes = {}
+        self._calls = collections.Counter()
+
+    def __getattr__(self, name):
+        attribute = getattr(self._pi, name)
+        if not callable(attribute):
+            return attribute
+
+        # every call is a round trip to the daemon
+        def call(*args, **kwargs):
+            self._calls[name] += 1
+            return attribute(*args, **kwargs)
+        return call
+
+    @property
+    def round_trips(self):
+        return sum(self._calls.values())
+
+    @property
+    def statistics(self):
+        return {
+            'round_trips': self.round_trips,
+            'calls': dict(self._calls),
+        }
+
+    @staticmethod
+    def masks(levels):
+        """ Bank masks (set, clear) of the given levels (pin -> level) """
+
+        (high, low) = (0, 0)
+        for pin, level in levels.items():
+            if level:
+                high |= 1 << pin
+            else:
+                low |= 1 << pin
+        return (high, low)
+
+    def write_bank(self, levels):
+        """ Write levels of bank 1 pins with at most two round trips """
+
+        (high, low) = Gpio.masks(levels)
+        if high:
+            self.set_bank_1(high)
+        if low:
+            self.clear_bank_1(low)
+
+    def set_modes(self, pins, mode):
+        """ Set the mode of pins (pigpio has no bank call for modes, pins
+            already set through this layer are skipped) """
+
+        for pin in pins:
+            if self._modes.get(pin) != mode:
+                self.set_mode(pin, mode)
+                self._modes[pin] = mode
+
+    def outputs(self, levels, mode):
+        """ Configure pins as outputs at the given levels """
+
+        # latch levels first, pins start driving without glitches
+        self.write_bank(levels)
+        self.set_modes(levels, mode)
@@ -0,0 +1,184 @@
+from .types import Speakers, Input, Effect, Stage
+
+from array import array
+
+import threading
+import time
+
+
+class History:
+    """ Fixed-size ring of state changes (one slot per array column) """
+
+    # recorded fields (prediction keys), stored by index
+    Fields = [
+        'stage', 'mute', 'input', 'speakers',
+        *(('volume', speakers) for speakers in Speakers),
+        *(('effect', input) for input in Input),
+    ]
+
+    # values stored as their integer and reported by name
+    Names = {
+        'stage': Stage,
+        'input': Input,
+        'speakers': Speakers,
+        'effect': Effect,
+    }
+
+    # source of changes not caused by a local command (e.g. the main unit)
+    Device = 'device'
+
+    def __init__(self, size=4096):
+        self._size = size
+        self._indices = {key: index for index, key in enumerate(History.Fields)}
+
+        # columns (monotonic timestamp, field, old, new, source)
+        self._times = array('d', bytes(8 * size))
+        self._fields = array('B', bytes(size))
+        self._old = array('h', bytes(2 * size))
+        self._new = array('h', bytes(2 * size))
+        self._sources = array('B', bytes(size))
+
+        # source names by index (components are few and long-lived)
+        self._names = [History.Device]
+
+        # total number of appended changes
+        self._count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def memory(self):
+        """ Bytes held by the ring (fixed once created) """
+
+        return sum(
+            column.itemsize * len(column) for column in (
+                self._times, self._fields, self._old, self._new,
+                self._sources))
+
+    @property
+    def statistics(self):
+        return {
+            'size': self._size,
+            'recorded': self._count,
+            'memory': self.memory,
+        }
+
+    def _source(self, name):
+        try:
+            return self._names.index(name)
+        except ValueError:
+            if len(self._names) > 255:
+                return 0
+            self._names.append(name)
+            return len(self._names) - 1
+
+    def append(self, key, old, new, source=None):
+        """ Record a change (O(1), overwrites the oldest) """
+
+        with self._lock:
+            slot = self._count % self._size
+            self._times[slot] = time.monotonic()
+            self._fields[slot] = self._indices[key]
+            self._old[slot] = round(old)
+            self._new[slot] = round(new)
+            self._sources[slot] = self._source(source or History.Device)
+            self._count += 1
+
+    @staticmethod
+    def name(key):
+        """ Field name as reported (e.g. 'volume.Master') """
+
+        if isinstance(key, tuple):
+            return f'{key[0]}.{key[1].name}'
+        return key
+
+    @staticmethod
+    def _value(key, value):
+        kind = key[0] if isinstance(key, tuple) else key
+        if kind == 'mute':
+            return bool(value)
+        if kind in History.Names:
+            # bytes of the device outside the enum are reported raw
+            try:
+                return History.Names[kind](value).name
+            except ValueError:
+                return value
+        return value
+
+    @staticmethod
+    def _wall():
+        """ Wall clock minus monotonic clock (changes on clock steps) """
+
+        return time.time() - time.monotonic()
+
+    def _first(self, start, end, since):
+        """ First position (logical) not older than since (bisect) """
+
+        while start < end:
+            middle = (start + end) // 2
+            if self._times[middle % self._size] < since:
+                start = middle + 1
+            else:
+                end = middle
+        return start
+
+    def query(self, since=None, until=None, field=None, offset=0, limit=100):
+        """ Changes within [since, until) of the field, oldest first
+
+            Times are epoch seconds. Changes are stored with monotonic
+            timestamps and reported relative to the current wall clock,
+            so clock steps (e.g. NTP after boot) keep their order. """
+
+        wall = History._wall()
+
+        with self._lock:
+            end = self._count
+            start = max(end - self._size, 0)
+
+            # timestamps grow along the ring
+            if since is not None:
+                start = self._first(start, end, since - wall)
+            if until is not None:
+                end = self._first(start, end, until - wall)
+
+            positions = range(start, end)
+            if field is not None:
+                index = self._indices[field]
+                positions = [
+                    position for position in positions
+                    if self._fields[position % self._size] == index]
+
+            total = len(positions)
+            entries = []
+            for position in positions[offset:offset + limit]:
+                slot = position % self._size
+                key = History.Fields[self._fields[slot]]
+                entries.append({
+                    'time': self._times[slot] + wall,
+                    'field': History.name(key),
+                    'old': History._value(key, self._old[slot]),
+                    'new': History._value(key, self._new[slot]),
+                    'source': self._names[self._sources[slot]],
+                })
+
+        return {'total': total, 'entries': entries}
+
+    @staticmethod
+    def parse(name):
+        """ Field key from its reported name """
+
+        (kind, _, member) = name.partition('.')
+        if kind == 'volume' and member:
+            return ('volume', Speakers[member])
+        if kind == 'effect' and member:
+            return ('effect', Input[member])
+        if name in History.Fields:
+            return name
+        raise KeyError(name)
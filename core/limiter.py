@@ -0,0 +1,89 @@
+import time
+
+
+class TokenBucket:
+    """ Classic token bucket (rate in tokens per second) """
+
+    def __init__(self, rate, burst):
+        self._rate = rate
+        self._burst = burst
+        self._tokens = burst
+        self._stamp = time.monotonic()
+
+    def _refill(self, now):
+        self._tokens = min(
+            self._burst, self._tokens + (now - self._stamp) * self._rate)
+        self._stamp = now
+
+    def delay(self):
+        """ Seconds until a token is available """
+
+        self._refill(time.monotonic())
+        if self._tokens >= 1:
+            return 0.0
+        return (1 - self._tokens) / self._rate
+
+    def take(self):
+        self._refill(time.monotonic())
+        self._tokens -= 1
+
+
+class Shaper:
+    """ Limits commands per class by shaping (delay) or dropping """
+
+    Shape = 'shape'
+    Drop = 'drop'
+    Pass = 'pass'
+
+    def __init__(self, classes, limits):
+        """ classes maps commands to class names, limits maps class names
+            to (policy, rate, burst) """
+
+        self._classes = classes
+        self._policies = {}
+        self._buckets = {}
+        self._counters = {}
+
+        for name, (policy, rate, burst) in limits.items():
+            self._policies[name] = policy
+            if policy != Shaper.Pass:
+                self._buckets[name] = TokenBucket(rate, burst)
+            self._counters[name] = {
+                'admitted': 0,
+                'shaped': 0,
+                'delay': 0.0,
+                'dropped': 0,
+            }
+
+    @property
+    def statistics(self):
+        return {
+            name: dict(counters)
+            for name, counters in self._counters.items()
+        }
+
+    def admit(self, command):
+        """ Blocks until the command may be sent, False if dropped """
+
+        name = self._classes.get(command)
+        bucket = self._buckets.get(name)
+        if bucket is None:
+            if name in self._counters:
+                self._counters[name]['admitted'] += 1
+            return True
+
+        counters = self._counters[name]
+        delay = bucket.delay()
+        if delay > 0:
+            if self._policies[name] == Shaper.Drop:
+                counters['dropped'] += 1
+                return False
+
+            # shape (wait for the next token)
+            counters['shaped'] += 1
+            counters['delay'] += delay
+            time.sleep(delay)
+
+        bucket.take()
+        counters['admitted'] += 1
+        return True
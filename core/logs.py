@@ -0,0 +1,86 @@
+import collections
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+
+class RateLimit(logging.Filter):
+    """ Limits the records per call site (errors always pass) """
+
+    def __init__(self, burst=10, interval=10.0):
+        super().__init__()
+        self._burst = burst
+        self._interval = interval
+        self._sites = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR:
+            return True
+
+        site = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            (start, count, suppressed) = self._sites.get(site, (now, 0, 0))
+
+            # new window, report what was suppressed in the last one
+            if now - start >= self._interval:
+                if suppressed:
+                    record.msg = f'{record.msg} ({suppressed} suppressed)'
+                (start, count, suppressed) = (now, 0, 0)
+
+            if count >= self._burst:
+                self._sites[site] = (start, count, suppressed + 1)
+                return False
+
+            self._sites[site] = (start, count + 1, suppressed)
+            return True
+
+
+class Traffic:
+    """ Fixed-size ring of recent protocol traffic """
+
+    def __init__(self, size=512):
+        self._entries = collections.deque(maxlen=size)
+
+    def record(self, direction, label, data):
+        self._entries.append((time.monotonic(), direction, label, data))
+
+    def entries(self, limit=None):
+        """ Recent entries (newest last), ages in seconds """
+
+        now = time.monotonic()
+        entries = list(self._entries)
+        if limit is not None:
+            entries = entries[-limit:]
+
+        return [
+            {
+                'age': now - timestamp,
+                'direction': direction,
+                'label': label,
+                'data': data.hex(),
+            }
+            for (timestamp, direction, label, data) in entries
+        ]
+
+
+def setup(level=logging.INFO, burst=10, interval=10.0):
+    """ Log through a background thread with per call site rate limits """
+
+    records = queue.SimpleQueue()
+
+    handler = logging.handlers.QueueHandler(records)
+    handler.addFilter(RateLimit(burst, interval))
+
+    output = logging.StreamHandler()
+    output.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    listener = logging.handlers.QueueListener(records, output)
+    listener.start()
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(handler)
+    return listener
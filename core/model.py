@@ -1,6 +1,9 @@
 from .types import Speakers, Input, Effect, Stage
+from .prediction import Predicted
+from .history import History
 
 import threading
+import time
 
 
 class Queue:
@@ -9,12 +12,25 @@ class Queue:
     def __init__(self):
         self._event = threading.Event()
         self._queue = []
+        self._listeners = []
 
     @property
     def drained(self):
         return not self._queue
 
+    def listen(self, listener):
+        """ Get notified about enqueued commands and their source """
+        self._listeners.append(listener)
+
     def enqueue(self, command, *params, **kwargs):
+        self.submit(None, command, *params, **kwargs)
+
+    def submit(self, source, command, *params, **kwargs):
+        """ Enqueue command on behalf of the given source """
+
+        for listener in self._listeners:
+            listener(source, command, params, kwargs)
+
         self._queue.append((command, params, kwargs))
         self._event.set()
 
@@ -25,15 +41,18 @@ class Queue:
     def clear(self):
         self._event.clear()
 
-    def wait(self):
-        self._event.wait()
+    def wait(self, timeout=None):
+        self._event.wait(timeout)
 
 
 class State:
     """ Stores the actual device state """
 
-    def __init__(self, max_volume=43):
+    def __init__(self, max_volume=43, history=4096):
         self._max_volume = max_volume
+
+        # master volume cap (e.g. quiet hours) on top of the maximum
+        self._cap = None
         self._stage = Stage.Off
         self._mute = False
         self._decode = False
@@ -43,9 +62,9 @@ class State:
         # volumes per speakers
         self._volumes = {
             Speakers.Master: 0,
-            Speakers.Rear: max_volume / 2,
-            Speakers.Center: max_volume / 2,
-            Speakers.Sub: max_volume / 2,
+            Speakers.Rear: max_volume // 2,
+            Speakers.Center: max_volume // 2,
+            Speakers.Sub: max_volume // 2,
         }
 
         # effects per input
@@ -55,9 +74,47 @@ class State:
             Input.Aux: Effect._2_1,
         }
 
+        # optimistic changes (key -> (value, deadline))
+        self._predictions = {}
+        self._lock = threading.Lock()
+
+        # components that caused predictions (key -> name)
+        self._sources = {}
+        self._history = History(history)
+
         # change notification
         self._event = threading.Event()
 
+    @property
+    def max_volume(self):
+        return self._max_volume
+
+    @max_volume.setter
+    def max_volume(self, max_volume):
+        self._max_volume = max_volume
+
+        # limits are enforced with the next update
+        self._event.set()
+
+    @property
+    def cap(self):
+        return self._cap
+
+    @cap.setter
+    def cap(self, cap):
+        self._cap = cap
+
+    def limit(self, speakers):
+        """ Highest volume of the speakers (maximum and cap) """
+
+        if self._cap is not None and speakers == Speakers.Master:
+            return min(self._max_volume, self._cap)
+        return self._max_volume
+
+    @property
+    def history(self):
+        return self._history
+
     @property
     def stage(self):
         return self._stage
@@ -110,8 +167,87 @@ class State:
     def off(self):
         return self._stage == Stage.Off
 
+    @property
+    def predicted(self):
+        """ State as expected once pending commands are confirmed """
+        return Predicted(self)
+
+    @property
+    def pending(self):
+        """ Keys of unconfirmed predictions """
+
+        with self._lock:
+            return list(self._predictions)
+
+    @property
+    def expiry(self):
+        """ Seconds until the next prediction times out (or None) """
+
+        now = time.monotonic()
+        with self._lock:
+            for key, (_, deadline) in list(self._predictions.items()):
+                if deadline <= now:
+                    del self._predictions[key]
+
+            if not self._predictions:
+                return None
+            deadline = min(
+                deadline for (_, deadline) in self._predictions.values())
+        return max(deadline - now, 0)
+
+    def predict(self, key, value, timeout, source=None):
+        """ Display value for key until confirmed or timed out """
+
+        with self._lock:
+            self._predictions[key] = (value, time.monotonic() + timeout)
+            self._sources[key] = source
+        self._event.set()
+
+    def _get(self, key):
+        if isinstance(key, tuple):
+            (kind, member) = key
+            fields = self._volumes if kind == 'volume' else self._effects
+            return fields.get(member)
+        return getattr(self, f'_{key}')
+
+    def change(self, key, value, source=None):
+        """ Set a field by its prediction key and record the change """
+
+        with self._lock:
+            old = self._get(key)
+            if old == value:
+                return
+
+            # attributed to the command that predicted it (if still pending)
+            if source is None and key in self._predictions:
+                source = self._sources.get(key)
+
+            if isinstance(key, tuple):
+                (kind, member) = key
+                fields = self._volumes if kind == 'volume' else self._effects
+                fields[member] = value
+            else:
+                setattr(self, f'_{key}', value)
+
+        if old is not None:
+            self._history.append(key, old, value, source)
+
+    def prediction(self, key, confirmed):
+        """ Predicted value for key (drops confirmed and expired ones) """
+
+        with self._lock:
+            entry = self._predictions.get(key)
+            if entry is None:
+                return confirmed
+
+            (value, deadline) = entry
+            if value == confirmed or deadline <= time.monotonic():
+                del self._predictions[key]
+                return confirmed
+            return value
+
     def clear(self):
         self._event.clear()
 
-    def wait(self):
-        self._event.wait()
+    def wait(self, timeout=None):
+        self._event.wait(timeout)
@@ -18,3 +18,12 @@ Q13 = 7
 
 POTI_1 = 22
 POTI_2 = 27
+
+# names that may be rewired by the configuration (and their default pins)
+Names = [name for name in dir() if name.isupper()]
+Defaults = {name: globals()[name] for name in Names}
+
+
+def configure(wiring):
+    """ Apply a wiring (name -> pin), before components are imported """
+    globals().update(wiring)
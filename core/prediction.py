@@ -0,0 +1,128 @@
+from .types import Commands, Speakers, Effect, Stage
+
+
+class Predicted:
+    """ View on a state overlaid with unconfirmed predictions """
+
+    def __init__(self, state):
+        self._state = state
+
+    def __getattr__(self, name):
+        return getattr(self._state, name)
+
+    @property
+    def mute(self):
+        return self._state.prediction('mute', self._state.mute)
+
+    @property
+    def input(self):
+        return self._state.prediction('input', self._state.input)
+
+    @property
+    def volumes(self):
+        return {
+            speakers: self._state.prediction(('volume', speakers), volume)
+            for speakers, volume in self._state.volumes.items()
+        }
+
+    @property
+    def effects(self):
+        return {
+            input: self._state.prediction(('effect', input), effect)
+            for input, effect in self._state.effects.items()
+        }
+
+    @property
+    def volume(self):
+        return self.volumes.get(self._state.speakers, 0)
+
+    @property
+    def effect(self):
+        return self.effects.get(self.input, Effect.Dolby)
+
+
+class Predictor:
+    """ Predicts the outcome of enqueued commands for display """
+
+    # seconds until unconfirmed predictions are rolled back
+    Timeout = 1.0
+
+    # seconds until power changes are expected to be completed
+    PowerTimeout = 10.0
+
+    def __init__(self, state, queue):
+        self._state = state
+        self._handlers = {
+            Commands.TurnOn: self._turn_on,
+            Commands.TurnOff: self._turn_off,
+            Commands.Mute: self._mute,
+            Commands.Unmute: self._unmute,
+            Commands.VolumeUp: self._volume_up,
+            Commands.VolumeDown: self._volume_down,
+            Commands.SelectInput: self._select_input,
+            Commands.SelectEffect: self._select_effect,
+            Commands.ApplyPreset: self._apply_preset,
+        }
+
+        queue.listen(self._on_command)
+
+    def _on_command(self, source, command, params, kwargs):
+        handler = self._handlers.get(command)
+        if handler is None:
+            return
+
+        # power changes are recorded to attribute them in the history
+        power = command in (Commands.TurnOn, Commands.TurnOff)
+        if power or self._state.ready:
+            name = 'external' if source is None else type(source).__name__
+            handler(name, *params, **kwargs)
+
+    def _predict(self, source, key, value, timeout=Timeout):
+        self._state.predict(key, value, timeout, source)
+
+    def _turn_on(self, source):
+        self._predict(source, 'stage', Stage.Ready, Predictor.PowerTimeout)
+
+    def _turn_off(self, source):
+        self._predict(source, 'stage', Stage.Off, Predictor.PowerTimeout)
+
+    def _mute(self, source):
+        self._predict(source, 'mute', True)
+
+    def _unmute(self, source):
+        self._predict(source, 'mute', False)
+
+    def _step(self, source, speakers, delta):
+        if speakers is None:
+            speakers = self._state.speakers
+
+        volume = self._state.predicted.volumes.get(speakers)
+        if volume is None:
+            return
+
+        # same limits as the validator (maximum and quiet hours cap)
+        volume = max(0, min(volume + delta, self._state.limit(speakers)))
+        self._predict(source, ('volume', speakers), volume)
+
+    def _volume_up(self, source, speakers=None):
+        self._step(source, speakers, 1)
+
+    def _volume_down(self, source, speakers=None):
+        self._step(source, speakers, -1)
+
+    def _select_input(self, source, input):
+        self._predict(source, 'input', input)
+
+    def _select_effect(self, source, effect, input=None):
+        if input is None:
+            input = self._state.predicted.input
+        self._predict(source, ('effect', input), effect)
+
+    def _apply_preset(self, source, preset):
+        (volumes, input, effects) = preset.resolve(self._state.predicted)
+        for speakers, volume in volumes.items():
+            volume = max(0, min(volume, self._state.limit(speakers)))
+            self._predict(source, ('volume', speakers), volume)
+        for other, effect in effects.items():
+            self._predict(source, ('effect', other), effect)
+        self._predict(source, 'input', input)
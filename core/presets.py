@@ -0,0 +1,190 @@
+from .types import Speakers, Input, Effect
+from . import store
+
+import logging
+import threading
+
+
+class Preset:
+    """ Named (partial) device state """
+
+    # volumes are sent as single bytes (limited to max_volume when applied)
+    MaxVolume = 255
+
+    # inputs with an effect a state frame can carry (and the state tracks)
+    Effects = (Input.Input1, Input.Chinch, Input.Aux)
+
+    def __init__(self, name, volumes=None, input=None, effects=None, ir=None):
+        self._name = name
+        self._volumes = volumes or {}
+        self._input = input
+        self._effects = effects or {}
+        self._ir = ir
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def ir(self):
+        return self._ir
+
+    @staticmethod
+    def capture(name, state):
+        """ Create preset from the current state """
+
+        return Preset(
+            name,
+            volumes={
+                speakers: int(volume)
+                for speakers, volume in state.volumes.items()
+            },
+            input=state.input,
+            effects=dict(state.effects))
+
+    @staticmethod
+    def parse(name, data):
+        """ Create preset from its serialized form """
+
+        def member(enum, value):
+            return enum[value] if isinstance(value, str) else enum(value)
+
+        if not isinstance(data, dict):
+            raise ValueError(f'preset {name} must be an object')
+
+        volumes = {
+            member(Speakers, speakers): int(volume)
+            for speakers, volume in data.get('volumes', {}).items()
+        }
+        for speakers, volume in volumes.items():
+            if not 0 <= volume <= Preset.MaxVolume:
+                raise ValueError(f'volume of {speakers.name} out of range')
+
+        effects = {
+            member(Input, input): member(Effect, effect)
+            for input, effect in data.get('effects', {}).items()
+        }
+        for input in effects:
+            if input not in Preset.Effects:
+                raise ValueError(f'{input.name} has no selectable effect')
+
+        input = data.get('input')
+        return Preset(
+            name,
+            volumes=volumes,
+            input=None if input is None else member(Input, input),
+            effects=effects,
+            ir=data.get('ir'))
+
+    def serialize(self):
+        data = {
+            'volumes': {
+                speakers.name: volume
+                for speakers, volume in self._volumes.items()
+            },
+            'effects': {
+                input.name: effect.name
+                for input, effect in self._effects.items()
+            },
+        }
+        if self._input is not None:
+            data['input'] = self._input.name
+        if self._ir is not None:
+            data['ir'] = self._ir
+        return data
+
+    def resolve(self, state):
+        """ Merge preset into the current state (returns full state) """
+
+        volumes = {
+            speakers: int(volume)
+            for speakers, volume in state.volumes.items()
+        }
+        volumes.update(self._volumes)
+
+        effects = dict(state.effects)
+        effects.update(self._effects)
+
+        input = state.input if self._input is None else self._input
+        return (volumes, input, effects)
+
+
+class Presets:
+    """ Stores presets on disk """
+
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._presets = {}
+        self._listeners = []
+        self.load()
+
+    @property
+    def names(self):
+        return list(self._presets)
+
+    def get(self, name):
+        return self._presets.get(name)
+
+    def items(self):
+        """ Consistent snapshot of all (name, preset) pairs """
+
+        with self._lock:
+            return list(self._presets.items())
+
+    def listen(self, listener):
+        """ Get notified once presets are stored or removed """
+        self._listeners.append(listener)
+
+    def _changed(self):
+        for listener in self._listeners:
+            listener()
+
+    def following(self, name):
+        """ Get the preset after the given one (cycles) """
+
+        presets = dict(self.items())
+        names = list(presets)
+        if not names:
+            return None
+        if name not in names:
+            return presets[names[0]]
+        return presets[names[(names.index(name) + 1) % len(names)]]
+
+    def load(self):
+        try:
+            data = store.load(self._path)
+            if data is None:
+                return
+            if not isinstance(data, dict):
+                raise ValueError('presets must be an object')
+            self._presets = {
+                name: Preset.parse(name, content)
+                for name, content in data.items()
+            }
+        except (OSError, ValueError, KeyError):
+            logging.exception(f'invalid presets file: {self._path}')
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        store.save(self._path, {
+            name: preset.serialize()
+            for name, preset in self._presets.items()
+        })
+
+    def store(self, preset):
+        with self._lock:
+            self._presets[preset.name] = preset
+            self._save()
+        self._changed()
+
+    def remove(self, name):
+        with self._lock:
+            if self._presets.pop(name, None) is None:
+                return False
+            self._save()
+        self._changed()
+        return True
@@ -0,0 +1,113 @@
+import logging
+import os
+import threading
+
+
+class Profile:
+    """ Scheduling of latency-critical threads """
+
+    def __init__(self, priority=None, nice=None, cpus=None):
+        self._priority = priority
+        self._nice = nice
+        self._cpus = None if cpus is None else set(cpus)
+
+    def __str__(self):
+        parts = []
+        if self._priority is not None:
+            parts.append(f'fifo {self._priority}')
+        if self._nice is not None:
+            parts.append(f'nice {self._nice}')
+        if self._cpus is not None:
+            parts.append(f'cpus {",".join(map(str, sorted(self._cpus)))}')
+        return ', '.join(parts) or 'normal'
+
+    def apply(self, thread=None):
+        """ Apply to a thread (native id, defaults to the calling one) """
+
+        if thread is None:
+            thread = threading.get_native_id()
+
+        # nice is ignored while running fifo, but kept if that is not permitted
+        applied = []
+        if self._nice is not None:
+            try:
+                os.setpriority(os.PRIO_PROCESS, thread, self._nice)
+                applied.append(f'nice {self._nice}')
+            except OSError as e:
+                logging.warning(f'failed to set nice {self._nice}: {e}')
+
+        if self._priority is not None:
+            try:
+                os.sched_setscheduler(
+                    thread, os.SCHED_FIFO, os.sched_param(self._priority))
+                applied.append(f'fifo {self._priority}')
+            except OSError as e:
+                logging.warning(f'failed to set fifo {self._priority}: {e}')
+
+        if self._cpus is not None:
+            try:
+                os.sched_setaffinity(thread, self._cpus)
+                applied.append(f'cpus {",".join(map(str, sorted(self._cpus)))}')
+            except OSError as e:
+                logging.warning(f'failed to set affinity {self._cpus}: {e}')
+
+        return ', '.join(applied) or 'normal'
+
+
+def schedstat(thread):
+    """ (running, waiting) seconds and runs of a thread (or None) """
+
+    try:
+        with open(f'/proc/self/task/{thread}/schedstat') as file:
+            (running, waiting, runs) = file.read().split()[:3]
+    except (OSError, ValueError):
+        return None
+    return (int(running) / 1e9, int(waiting) / 1e9, int(runs))
+
+
+def statistics(thread, baseline=None):
+    """ Average wait for the CPU per run (scheduling latency) """
+
+    current = schedstat(thread)
+    if current is None:
+        return None
+
+    (running, waiting, runs) = current
+    if baseline is not None:
+        running -= baseline[0]
+        waiting -= baseline[1]
+        runs -= baseline[2]
+
+    return {
+        'runs': runs,
+        'running': running,
+        'waiting': waiting,
+        'latency_ms': waiting / runs * 1000 if runs else None,
+    }
+
+
+# profile of critical threads (normal scheduling by default)
+_profile = None
+
+
+def active():
+    return _profile
+
+
+def setup(profile):
+    """ Set the profile of critical workers started afterwards """
+
+    global _profile
+
+    _profile = profile
+    if profile is not None:
+        logging.info(f'critical threads scheduled with {profile}')
+
+
+def enter(critical):
+    """ Apply the profile to the calling thread (if critical) """
+
+    profile = _profile
+    if not critical or profile is None:
+        return 'normal'
+    return profile.apply()
@@ -0,0 +1,153 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+
+class Scheduler:
+    """ Polls components at their individual deadlines """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._sequence = itertools.count()
+        self._heap = []
+        self._entries = {}
+        self._components = []
+
+        # statistics
+        self._started = time.monotonic()
+        self._wakeups = 0
+        self._polls = 0
+        self._overruns = 0
+        self._jitter_total = 0.0
+        self._jitter_max = 0.0
+
+    @property
+    def statistics(self):
+        elapsed = max(time.monotonic() - self._started, 1e-9)
+        return {
+            'wakeups': self._wakeups,
+            'wakeups_per_second': self._wakeups / elapsed,
+            'polls': self._polls,
+            'overruns': self._overruns,
+            'jitter_mean': self._jitter_total / max(self._polls, 1),
+            'jitter_max': self._jitter_max,
+        }
+
+    def add(self, component):
+        """ Add a polling component to the schedule """
+
+        self._components.append(component)
+        component._scheduler = self
+        self.schedule(component, time.monotonic())
+
+    def remove(self, component):
+        """ Stop polling a component """
+
+        with self._lock:
+            if component in self._components:
+                self._components.remove(component)
+            entry = self._entries.pop(component, None)
+            if entry is not None:
+                entry[2] = None
+        component._scheduler = None
+
+    def schedule(self, component, deadline, earlier=False):
+        """ Set the next deadline of a component """
+
+        with self._lock:
+            old = self._entries.get(component)
+            if old is not None:
+                if earlier and old[0] <= deadline:
+                    return
+                # invalidate entry (removed lazily)
+                old[2] = None
+
+            entry = [deadline, next(self._sequence), component]
+            self._entries[component] = entry
+            heapq.heappush(self._heap, entry)
+
+        self._event.set()
+
+    def restart(self):
+        """ Reschedule all components and reset statistics """
+
+        now = time.monotonic()
+        for component in self._components:
+            if not component.asleep:
+                self.schedule(component, now)
+
+        self._started = now
+        self._wakeups = 0
+        self._polls = 0
+        self._overruns = 0
+        self._jitter_total = 0.0
+        self._jitter_max = 0.0
+
+    def wake(self):
+        """ Interrupt waiting for the next deadline """
+        self._event.set()
+
+    def _next_deadline(self):
+        with self._lock:
+            while self._heap and self._heap[0][2] is None:
+                heapq.heappop(self._heap)
+            if self._heap:
+                return self._heap[0][0]
+
+    def _pop_due(self, now):
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                (deadline, _, component) = heapq.heappop(self._heap)
+                if component is None:
+                    continue
+                del self._entries[component]
+                due.append((deadline, component))
+        return due
+
+    def step(self):
+        """ Wait for the next deadline and poll all due components """
+
+        self._event.clear()
+
+        # sleep until next deadline (or forever if all components sleep)
+        deadline = self._next_deadline()
+        if deadline is None:
+            self._event.wait()
+        else:
+            timeout = deadline - time.monotonic()
+            if timeout > 0 and self._event.wait(timeout):
+                return
+
+        self._wakeups += 1
+        now = time.monotonic()
+
+        for (deadline, component) in self._pop_due(now):
+
+            # park sleeping components until woken up
+            if component.asleep:
+                continue
+
+            # measure scheduling jitter
+            jitter = now - deadline
+            self._jitter_total += jitter
+            self._jitter_max = max(self._jitter_max, jitter)
+            self._polls += 1
+
+            try:
+                component.poll()
+            except Exception:
+                logging.exception(f'polling failed: {component}')
+
+            # keep cadence unless the loop fell behind
+            interval = component.interval
+            following = deadline + interval
+            finished = time.monotonic()
+            if following < finished:
+                self._overruns += 1
+                following = finished + interval
+
+            self.schedule(component, following)
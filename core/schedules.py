@@ -0,0 +1,160 @@
+from . import store
+
+import datetime
+import logging
+import threading
+
+
+def _clock(value):
+    """ Parse 'HH:MM' into a time """
+
+    (hour, minute) = value.split(':')
+    return datetime.time(int(hour), int(minute))
+
+
+class Schedule:
+    """ Recurring action at a wall-clock time """
+
+    # on, off, apply preset, cap volume until the end time
+    Actions = ('on', 'off', 'preset', 'quiet')
+
+    def __init__(self, name, at, action, days=None, preset=None,
+                 until=None, volume=None):
+        if action not in Schedule.Actions:
+            raise ValueError(f'unknown action: {action}')
+        if action == 'preset' and preset is None:
+            raise ValueError('missing preset')
+        if action == 'quiet' and (until is None or volume is None):
+            raise ValueError('quiet hours need until and volume')
+
+        self._name = name
+        self._at = at
+        self._action = action
+        self._days = set(range(7)) if days is None else set(days)
+        self._preset = preset
+        self._until = until
+        self._volume = volume
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def action(self):
+        return self._action
+
+    @property
+    def preset(self):
+        return self._preset
+
+    @property
+    def volume(self):
+        return self._volume
+
+    @staticmethod
+    def parse(name, data):
+        until = data.get('until')
+        volume = data.get('volume')
+        return Schedule(
+            name,
+            _clock(data['at']),
+            data['action'],
+            data.get('days'),
+            data.get('preset'),
+            None if until is None else _clock(until),
+            None if volume is None else int(volume))
+
+    def serialize(self):
+        data = {
+            'at': self._at.strftime('%H:%M'),
+            'action': self._action,
+            'days': sorted(self._days),
+        }
+        if self._preset is not None:
+            data['preset'] = self._preset
+        if self._until is not None:
+            data['until'] = self._until.strftime('%H:%M')
+        if self._volume is not None:
+            data['volume'] = self._volume
+        return data
+
+    def _starts(self, now):
+        """ Start times around now (yesterday to next week) """
+
+        for offset in range(-1, 8):
+            day = now.date() + datetime.timedelta(days=offset)
+            if day.weekday() in self._days:
+                yield datetime.datetime.combine(day, self._at)
+
+    def _end(self, start):
+        end = datetime.datetime.combine(start.date(), self._until)
+        if end <= start:
+            end += datetime.timedelta(days=1)
+        return end
+
+    def next(self, now):
+        """ Next wall-clock time an action is due (start or end) """
+
+        due = []
+        for start in self._starts(now):
+            if start > now:
+                due.append(start)
+            if self._until is not None and self._end(start) > now:
+                due.append(self._end(start))
+        return min(due, default=None)
+
+    def active(self, now):
+        """ Whether quiet hours are active at the given time """
+
+        if self._until is None:
+            return False
+        return any(
+            start <= now < self._end(start) for start in self._starts(now))
+
+
+class Schedules:
+    """ Stores schedules on disk """
+
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._schedules = {}
+        self.load()
+
+    @property
+    def names(self):
+        return list(self._schedules)
+
+    def get(self, name):
+        return self._schedules.get(name)
+
+    def load(self):
+        try:
+            data = store.load(self._path)
+            if data is None:
+                return
+            self._schedules = {
+                name: Schedule.parse(name, content)
+                for name, content in data.items()
+            }
+        except (OSError, ValueError, KeyError):
+            logging.exception(f'invalid schedules file: {self._path}')
+
+    def save(self):
+        data = {
+            name: schedule.serialize()
+            for name, schedule in self._schedules.items()
+        }
+
+        with self._lock:
+            store.save(self._path, data)
+
+    def store(self, schedule):
+        self._schedules[schedule.name] = schedule
+        self.save()
+
+    def remove(self, name):
+        if self._schedules.pop(name, None) is None:
+            return False
+        self.save()
+        return True
@@ -1,19 +1,82 @@
 from .component import ConsumingComponent, PollingComponent
+from .prediction import Predictor
+from .scheduler import Scheduler
 from .types import Stage
+from . import realtime
 
 import logging
 import threading
 import time
 
 
+class Token:
+    """ Cancellation token of a single worker cycle """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def on_cancel(self, callback):
+        """ Register callback to interrupt blocking calls """
+
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+
+        callback()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                logging.exception('cancellation callback failed')
+
+    def wait(self, timeout=None):
+        """ Sleep interruptibly, returns True if cancelled """
+        return self._event.wait(timeout)
+
+
 class Worker:
     """ Works on a specific loop """
 
-    def __init__(self, loop, description):
+    # seconds to wait for a stopping thread
+    JoinTimeout = 2.0
+
+    # restart delays after crashes
+    BackoffInitial = 0.5
+    BackoffMaximum = 30.0
+
+    def __init__(self, loop, description, critical=False):
         self._loop = loop
         self._description = description
+        self._critical = critical
         self._thread = None
         self._cycle = 1
+        self._token = Token()
+
+        # scheduling of the running thread (critical ones may be elevated)
+        self._native_id = None
+        self._scheduling = None
+        self._schedstat = None
+
+        # health information
+        self._status = 'idle'
+        self._restarts = 0
+        self._error = None
+        self._heartbeat = None
 
     @property
     def running(self):
@@ -23,22 +86,96 @@ class Worker:
     def cycle(self):
         return self._cycle
 
-    def _guard(self):
-        if self._thread is not None:
-            logging.warning(f'already running: {self._description}')
-            return False
+    @property
+    def token(self):
+        return self._token
 
-        return True
+    @property
+    def description(self):
+        return self._description
+
+    @property
+    def critical(self):
+        return self._critical
+
+    @property
+    def health(self):
+        heartbeat = self._heartbeat
+        return {
+            'status': self._status,
+            'restarts': self._restarts,
+            'error': self._error,
+            'last_iteration': None if heartbeat is None
+            else time.monotonic() - heartbeat,
+            'scheduling': self.scheduling,
+        }
+
+    @property
+    def scheduling(self):
+        """ Applied profile and CPU wait of the thread since it started """
+
+        thread = self._native_id
+        if thread is None:
+            return None
+        return {
+            'profile': self._scheduling,
+            **(realtime.statistics(thread, self._schedstat) or {}),
+        }
+
+    def heartbeat(self):
+        """ Called by loops once per iteration """
+        self._heartbeat = time.monotonic()
 
     def _work(self):
+        cycle = self._cycle
+        token = self._token
+        backoff = Worker.BackoffInitial
+
+        # elevate latency-critical threads (if configured)
+        self._native_id = threading.get_native_id()
+        self._scheduling = realtime.enter(self._critical)
+        self._schedstat = realtime.schedstat(self._native_id)
 
         # start the thread (loop is long running)
         logging.info(f'running {self._description}')
-        self._loop(self._cycle, self)
+        while cycle == self._cycle:
+            self._status = 'running'
+            self.heartbeat()
+
+            try:
+                self._loop(cycle, self)
+                break
+
+            except Exception as e:
+                logging.exception(f'crashed {self._description}')
+                self._status = 'crashed'
+                self._error = repr(e)
+
+            # restart with exponential backoff
+            if token.wait(backoff):
+                break
+            backoff = min(backoff * 2, Worker.BackoffMaximum)
+            self._restarts += 1
+            logging.info(f'restarting {self._description}')
 
         # thread completed
         logging.info(f'stopped {self._description}')
-        self._thread = None
+        if self._thread is threading.current_thread():
+            self._status = 'stopped'
+            self._thread = None
+
+    def _guard(self):
+
+        # let a previous cycle finish first
+        if self._token.cancelled:
+            self.join()
+
+        if self._thread is not None:
+            logging.warning(f'already running: {self._description}')
+            return False
+
+        self._token = Token()
+        return True
 
     def run(self):
         """ Synchronously runs the worker """
@@ -53,46 +190,142 @@ class Worker:
         if not self._guard():
             return
 
-        self._thread = threading.Thread(target=self._work)
+        self._thread = threading.Thread(
+            target=self._work, name=self._description, daemon=True)
         self._thread.start()
         return True
 
-    def stop(self):
+    def cancel(self):
+        """ Signal the worker to stop without waiting """
+
+        if self._thread is None:
+            return False
+
+        self._cycle += 1
+        self._status = 'stopping'
+        self._token.cancel()
+        return True
+
+    def stop(self, timeout=None):
         """ Stop asynchronous worker """
 
-        thread = self._thread
-        if thread is None:
+        if not self.cancel():
             logging.info(f'not running: {self._description}')
-            return
+            return True
 
-        self._cycle += 1
-        # thread.join()
+        # a worker may stop itself from within its loop
+        if self._thread is threading.current_thread():
+            return False
+        return self.join(timeout)
+
+    def join(self, timeout=None):
+        """ Wait a bounded time for the thread to complete """
+
+        thread = self._thread
+        if thread is None or thread is threading.current_thread():
+            return thread is None
+
+        if timeout is None:
+            timeout = Worker.JoinTimeout
+        thread.join(timeout)
+
+        if thread.is_alive():
+            logging.error(f'failed to stop {self._description}')
+            return False
+
+        if self._thread is thread:
+            self._thread = None
+        return True
+
+
+class Supervisor:
+    """ Keeps track of all workers """
+
+    def __init__(self):
+        self._workers = []
+
+    @property
+    def workers(self):
+        return self._workers
+
+    @property
+    def health(self):
+        return {
+            worker.description: worker.health
+            for worker in self._workers
+        }
+
+    def watch(self, worker):
+        if worker not in self._workers:
+            self._workers.append(worker)
+
+    def unwatch(self, worker):
+        if worker in self._workers:
+            self._workers.remove(worker)
+
+    def cancel(self):
+        for worker in self._workers:
+            worker.cancel()
+
+    def join(self, timeout=None):
+        """ Join all workers within the timeout """
+
+        deadline = time.monotonic() + (
+            Worker.JoinTimeout if timeout is None else timeout)
+        stopped = True
+        for worker in self._workers:
+            remaining = max(deadline - time.monotonic(), 0)
+            stopped = worker.join(remaining) and stopped
+        return stopped
+
+    def stop(self, timeout=None):
+        """ Cancel all workers, then join them within the timeout """
+
+        self.cancel()
+        return self.join(timeout)
 
 
 class Service:
     """ Schedules the components """
 
-    def __init__(self, state, queue):
+    def __init__(self, state, queue, name=None):
         self._state = state
         self._queue = queue
+        self._name = name
 
         self._consumer = None
         self._components = []
         self._pollers = []
+        self._scheduler = Scheduler()
+        self._supervisor = Supervisor()
+        self._predictor = Predictor(state, queue)
         self._running = True
 
-        self._poll_worker = Worker(self._poll_loop, 'poll thread')
-        self._queue_worker = Worker(self._queue_loop, 'queue thread')
-        self._update_worker = Worker(self._update_loop, 'update thread')
+        prefix = '' if name is None else f'{name} '
+        self._poll_worker = Worker(
+            self._poll_loop, f'{prefix}poll thread', critical=True)
+        self._queue_worker = Worker(
+            self._queue_loop, f'{prefix}queue thread', critical=True)
+        self._update_worker = Worker(
+            self._update_loop, f'{prefix}update thread', critical=True)
+
+        for worker in (
+                self._poll_worker,
+                self._queue_worker,
+                self._update_worker):
+            self._supervisor.watch(worker)
 
     def _poll_loop(self, cycle, worker):
         """ Polling components loop """
 
+        worker.token.on_cancel(self._scheduler.wake)
+
+        self._scheduler.restart()
         while cycle == worker.cycle:
+            worker.heartbeat()
+            self._scheduler.step()
 
-            for component in self._pollers:
-                component.poll()
-            time.sleep(0.05)
+        logging.info(f'polling statistics: {self._scheduler.statistics}')
 
     def _queue_loop(self, cycle, worker):
         """ Consuming component loop """
@@ -101,7 +334,10 @@ class Service:
             logging.error('missing consumer')
             return
 
-        while self._running:
+        worker.token.on_cancel(self._queue._event.set)
+
+        while self._running and cycle == worker.cycle:
+            worker.heartbeat()
 
             self._queue.clear()
             self._consumer.consume()
@@ -110,7 +346,10 @@ class Service:
     def _update_loop(self, cycle, worker):
         """ Main application loop """
 
-        while self._running:
+        worker.token.on_cancel(self._state._event.set)
+
+        while self._running and cycle == worker.cycle:
+            worker.heartbeat()
 
             self._state.clear()
 
@@ -118,23 +357,149 @@ class Service:
             if self._state.ready and not self._poll_worker.running:
                 self._poll_worker.start()
 
-            # run updates on components
-            for component in self._components:
+            # run updates on components (may be replaced meanwhile)
+            for component in list(self._components):
                 component.update()
 
             # stop polling loop if neccessary
             if self._state.off and self._poll_worker.running:
                 self._poll_worker.stop()
 
-            self._state.wait()
+            # wake up to roll back expired predictions
+            self._state.wait(self._state.expiry)
 
     def register(self, component):
         if isinstance(component, ConsumingComponent):
             self._consumer = component
         if isinstance(component, PollingComponent):
             self._pollers.append(component)
+            self._scheduler.add(component)
+        for worker in component.workers:
+            self._supervisor.watch(worker)
+        component._service = self
         self._components.append(component)
 
+    def remove(self, component):
+        """ Stop and remove a component at runtime (e.g. to replace it) """
+
+        if component not in self._components:
+            return False
+
+        for worker in component.workers:
+            worker.stop()
+            self._supervisor.unwatch(worker)
+        if component in self._pollers:
+            self._pollers.remove(component)
+            self._scheduler.remove(component)
+        self._components.remove(component)
+        component.close()
+        return True
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def state(self):
+        return self._state
+
+    @property
+    def queue(self):
+        return self._queue
+
+    @property
+    def scheduler(self):
+        return self._scheduler
+
+    def find(self, type):
+        """ Get the first registered component of the given type """
+
+        for component in self._components:
+            if isinstance(component, type):
+                return component
+
+    @property
+    def health(self):
+        return self._supervisor.health
+
+    @property
+    def statistics(self):
+        return {
+            type(component).__name__: component.statistics
+            for component in self._components
+            if component.statistics is not None
+        }
+
     def start(self):
+        self._running = True
         self._queue_worker.start()
         self._update_worker.start()
+
+    def cancel(self):
+        self._running = False
+        self._supervisor.cancel()
+
+    def join(self, timeout=None):
+        return self._supervisor.join(timeout)
+
+    def stop(self, timeout=None):
+        """ Stop all workers within bounded time """
+
+        self.cancel()
+        return self.join(timeout)
+
+
+class Units:
+    """ Hosts several independently scheduled devices """
+
+    def __init__(self):
+        self._services = {}
+        self._default = None
+
+    @property
+    def ids(self):
+        return list(self._services)
+
+    @property
+    def default(self):
+        return self._default
+
+    @property
+    def health(self):
+        return {
+            id: service.health
+            for id, service in self._services.items()
+        }
+
+    def get(self, id=None):
+        """ Get a device service (or the default one) """
+
+        if id is None:
+            id = self._default
+        return self._services.get(id)
+
+    def add(self, id, service):
+        if id in self._services:
+            raise ValueError(f'duplicate device: {id}')
+
+        self._services[id] = service
+        if self._default is None:
+            self._default = id
+
+    def start(self):
+        for service in self._services.values():
+            service.start()
+
+    def stop(self, timeout=None):
+        """ Stop all devices within a shared deadline """
+
+        for service in self._services.values():
+            service.cancel()
+
+        deadline = time.monotonic() + (
+            Worker.JoinTimeout if timeout is None else timeout)
+        stopped = True
+        for service in self._services.values():
+            remaining = max(deadline - time.monotonic(), 0)
+            stopped = service.join(remaining) and stopped
+        return stopped
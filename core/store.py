@@ -0,0 +1,34 @@
+import json
+import os
+
+
+def load(path):
+    """ Content of a JSON file, None if it does not exist """
+
+    if path is None or not os.path.exists(path):
+        return None
+
+    with open(path) as file:
+        return json.load(file)
+
+
+def save(path, data):
+    """ Write a JSON file atomically (SD cards may lose power any time)
+
+        The content is synced before the temporary file replaces the old
+        one, and the directory afterwards, so a power loss leaves either
+        the old or the new file but never a partial one. """
+
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w') as file:
+        json.dump(data, file, indent=2)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+    # persist the rename itself
+    directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
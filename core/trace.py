@@ -0,0 +1,159 @@
+from enum import IntEnum
+
+import logging
+import struct
+import threading
+import time
+
+
+class Kind(IntEnum):
+    Rebase = 0
+    SerialIn = 1
+    SerialOut = 2
+    Ir = 3
+    Voltage = 4
+    Rotary = 5
+    Api = 6
+
+
+# file header and record header (delta in microseconds, kind, length)
+Magic = b'Z906TRC1'
+Header = struct.Struct('<IBH')
+
+# gaps beyond the delta range (~71 minutes) precede a record as rebase
+Rebase = struct.Struct('<Q')
+MaxDelta = 0xffffffff
+
+# larger payloads are truncated (tracing must never fail the traced code)
+MaxPayload = 0xffff
+
+
+class Recorder:
+    """ Writes records to a compact binary trace (replaces the file) """
+
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'wb')
+        self._file.write(Magic)
+        self._stamp = time.monotonic()
+        self._count = 0
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def count(self):
+        return self._count
+
+    def record(self, kind, payload):
+        now = time.monotonic()
+        if len(payload) > MaxPayload:
+            logging.warning(
+                'truncated %s trace record of %d bytes', Kind(kind).name,
+                len(payload))
+            payload = payload[:MaxPayload]
+
+        with self._lock:
+            if self._file.closed:
+                return
+            delta = int((now - self._stamp) * 1e6)
+            self._stamp = now
+            try:
+                if delta > MaxDelta:
+                    self._file.write(
+                        Header.pack(0, Kind.Rebase, Rebase.size))
+                    self._file.write(Rebase.pack(delta))
+                    delta = 0
+                self._file.write(Header.pack(delta, kind, len(payload)))
+                self._file.write(payload)
+                self._count += 1
+            except (OSError, struct.error):
+                logging.exception('failed to write trace record')
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read(path):
+    """ Iterate (seconds since start, kind, payload) of a trace """
+
+    with open(path, 'rb') as file:
+        if file.read(len(Magic)) != Magic:
+            raise ValueError(f'not a trace file: {path}')
+
+        timestamp = 0.0
+        while True:
+            header = file.read(Header.size)
+            if len(header) < Header.size:
+                return
+
+            (delta, kind, length) = Header.unpack(header)
+            payload = file.read(length)
+            if len(payload) < length:
+                logging.warning(f'truncated trace: {path}')
+                return
+
+            timestamp += delta / 1e6
+            if kind == Kind.Rebase:
+                timestamp += Rebase.unpack(payload)[0] / 1e6
+                continue
+            yield (timestamp, Kind(kind), payload)
+
+
+class Tap:
+    """ Serial port proxy that traces all transferred bytes """
+
+    def __init__(self, serial):
+        self._serial = serial
+
+    def __getattr__(self, name):
+        return getattr(self._serial, name)
+
+    def read(self, size=1):
+        data = self._serial.read(size)
+        if data and _recorder is not None:
+            record(Kind.SerialIn, data)
+        return data
+
+    def write(self, data):
+        if _recorder is not None:
+            record(Kind.SerialOut, data)
+        return self._serial.write(data)
+
+
+# active recorder (tracing is off by default)
+_recorder = None
+
+
+def active():
+    return _recorder
+
+
+def record(kind, payload):
+    """ Record an event if tracing is active """
+
+    recorder = _recorder
+    if recorder is not None:
+        recorder.record(kind, payload)
+
+
+def start(path):
+    global _recorder
+
+    stop()
+    _recorder = Recorder(path)
+    logging.info(f'tracing to {path}')
+    return _recorder
+
+
+def stop():
+    global _recorder
+
+    recorder, _recorder = _recorder, None
+    if recorder is not None:
+        recorder.close()
+        logging.info(f'stopped tracing ({recorder.count} records)')
+    return recorder
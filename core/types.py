@@ -55,3 +55,4 @@ class Commands(Enum):
     SelectInput = auto()
     SelectEffect = auto()
     RequestState = auto()
+    ApplyPreset = auto()
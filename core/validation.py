@@ -0,0 +1,150 @@
+from .types import Commands, Stage
+
+import time
+
+
+class Validator:
+    """ Eliminates commands that would not change the device """
+
+    # seconds until sent commands are expected to be echoed
+    Timeout = 1.0
+
+    # seconds until another power on is sent while booting
+    BootTimeout = 10.0
+
+    def __init__(self, state):
+        self._state = state
+
+        # values expected once sent commands are echoed (key -> (value, deadline))
+        self._sent = {}
+
+        self._eliminated = {}
+        self._merged = 0
+
+        self._checks = {
+            Commands.TurnOn: self._turn_on,
+            Commands.VolumeUp: self._volume_up,
+            Commands.VolumeDown: self._volume_down,
+            Commands.SelectInput: self._select_input,
+        }
+
+    @property
+    def statistics(self):
+        return {
+            'eliminated': dict(self._eliminated),
+            'merged': self._merged,
+        }
+
+    def _expected(self, key, confirmed):
+        """ Value once sent commands are echoed """
+
+        entry = self._sent.get(key)
+        if entry is None:
+            return confirmed
+
+        (value, deadline) = entry
+        if value == confirmed or deadline <= time.monotonic():
+            del self._sent[key]
+            return confirmed
+        return value
+
+    def _send(self, key, value, timeout=Timeout):
+        self._sent[key] = (value, time.monotonic() + timeout)
+
+    def _turn_on(self):
+        stage = self._state.stage
+        if stage >= Stage.Booted:
+            return False
+
+        # repeat power on if the unit did not respond
+        if stage == Stage.Booting and self._expected('on', False):
+            return False
+
+        self._send('on', True, Validator.BootTimeout)
+        return True
+
+    def _speakers(self, speakers=None):
+        return self._state.speakers if speakers is None else speakers
+
+    def _step(self, speakers, delta):
+        if not self._state.ready:
+            return True
+
+        speakers = self._speakers(speakers)
+        volume = self._state.volumes.get(speakers)
+        if volume is None:
+            return True
+
+        # volume limits are not enforced by the main unit
+        limit = self._state.limit(speakers)
+
+        volume = self._expected(('volume', speakers), volume)
+        if delta > 0 and volume + delta > limit or volume + delta < 0:
+            return False
+
+        self._send(('volume', speakers), volume + delta)
+        return True
+
+    def _volume_up(self, speakers=None):
+        return self._step(speakers, 1)
+
+    def _volume_down(self, speakers=None):
+        return self._step(speakers, -1)
+
+    def _select_input(self, input):
+        if not self._state.ready:
+            return True
+
+        if self._expected('input', self._state.input) == input:
+            return False
+
+        self._send('input', input)
+        return True
+
+    def admit(self, command, *params, **kwargs):
+        """ Whether the command changes the device (assumes it is sent) """
+
+        check = self._checks.get(command)
+        if check is None or check(*params, **kwargs):
+            return True
+
+        self._eliminated[command.name] = \
+            self._eliminated.get(command.name, 0) + 1
+        return False
+
+    def _merge(self, admitted, entry):
+        """ Merge entry into the last admitted command (if possible) """
+
+        if not admitted:
+            return False
+
+        (command, params, kwargs) = entry
+        (last, last_params, last_kwargs) = admitted[-1]
+
+        # opposite volume steps cancel out
+        if {command, last} == {Commands.VolumeUp, Commands.VolumeDown} and \
+                self._speakers(*params, **kwargs) == \
+                self._speakers(*last_params, **last_kwargs):
+            admitted.pop()
+            self._merged += 2
+            return True
+
+        # only the last of consecutive input selections is visible
+        if command == last == Commands.SelectInput:
+            admitted[-1] = entry
+            self._merged += 1
+            return True
+
+        return False
+
+    def filter(self, batch):
+        """ Drop and merge (command, params, kwargs) entries of a batch """
+
+        admitted = []
+        for entry in batch:
+            (command, params, kwargs) = entry
+            if not self.admit(command, *params, **kwargs):
+                continue
+            if not self._merge(admitted, entry):
+                admitted.append(entry)
+        return admitted
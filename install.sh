@@ -15,6 +15,7 @@ pip3 install \
     evdev \
     flask \
     gunicorn \
+    paho-mqtt \
     adafruit-circuitpython-ads1x15
 
 # clone repository
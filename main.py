@@ -1,43 +1,250 @@
-
 from core.model import State, Queue
-from core.service import Service
+from core.config import Config
+from core import logs
+from core import pins
+from core import realtime
+from core import trace
+from core.gpio import Gpio
+from core.buttons import Buttons, Tracker
+from core.presets import Presets
+from core.schedules import Schedules
+from core.service import Service, Units
+
+import logging
+import threading
+import signal
+import pigpio
+import flask
+import os
+
+
+# load configuration (the file overrides legacy environment variables)
+config_path = os.environ.get('Z906_CONFIG', 'config.json')
+try:
+    config = Config.load(config_path)
+except ValueError as e:
+    logging.error(f'invalid configuration {config_path}: {e}')
+    exit(1)
+
+# rewire pins before the components bind them (changes require a restart)
+pins.configure(config.pins)
 
 from components.Z906.controller import Controller
 from components.Z906.inputs import Inputs
 from components.Z906.panel import Panel
 from components.Z906.lirc import Lirc
+from components.ramp import Ramps
+from components.reconciler import Reconciler
 from components.api import Api
+from components.control import Control
+from components.group import Group
+from components.mqtt import Mqtt
+from components.activity import Activity
+from components.timers import Timers
 
-import logging
-import threading
-import pigpio
-import flask
-import os
+# initialize logging (recent serial traffic is available on /traffic)
+logs.setup(config.log_level)
 
+# record a trace from the start (replay with tools.replay)
+if config.trace is not None:
+    trace.start(config.trace)
 
-# initialize logging
-logging.basicConfig(level=logging.DEBUG)
+# elevate latency-critical threads (opt-in, e.g. next to audio streaming)
+if config.realtime is not None:
+    realtime.setup(realtime.Profile(*config.realtime))
 
 # initialize webserver
 app = flask.Flask("logitech-z906")
 
-# load GPIO
-pi = pigpio.pi()
+# load GPIO (pin operations are grouped into bank calls)
+pi = Gpio(pigpio.pi())
 if not pi.connected:
     logging.error("GPIO not available")
     exit(0)
 
-# initialize core
-state = State()
-queue = Queue()
+# load presets
+presets = Presets(config.presets)
+
+# load schedules (sleep timers, on/off times and quiet hours)
+schedules = Schedules(config.schedules)
+
+# load calibrated panel button levels
+buttons = Buttons(
+    config.buttons_path, Tracker(**config.tracker), config.tolerance)
+
+
+def _optional(section, settings, state, queue, id):
+    """ Create the component of a replaceable section (or None) """
+
+    if section == 'socket':
+        return Control(
+            pi, state, queue, settings.socket, presets, settings.listen)
+    if section == 'group' and settings.group is not None:
+        (members, timeout, local) = settings.group
+        return Group(pi, state, queue, members, timeout, local, presets)
+    if section == 'mqtt' and settings.mqtt is not None:
+        (host, port) = settings.mqtt
+        return Mqtt(pi, state, queue, host, port, f'z906/{id}')
+    if section == 'activity' and settings.activity is not None:
+        (path, idle) = settings.activity
+        return Activity(pi, state, queue, path, idle)
+    if section == 'debounce':
+        return Inputs(pi, state, queue, buttons, presets, settings.debounce)
+
+
+# components of the primary device replaced on reload (section -> component)
+replaceable = {}
+
+# SIGHUP and the API may reload at the same time
+reloading = threading.Lock()
+
+
+def _replace(section, new):
+    """ Replace the component of a section, keep the old one on failure """
+
+    service = units.get()
+    old = replaceable.pop(section)
+    if old is not None:
+        service.remove(old)
+
+    replaced = True
+    try:
+        component = _optional(
+            section, new, service.state, service.queue, service.name)
+    except Exception:
+        logging.exception(f'failed to replace {section}, restoring it')
+        component = _optional(
+            section, config, service.state, service.queue, service.name)
+        replaced = False
+
+    if component is not None:
+        service.register(component)
+    replaceable[section] = component
+    return replaced
+
+
+def reload():
+    """ Apply a changed configuration file without touching serial links """
+
+    with reloading:
+        return _reload()
+
+
+def _reload():
+    global config
+
+    new = Config.load(config_path)
+    changed = config.changed(new)
+    if 'listen' in changed and 'socket' not in changed:
+        changed.append('socket')
+    applied = []
+    restart = []
+
+    for section in changed:
+        if section not in Config.Reloadable:
+            restart.append(section)
+            continue
+
+        if section == 'devices':
+            ports = [(device.id, device.port) for device in new.devices]
+            if ports != [(device.id, device.port) for device in config.devices]:
+                restart.append(section)
+                continue
+
+        if section in ('devices', 'max_volume'):
+            for device in new.devices:
+                service = units.get(device.id)
+                if service is not None:
+                    service.state.max_volume = device.max_volume
+        elif section == 'ir':
+            if new.ir_device != config.ir_device:
+                restart.append(section)
+                continue
+            lirc = units.get().find(Lirc)
+            if lirc is not None:
+                lirc.configure(new.ir)
+        elif section == 'buttons':
+            if new.buttons_path != config.buttons_path:
+                restart.append(section)
+                continue
+            buttons.configure(new.tolerance, **new.tracker)
+        elif section == 'log_level':
+            logging.getLogger().setLevel(new.log_level)
+        elif section == 'listen':
+            # the TCP listener is replaced along with the control socket
+            pass
+        elif section in replaceable:
+            if not _replace(section, new):
+                restart.append(section)
+                continue
+
+        applied.append(section)
+
+    config = new
+    logging.info(
+        f'configuration reloaded (applied: {applied}, restart: {restart})')
+    return {'applied': applied, 'restart': restart}
+
+
+def _hangup(signum, frame):
+
+    # reload off the signal handler (it interrupts the main thread)
+    def run():
+        try:
+            reload()
+        except ValueError as e:
+            logging.error(f'invalid configuration: {e}')
+        except Exception:
+            logging.exception('failed to reload configuration')
+
+    threading.Thread(target=run, name='reload thread', daemon=True).start()
+
+
+signal.signal(signal.SIGHUP, _hangup)
+
+# initialize devices
+units = Units()
+for index, device in enumerate(config.devices):
+    primary = index == 0
+    id = device.id
+
+    # initialize core (history holds the latest state changes)
+    state = State(device.max_volume, config.history)
+    queue = Queue()
+    service = Service(state, queue, name=id)
+
+    # initialize serial connection (panel and IR only drive the primary unit)
+    try:
+        if primary:
+            service.register(Api(
+                pi, state, queue, app, units, presets, schedules, buttons,
+                reload))
+            service.register(Timers(pi, state, queue, schedules, presets))
+            for section in ('socket', 'group', 'mqtt', 'activity'):
+                replaceable[section] = _optional(section, config, state, queue, id)
+                if replaceable[section] is not None:
+                    service.register(replaceable[section])
+            service.register(Controller(
+                pi, state, queue, device.port,
+                baudrate=config.baudrate, timeout=config.timeout))
+            replaceable['debounce'] = _optional(
+                'debounce', config, state, queue, id)
+            service.register(replaceable['debounce'])
+            service.register(Lirc(
+                pi, state, queue, presets, config.ir_device, config.ir))
+            service.register(Panel(pi, state, queue))
+        else:
+            service.register(Controller(
+                pi, state, queue, device.port, None,
+                baudrate=config.baudrate, timeout=config.timeout))
+        service.register(Ramps(pi, state, queue))
+        service.register(Reconciler(pi, state, queue))
+
+    except Exception:
+        logging.exception(f'failed to initialize device {id} ({device.port})')
+        continue
 
-# initialize components
-service = Service(state, queue)
-service.register(Api(pi, state, queue, app))
-service.register(Controller(pi, state, queue))
-service.register(Inputs(pi, state, queue))
-service.register(Lirc(pi, state, queue))
-service.register(Panel(pi, state, queue))
+    units.add(id, service)
 
 # run application
-service.start()
+units.start()
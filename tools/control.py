@@ -0,0 +1,70 @@
+from components.control import Client, Protocol
+from core.types import Commands, Speakers, Input, Effect
+
+import argparse
+import json
+
+
+# command names (as on the HTTP API) and their parameter type
+Names = {
+    'on': (Commands.TurnOn, None),
+    'off': (Commands.TurnOff, None),
+    'mute': (Commands.Mute, None),
+    'unmute': (Commands.Unmute, None),
+    'volume-up': (Commands.VolumeUp, Speakers),
+    'volume-down': (Commands.VolumeDown, Speakers),
+    'input': (Commands.SelectInput, Input),
+    'effect': (Commands.SelectEffect, Effect),
+}
+
+
+def _param(type, value):
+    """ Parameter by name or number """
+
+    if value is None:
+        return None
+    if value.isdigit():
+        return type(int(value))
+    return type[value]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Control the Z906 via socket')
+    parser.add_argument('--path', default='/tmp/z906.sock')
+    parser.add_argument(
+        'action', choices=list(Names) + ['preset', 'state', 'watch'])
+    parser.add_argument('param', nargs='?')
+    parser.add_argument(
+        '--repeat', type=int, default=1, help='send the command n times')
+    args = parser.parse_args()
+
+    client = Client(args.path, timeout=None if args.action == 'watch' else 1.0)
+
+    if args.action == 'state':
+        print(json.dumps(client.state(), indent=2))
+
+    elif args.action == 'watch':
+        client.subscribe()
+        while True:
+            print(json.dumps(client.event()), flush=True)
+
+    elif args.action == 'preset':
+        if not client.preset(args.param):
+            raise SystemExit(f'unknown preset {args.param}')
+
+    else:
+        (command, type) = Names[args.action]
+        payload = Client.encode(command, _param(type, args.param))
+
+        # pipeline all repetitions, then collect the acknowledgements
+        for _ in range(args.repeat):
+            client.send(Protocol.Command, payload)
+        failed = sum(not client.status() for _ in range(args.repeat))
+        if failed:
+            raise SystemExit(f'{failed} commands failed')
+
+    client.close()
+
+
+if __name__ == '__main__':
+    main()
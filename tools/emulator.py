@@ -0,0 +1,998 @@
+from core.component import Component
+from core.types import Input, Effect, Speakers, Commands
+
+import argparse
+import logging
+import os
+import pty
+import select
+import threading
+import time
+import tty
+
+
+class Emulator(threading.Thread):
+    """ Emulates a Z906 main unit on a pseudo terminal """
+
+    Inputs = {
+        0x02: Input.Input1,
+        0x05: Input.Chinch,
+        0x03: Input.Optical,
+        0x04: Input.Input4,
+        0x06: Input.Input5,
+        0x07: Input.Aux,
+    }
+
+    Effects = {
+        0x35: Effect.Dolby,
+        0x14: Effect._3D,
+        0x15: Effect._4_1,
+        0x16: Effect._2_1,
+    }
+
+    VolumeUp = {
+        0x08: Speakers.Master,
+        0x0c: Speakers.Center,
+        0x0e: Speakers.Rear,
+        0x0a: Speakers.Sub,
+    }
+
+    VolumeDown = {
+        0x09: Speakers.Master,
+        0x0d: Speakers.Center,
+        0x0f: Speakers.Rear,
+        0x0b: Speakers.Sub,
+    }
+
+    def __init__(self, boot_delay=0.0, rate=None, capacity=None,
+                 max_volume=43):
+        super().__init__(daemon=True)
+
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._master)
+        self.port = os.ttyname(self._slave)
+
+        # simulated hardware limits
+        self.boot_delay = boot_delay
+        self.rate = rate
+        self.capacity = capacity
+        self.max_volume = max_volume
+        self.stalled = False
+
+        # simulated device state
+        self.powered = False
+        self.input = Input.Input1
+        self.volumes = {
+            Speakers.Master: 20,
+            Speakers.Rear: 21,
+            Speakers.Center: 21,
+            Speakers.Sub: 21,
+        }
+        self.effects = {
+            Input.Input1: Effect._2_1,
+            Input.Chinch: Effect._2_1,
+            Input.Aux: Effect._2_1,
+        }
+
+        # statistics
+        self.received = 0
+        self.processed = 0
+        self.lost = 0
+
+        self._buffer = bytearray()
+        self._running = True
+
+    def frame(self):
+        """ Build the state frame (answer to 0x34) """
+
+        content = bytes([
+            self.volumes[Speakers.Master],
+            self.volumes[Speakers.Rear],
+            self.volumes[Speakers.Center],
+            self.volumes[Speakers.Sub],
+            self.input,
+            0, 0, 0,
+            self.effects[Input.Chinch],
+            self.effects[Input.Aux],
+            self.effects[Input.Input1],
+            0, 0, 0,
+            0x06, 0x01, 0x03,
+            0, 0, 0,
+        ])
+        message = b'\x0a' + bytes([len(content)]) + content
+        checksum = sum(message) % 255
+        return b'\xaa' + message + bytes([checksum])
+
+    def _send(self, data):
+        os.write(self._master, data)
+
+    def _apply(self, content):
+        """ Apply a state frame sent to the device """
+
+        self.volumes = {
+            Speakers.Master: content[0],
+            Speakers.Rear: content[1],
+            Speakers.Center: content[2],
+            Speakers.Sub: content[3],
+        }
+        self.input = Input(content[4])
+        self.effects = {
+            Input.Chinch: Effect(content[8]),
+            Input.Aux: Effect(content[9]),
+            Input.Input1: Effect(content[10]),
+        }
+
+    def _parse(self):
+        """ Process a single command, returns the consumed length """
+
+        buffer = self._buffer
+        byte = buffer[0]
+
+        # power on sequence (device boots before echoing)
+        if byte == 0x11:
+            if len(buffer) < 7:
+                return 0
+            time.sleep(self.boot_delay)
+            self.powered = True
+            self._send(bytes(buffer[:7]))
+            return 7
+
+        # state frame
+        if byte == 0xaa:
+            if len(buffer) < 3 or len(buffer) < 4 + buffer[2]:
+                return 0
+            length = buffer[2]
+            if buffer[1] == 0x0a and self.powered:
+                self._apply(buffer[3:3 + length])
+            return 4 + length
+
+        # ignore everything else while off
+        if not self.powered:
+            return 1
+
+        if byte == 0x37:
+            self.powered = False
+            self._send(b'\x37')
+        elif byte == 0x34:
+            self._send(self.frame())
+        elif byte in Emulator.VolumeUp:
+            speakers = Emulator.VolumeUp[byte]
+            if self.volumes[speakers] < self.max_volume:
+                self.volumes[speakers] += 1
+                self._send(bytes([byte]))
+        elif byte in Emulator.VolumeDown:
+            speakers = Emulator.VolumeDown[byte]
+            if self.volumes[speakers] > 0:
+                self.volumes[speakers] -= 1
+                self._send(bytes([byte]))
+        elif byte in Emulator.Inputs:
+            self.input = Emulator.Inputs[byte]
+            self._send(bytes([byte]))
+        elif byte in Emulator.Effects:
+            if self.input in self.effects:
+                self.effects[self.input] = Emulator.Effects[byte]
+
+        return 1
+
+    def run(self):
+        while self._running:
+
+            # a stalled unit stops reading (its input buffer fills up)
+            if self.stalled:
+                time.sleep(0.05)
+                continue
+
+            (readable, _, _) = select.select([self._master], [], [], 0.05)
+            if not readable:
+                continue
+
+            data = os.read(self._master, 256)
+            self.received += len(data)
+
+            # input buffer overruns lose bytes
+            if self.capacity is not None:
+                space = max(self.capacity - len(self._buffer), 0)
+                self.lost += max(len(data) - space, 0)
+                data = data[:space]
+            self._buffer += data
+
+            while self._buffer:
+                consumed = self._parse()
+                if not consumed:
+                    break
+                del self._buffer[:consumed]
+                self.processed += 1
+
+                # finite processing rate of the main unit
+                if self.rate:
+                    time.sleep(1.0 / self.rate)
+
+    def stop(self):
+        self._running = False
+
+
+def _wait(condition, timeout):
+    """ Wait until condition holds, returns elapsed seconds or None """
+
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        if condition():
+            return time.monotonic() - start
+        time.sleep(0.001)
+
+
+def _service(emulator, name=None, limits=None):
+    """ Create a device service connected to the emulator """
+
+    from core.model import State, Queue
+    from core.service import Service
+    from components.Z906.controller import Controller
+
+    state = State()
+    queue = Queue()
+    service = Service(state, queue, name=name)
+    service.register(Controller(
+        None, state, queue, emulator.port, None, limits))
+    return service
+
+
+def _power_on(service, timeout):
+    service.queue.enqueue(Commands.TurnOn)
+    if _wait(lambda: service.state.ready, timeout) is None:
+        raise TimeoutError('device did not become ready')
+
+
+def scaling(units, steps, stalled, timeout):
+    """ Drive several emulated units from one host """
+
+    from core.service import Units
+
+    emulators = []
+    host = Units()
+    for index in range(units):
+        emulator = Emulator()
+        emulator.start()
+        emulators.append(emulator)
+        host.add(f'unit{index}', _service(emulator, f'unit{index}'))
+
+    host.start()
+
+    # power on all units
+    for id in host.ids:
+        host.get(id).queue.enqueue(Commands.TurnOn)
+    for id in host.ids:
+        if _wait(lambda: host.get(id).state.ready, timeout) is None:
+            logging.error(f'{id} did not become ready')
+
+    # stall some units, then run volume steps everywhere
+    for emulator in emulators[:stalled]:
+        emulator.stalled = True
+
+    start = time.monotonic()
+    targets = {}
+    for id in host.ids:
+        service = host.get(id)
+        targets[id] = service.state.volumes[Speakers.Master] + steps
+        for _ in range(steps):
+            service.queue.enqueue(Commands.VolumeUp, Speakers.Master)
+
+    # record completion of every unit independently
+    results = dict.fromkeys(host.ids)
+    while time.monotonic() - start < timeout:
+        for id, target in targets.items():
+            volume = host.get(id).state.volumes[Speakers.Master]
+            if results[id] is None and volume >= target:
+                results[id] = time.monotonic() - start
+        if all(elapsed is not None for elapsed in results.values()):
+            break
+        time.sleep(0.001)
+
+    for emulator in emulators:
+        emulator.stalled = False
+    host.stop()
+    for emulator in emulators:
+        emulator.stop()
+
+    return results
+
+
+def presets(rate, timeout):
+    """ Compare applying a scene by state frame and by single steps """
+
+    from core.presets import Preset
+
+    emulator = Emulator(rate=rate)
+    emulator.start()
+    service = _service(emulator)
+    service.start()
+    _power_on(service, timeout)
+
+    base = Preset(
+        'base',
+        volumes={
+            Speakers.Master: 10,
+            Speakers.Rear: 15,
+            Speakers.Center: 15,
+            Speakers.Sub: 15,
+        },
+        input=Input.Input1,
+        effects={Input.Aux: Effect.Dolby, Input.Input1: Effect.Dolby})
+    movie = Preset(
+        'movie',
+        volumes={
+            Speakers.Master: 30,
+            Speakers.Rear: 25,
+            Speakers.Center: 28,
+            Speakers.Sub: 24,
+        },
+        input=Input.Aux,
+        effects={Input.Aux: Effect.Dolby, Input.Input1: Effect.Dolby})
+
+    def reached(preset):
+        (volumes, input, _) = preset.resolve(service.state)
+        return service.state.input == input and all(
+            service.state.volumes[speakers] == volume
+            for speakers, volume in volumes.items())
+
+    def measure(apply):
+        service.queue.enqueue(Commands.ApplyPreset, base)
+        _wait(lambda: reached(base), timeout)
+        time.sleep(0.1)
+
+        start = time.monotonic()
+        apply()
+        return _wait(lambda: reached(movie), timeout)
+
+    def stepwise():
+        (volumes, input, _) = movie.resolve(service.state)
+        for speakers, volume in volumes.items():
+            delta = volume - service.state.volumes[speakers]
+            command = Commands.VolumeUp if delta > 0 else Commands.VolumeDown
+            for _ in range(abs(delta)):
+                service.queue.enqueue(command, speakers)
+        service.queue.enqueue(Commands.SelectInput, input)
+
+    results = {
+        'frame': measure(
+            lambda: service.queue.enqueue(Commands.ApplyPreset, movie)),
+        'stepwise': measure(stepwise),
+    }
+
+    service.stop()
+    emulator.stop()
+    return results
+
+
+def shaping(rate, steps, timeout):
+    """ Burst volume steps into a unit with finite processing rate """
+
+    from core.limiter import Shaper
+    from components.Z906.controller import Controller
+
+    unlimited = {
+        name: (Shaper.Pass, None, None)
+        for name in Controller.Limits
+    }
+
+    results = {}
+    for name, limits in (('unlimited', unlimited), ('shaped', None)):
+        emulator = Emulator(rate=rate, capacity=16)
+        emulator.start()
+        service = _service(emulator, limits=limits)
+        service.start()
+        _power_on(service, timeout)
+
+        # burst steps (e.g. knob storm), then wait for the unit to settle
+        start = time.monotonic()
+        expected = min(
+            emulator.volumes[Speakers.Master] + steps, emulator.max_volume)
+        for _ in range(steps):
+            service.queue.enqueue(Commands.VolumeUp, Speakers.Master)
+        elapsed = _wait(
+            lambda: emulator.volumes[Speakers.Master] >= expected, timeout)
+        time.sleep(0.2)
+
+        results[name] = {
+            'elapsed': elapsed,
+            'device': emulator.volumes[Speakers.Master],
+            'expected': expected,
+            'lost': emulator.lost,
+            'shaping': service.statistics['Controller']['shaping']['volume'],
+        }
+
+        service.stop()
+        emulator.stop()
+
+    return results
+
+
+class Display(Component):
+    """ Records when confirmed and predicted volumes are shown """
+
+    def __init__(self, state, queue):
+        super().__init__(None, state, queue)
+        self.confirmed = {}
+        self.predicted = {}
+
+    def update(self):
+        now = time.monotonic()
+        self.confirmed.setdefault(self._state.volume, now)
+        self.predicted.setdefault(self._state.predicted.volume, now)
+
+
+def latency(rate, steps, timeout):
+    """ Input to display latency with and without prediction """
+
+    emulator = Emulator(rate=rate)
+    emulator.start()
+    service = _service(emulator)
+    display = Display(service.state, service.queue)
+    service.register(display)
+    service.start()
+    _power_on(service, timeout)
+
+    # single knob ticks, each one measured separately
+    confirmed = []
+    predicted = []
+    for _ in range(steps):
+        target = service.state.volume + 1
+        display.confirmed.pop(target, None)
+        display.predicted.pop(target, None)
+
+        start = time.monotonic()
+        service.queue.enqueue(Commands.VolumeUp)
+        _wait(lambda: target in display.confirmed, timeout)
+        predicted.append(display.predicted.get(target, start) - start)
+        confirmed.append(display.confirmed.get(target, start) - start)
+        time.sleep(0.05)
+
+    service.stop()
+    emulator.stop()
+
+    return {
+        'confirmed': sum(confirmed) / len(confirmed),
+        'predicted': sum(predicted) / len(predicted),
+    }
+
+
+def elimination(steps, timeout):
+    """ Redundant commands that never reach the serial link """
+
+    emulator = Emulator()
+    emulator.start()
+    service = _service(emulator)
+    service.start()
+    _power_on(service, timeout)
+
+    # steps beyond the limit, repeated selections and knob jitter
+    received = emulator.received
+    expected = min(
+        emulator.volumes[Speakers.Master] + steps, emulator.max_volume)
+    commands = [(Commands.VolumeUp, Speakers.Master)] * steps
+    commands += [(Commands.SelectInput, service.state.input)] * 5
+    commands += [(Commands.TurnOn,)]
+    commands += [
+        (Commands.VolumeDown, Speakers.Master),
+        (Commands.VolumeUp, Speakers.Master),
+    ] * 10
+    for command in commands:
+        service.queue.enqueue(*command)
+
+    # commands are shaped, wait until the last steps arrived
+    _wait(lambda: emulator.volumes[Speakers.Master] >= expected, timeout)
+    time.sleep(0.5)
+
+    results = {
+        'commands': len(commands),
+        'bytes': emulator.received - received,
+        'device': emulator.volumes[Speakers.Master],
+        'validation': service.statistics['Controller']['validation'],
+    }
+
+    service.stop()
+    emulator.stop()
+    return results
+
+
+def control(steps, timeout):
+    """ Command throughput and round trips via socket and HTTP """
+
+    import tempfile
+    from core.limiter import Shaper
+    from components.control import Control, Client, Protocol
+    from components.Z906.controller import Controller
+
+    # commands are only enqueued, the device must not slow them down
+    unlimited = {
+        name: (Shaper.Pass, None, None)
+        for name in Controller.Limits
+    }
+
+    emulator = Emulator()
+    emulator.start()
+    service = _service(emulator, limits=unlimited)
+    path = os.path.join(tempfile.mkdtemp(), 'z906.sock')
+    service.register(Control(None, service.state, service.queue, path))
+    service.start()
+    _power_on(service, timeout)
+
+    def measure(single, pipelined):
+        """ Round trip of single commands and rate of pipelined ones """
+
+        rounds = []
+        for _ in range(steps):
+            start = time.perf_counter()
+            single()
+            rounds.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        pipelined(steps)
+        elapsed = time.perf_counter() - start
+        return {
+            'round_trip_ms': sum(rounds) / len(rounds) * 1000,
+            'commands_per_second': steps / elapsed,
+        }
+
+    results = {}
+    client = Client(path)
+    payload = Client.encode(Commands.Unmute)
+
+    def pipelined(count):
+        for _ in range(count):
+            client.send(Protocol.Command, payload)
+        for _ in range(count):
+            client.status()
+
+    results['socket'] = measure(
+        lambda: client.command(Commands.Unmute), pipelined)
+    client.close()
+
+    # HTTP endpoint on a real server (keep-alive connection)
+    try:
+        import flask
+        import http.client
+        import json
+        import werkzeug.serving
+        from components.api import Api
+
+        app = flask.Flask('control')
+        service.register(Api(None, service.state, service.queue, app))
+        server = werkzeug.serving.make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        connection = http.client.HTTPConnection('127.0.0.1', server.port)
+        body = json.dumps({'command': 'unmute'})
+        headers = {'Content-Type': 'application/json'}
+
+        def post():
+            connection.request('POST', '/command', body, headers)
+            connection.getresponse().read()
+
+        results['http'] = measure(
+            post, lambda count: [post() for _ in range(count)])
+        server.shutdown()
+
+    except ImportError as e:
+        logging.warning(f'skipping HTTP: {e}')
+
+    service.stop()
+    emulator.stop()
+    return results
+
+
+def mqtt(steps, timeout):
+    """ State publishing, commands and reconnects against a broker stand-in """
+
+    from core.limiter import Shaper
+    from components.mqtt import Mqtt
+    from components.Z906.controller import Controller
+    from tools import fakebroker
+
+    unlimited = {
+        name: (Shaper.Pass, None, None)
+        for name in Controller.Limits
+    }
+
+    broker = fakebroker.Broker()
+    emulator = Emulator()
+    emulator.start()
+    service = _service(emulator, limits=unlimited)
+    bridge = Mqtt(
+        None, service.state, service.queue,
+        client=fakebroker.Client(broker))
+    service.register(bridge)
+    service.start()
+    _power_on(service, timeout)
+
+    volume = 'z906/state/volume'
+    _wait(lambda: broker.retained.get(volume) is not None, timeout)
+    results = {'discovery': sum(
+        topic.startswith('homeassistant/') for topic in broker.retained)}
+
+    # burst of steps, intermediate values are coalesced
+    published = len(broker.log)
+    target = str(min(emulator.volumes[Speakers.Master] + steps, emulator.max_volume))
+    for _ in range(steps):
+        service.queue.enqueue(Commands.VolumeUp, Speakers.Master)
+    _wait(lambda: broker.retained.get(volume) == target.encode(), timeout)
+    results['burst'] = {
+        'steps': steps,
+        'volume_publishes': sum(
+            topic == volume for (topic, _) in broker.log[published:]),
+    }
+
+    # command topic until the retained state confirms it
+    client = fakebroker.Client(broker)
+    client.connect()
+    start = time.monotonic()
+    client.publish('z906/set/volume', '10')
+    elapsed = _wait(lambda: broker.retained.get(volume) == b'10', timeout)
+    results['command_ms'] = None if elapsed is None else elapsed * 1000
+
+    # broker restart (retained messages are lost)
+    broker.crash()
+    results['will'] = broker.retained.get('z906/availability')
+    broker.retained.clear()
+    broker.down = False
+    elapsed = _wait(lambda: broker.retained.get(volume) == b'10', timeout)
+    results['reconnect_s'] = elapsed
+
+    # broker accepting TCP but refusing the session (e.g. bad credentials)
+    connects = bridge.statistics['connects']
+    broker.reason = 5
+    broker.crash()
+    broker.down = False
+    time.sleep(4.0)
+    results['refused_connects_4s'] = bridge.statistics['connects'] - connects
+    broker.reason = 0
+    results['statistics'] = bridge.statistics
+
+    service.stop()
+    emulator.stop()
+    return results
+
+
+def activity(boot_delay, lead, timeout):
+    """ Playback start until the unit is ready, with and without pre-warm """
+
+    import tempfile
+    from components.activity import Activity
+
+    results = {}
+    for name, prewarm in (('cold', False), ('prewarm', True)):
+        emulator = Emulator(boot_delay=boot_delay)
+        emulator.start()
+        service = _service(emulator)
+        path = os.path.join(tempfile.mkdtemp(), 'activity')
+        service.register(Activity(
+            None, service.state, service.queue, path, lead + 1.0, prewarm))
+        service.start()
+        _wait(lambda: os.path.exists(path), timeout)
+
+        def send(event):
+            with open(path, 'w') as fifo:
+                fifo.write(event + '\n')
+
+        # the player prepares the track before playback starts
+        send('preparing')
+        time.sleep(lead)
+        send('playing')
+        start = time.monotonic()
+        elapsed = _wait(lambda: service.state.ready, timeout)
+
+        # idle timeout after playback stopped
+        send('stopped')
+        idle = _wait(lambda: not emulator.powered, timeout)
+
+        results[name] = {
+            'playing_to_ready': elapsed,
+            'stopped_to_off': idle,
+        }
+
+        service.stop()
+        emulator.stop()
+
+    return results
+
+
+def history(steps, timeout):
+    """ Attributed change records and the cost of recording them """
+
+    from core.history import History
+    from core.prediction import Predictor
+
+    class Lirc(Component):
+        pass
+
+    emulator = Emulator()
+    emulator.start()
+    service = _service(emulator)
+    service.start()
+    remote = Lirc(None, service.state, service.queue)
+    remote.command(Commands.TurnOn)
+    if _wait(lambda: service.state.ready, timeout) is None:
+        raise TimeoutError('device did not become ready')
+
+    # changes by a component, then by the main unit itself
+    expected = min(
+        emulator.volumes[Speakers.Master] + steps, emulator.max_volume)
+    for _ in range(steps):
+        remote.command(Commands.VolumeUp, Speakers.Master)
+    _wait(lambda: service.state.volumes[Speakers.Master] >= expected, timeout)
+    time.sleep(Predictor.Timeout + 0.5)
+    emulator.volumes[Speakers.Master] -= 1
+    service.queue.enqueue(Commands.RequestState)
+    _wait(lambda: service.state.volumes[Speakers.Master] < expected, timeout)
+
+    sources = {}
+    for entry in service.state.history.query(limit=1000)['entries']:
+        key = (entry['field'], entry['source'])
+        sources[key] = sources.get(key, 0) + 1
+
+    # append and query cost on a full ring
+    ring = History()
+    count = ring.size * 4
+    start = time.perf_counter()
+    for index in range(count):
+        ring.append(('volume', Speakers.Master), index, index + 1, 'Lirc')
+    append = (time.perf_counter() - start) / count
+    start = time.perf_counter()
+    page = ring.query(field=('volume', Speakers.Master), offset=100, limit=50)
+    query = time.perf_counter() - start
+
+    results = {
+        'records': {f'{f} by {s}': n for (f, s), n in sources.items()},
+        'append': f'{append * 1e6:.2f} us',
+        'query': f'{query * 1000:.2f} ms ({page["total"]} matched)',
+        'memory': f'{ring.memory} bytes for {ring.size} changes',
+    }
+
+    service.stop()
+    emulator.stop()
+    return results
+
+
+def _hog():
+    """ Busy loop competing for the CPU """
+    while True:
+        pass
+
+
+def realtime(hogs, steps, timeout):
+    """ Knob to display latency under CPU load, with and without profile """
+
+    import multiprocessing
+    import statistics
+    from core import realtime
+
+    results = {}
+    for name, profile in (
+            ('normal', None), ('realtime', realtime.Profile(priority=10))):
+        realtime.setup(profile)
+
+        # the main unit does not share the CPU
+        emulator = Emulator()
+        emulator.start()
+        realtime.Profile(priority=20).apply(emulator.native_id)
+
+        service = _service(emulator)
+        display = Display(service.state, service.queue)
+        service.register(display)
+        service.start()
+        _power_on(service, timeout)
+
+        processes = [
+            multiprocessing.Process(target=_hog, daemon=True)
+            for _ in range(hogs)]
+        for process in processes:
+            process.start()
+        time.sleep(0.5)
+
+        # single knob ticks (down and up to stay within the limits)
+        confirmed = []
+        for step in range(steps):
+            target = service.state.volume + (1 if step % 2 else -1)
+            display.confirmed.pop(target, None)
+
+            start = time.monotonic()
+            service.queue.enqueue(
+                Commands.VolumeUp if step % 2 else Commands.VolumeDown)
+            _wait(lambda: target in display.confirmed, timeout)
+            confirmed.append(display.confirmed.get(target, start) - start)
+
+            # stay below the shaped volume rate
+            time.sleep(0.05)
+
+        for process in processes:
+            process.terminate()
+            process.join()
+
+        confirmed.sort()
+        results[name] = {
+            'median_ms': statistics.median(confirmed) * 1000,
+            'p95_ms': confirmed[int(len(confirmed) * 0.95)] * 1000,
+            'max_ms': confirmed[-1] * 1000,
+            'threads': {
+                description: (health['scheduling'] or {}).get('latency_ms')
+                for description, health in service.health.items()
+            },
+        }
+
+        service.stop()
+        emulator.stop()
+
+    realtime.setup(None)
+    return results
+
+
+def _free_port():
+    """ Unused localhost TCP port """
+
+    import socket
+
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def group(units, steps, timeout):
+    """ Fan-out to several instances on localhost versus sequential calls """
+
+    import tempfile
+    from core.limiter import Shaper
+    from core.model import State, Queue
+    from components.control import Control, Client
+    from components.group import Group
+    from components.Z906.controller import Controller
+
+    unlimited = {
+        name: (Shaper.Pass, None, None)
+        for name in Controller.Limits
+    }
+
+    # one emulated unit and service per room, each listening on TCP
+    directory = tempfile.mkdtemp()
+    rooms = {}
+    for index in range(units):
+        name = f'room{index}'
+        emulator = Emulator()
+        emulator.start()
+        service = _service(emulator, name=name, limits=unlimited)
+        address = ('127.0.0.1', _free_port())
+        control = Control(
+            None, service.state, service.queue,
+            os.path.join(directory, f'{name}.sock'), listen=address)
+        service.register(control)
+        service.start()
+        _power_on(service, timeout)
+        rooms[name] = (emulator, service, control, address)
+
+    coordinator = Group(
+        None, State(), Queue(),
+        {name: room[3] for name, room in rooms.items()},
+        timeout=1.0, local=False)
+    results = {'members': units}
+    results['connect_s'] = _wait(
+        lambda: coordinator.statistics['connected'] == units, timeout)
+
+    commands = [Commands.Mute, Commands.Unmute]
+
+    # automation calling every instance one after another
+    clients = [Client(f'{host}:{port}') for (_, _, _, (host, port)) in rooms.values()]
+    start = time.perf_counter()
+    for step in range(steps):
+        for client in clients:
+            client.command(commands[step % 2])
+    results['sequential_ms'] = (time.perf_counter() - start) / steps * 1000
+    for client in clients:
+        client.close()
+
+    start = time.perf_counter()
+    for step in range(steps):
+        outcome = coordinator.send(commands[step % 2])
+    results['fan_out_ms'] = (time.perf_counter() - start) / steps * 1000
+    results['failed'] = outcome['failed']
+
+    # aggregated state follows the members' events
+    coordinator.send(Commands.Mute)
+    results['aggregated_s'] = _wait(
+        lambda: coordinator.serialize()['muted'] == units, timeout)
+    results['latency_ms'] = {
+        name: round(member['latency_ms']['mean'], 3)
+        for name, member in coordinator.serialize()['members'].items()
+    }
+
+    # a member going away is reported, then reconnected
+    (emulator, service, control, address) = rooms['room0']
+    service.remove(control)
+    _wait(lambda: not coordinator.serialize()['members']['room0']['connected'],
+          timeout)
+    outcome = coordinator.send(Commands.Unmute)
+    results['member_down'] = {
+        'failed': outcome['failed'],
+        'status': outcome['members']['room0']['status'],
+    }
+    service.register(Control(
+        None, service.state, service.queue,
+        os.path.join(directory, 'room0.sock'), listen=address))
+    results['reconnect_s'] = _wait(
+        lambda: coordinator.statistics['connected'] == units, timeout)
+    results['statistics'] = coordinator.statistics
+
+    coordinator.stop()
+    for (emulator, service, _, _) in rooms.values():
+        service.stop()
+        emulator.stop()
+    return results
+
+
+def _report(results):
+    for name, result in results.items():
+        print(f'{name}: {result}')
+
+
+def _scaling(args):
+    results = scaling(args.units, args.steps, args.stalled, args.timeout)
+    for id, elapsed in results.items():
+        if elapsed is None:
+            print(f'{id}: timed out')
+        else:
+            print(f'{id}: {args.steps} steps in {elapsed * 1000:.1f} ms')
+
+
+def _presets(args):
+    results = presets(args.rate, args.timeout)
+    for path, elapsed in results.items():
+        if elapsed is None:
+            print(f'{path}: timed out')
+        else:
+            print(f'{path}: applied in {elapsed * 1000:.1f} ms')
+
+
+def _latency(args):
+    results = latency(args.rate, args.steps, args.timeout)
+    for name, elapsed in results.items():
+        print(f'{name}: {elapsed * 1000:.2f} ms until displayed')
+
+
+# scenario name -> runner (prints the results)
+Scenarios = {
+    'scaling': _scaling,
+    'presets': _presets,
+    'shaping': lambda args: _report(
+        shaping(args.rate, args.steps, args.timeout)),
+    'latency': _latency,
+    'elimination': lambda args: _report(
+        elimination(args.steps, args.timeout)),
+    'control': lambda args: _report(control(args.steps, args.timeout)),
+    'mqtt': lambda args: _report(mqtt(args.steps, args.timeout)),
+    'activity': lambda args: _report(
+        activity(args.boot_delay, args.lead, args.timeout)),
+    'history': lambda args: _report(history(args.steps, args.timeout)),
+    'realtime': lambda args: _report(
+        realtime(args.hogs, args.steps, args.timeout)),
+    'group': lambda args: _report(
+        group(args.units, args.steps, args.timeout)),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Z906 main unit emulator')
+    parser.add_argument(
+        'scenario', nargs='?', default='scaling', choices=list(Scenarios))
+    parser.add_argument('--units', type=int, default=8)
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--stalled', type=int, default=1)
+    parser.add_argument('--rate', type=float, default=200.0)
+    parser.add_argument('--timeout', type=float, default=10.0)
+    parser.add_argument('--boot-delay', type=float, default=2.0)
+    parser.add_argument('--lead', type=float, default=1.5)
+    parser.add_argument('--hogs', type=int, default=4)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    Scenarios[args.scenario](args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+""" In-process MQTT broker stand-in (subset of the paho client API) """
+
+import collections
+import threading
+
+
+class Message:
+
+    def __init__(self, topic, payload, retain=False):
+        self.topic = topic
+        self.payload = payload if isinstance(payload, bytes) else \
+            str(payload).encode()
+        self.retain = retain
+
+
+def matches(filter, topic):
+    """ Whether the topic matches a subscription filter (+ and #) """
+
+    filter = filter.split('/')
+    topic = topic.split('/')
+    for index, part in enumerate(filter):
+        if part == '#':
+            return True
+        if index >= len(topic) or (part != '+' and part != topic[index]):
+            return False
+    return len(filter) == len(topic)
+
+
+class Broker:
+    """ Routes messages between clients, keeps retained messages """
+
+    def __init__(self):
+        self.retained = {}
+        self.log = []
+        self.down = False
+
+        # CONNACK reason of new sessions (e.g. 5 for bad credentials)
+        self.reason = 0
+        self._clients = []
+        self._lock = threading.Lock()
+
+    def attach(self, client):
+        if self.down:
+            raise ConnectionRefusedError('broker is down')
+        with self._lock:
+            if client not in self._clients:
+                self._clients.append(client)
+
+    def detach(self, client, unexpected=False):
+        with self._lock:
+            if client in self._clients:
+                self._clients.remove(client)
+        if unexpected and client.will is not None:
+            self.route(client.will)
+
+    def crash(self):
+        """ Drop all connections (wills are sent), refuse new ones """
+
+        self.down = True
+        for client in list(self._clients):
+            client.lost = True
+            self.detach(client, unexpected=True)
+
+    def route(self, message):
+        with self._lock:
+            self.log.append((message.topic, message.payload))
+            if message.retain:
+                self.retained[message.topic] = message.payload
+            clients = list(self._clients)
+
+        for client in clients:
+            client.deliver(message)
+
+
+class Client:
+    """ Client connected to an in-process broker """
+
+    def __init__(self, broker):
+        self._broker = broker
+        self._filters = []
+        self._inbox = collections.deque()
+        self._event = threading.Event()
+        self.will = None
+        self.lost = False
+        self.connected = False
+        self.on_connect = None
+        self.on_message = None
+        self._connack = None
+
+    def will_set(self, topic, payload=None, qos=0, retain=False):
+        self.will = Message(topic, payload, retain)
+
+    def connect(self, host='localhost', port=1883, keepalive=60):
+        self._broker.attach(self)
+        self._filters = []
+        self.lost = False
+        self.connected = True
+        self._connack = self._broker.reason
+        return 0
+
+    def disconnect(self):
+        self._broker.detach(self)
+        self.connected = False
+        return 0
+
+    def subscribe(self, topic, qos=0):
+        self._filters.append(topic)
+
+        # retained messages are delivered on subscription
+        for retained, payload in list(self._broker.retained.items()):
+            if matches(topic, retained):
+                self.deliver(Message(retained, payload, True))
+        return (0, len(self._filters))
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        if self.connected and not self.lost:
+            self._broker.route(Message(topic, payload, retain))
+
+    def deliver(self, message):
+        if any(matches(filter, message.topic) for filter in self._filters):
+            self._inbox.append(message)
+            self._event.set()
+
+    def loop(self, timeout=1.0):
+        """ Dispatch received messages (non-zero if the connection is lost) """
+
+        # sessions are acknowledged (or refused and closed) first
+        if self._connack is not None:
+            (reason, self._connack) = (self._connack, None)
+            if self.on_connect is not None:
+                self.on_connect(self, None, {}, reason)
+            if reason != 0:
+                self._broker.detach(self)
+                self.lost = True
+
+        if self.lost or not self.connected:
+            self.connected = False
+            return 7
+
+        self._event.wait(timeout)
+        self._event.clear()
+        while self._inbox:
+            message = self._inbox.popleft()
+            if self.on_message is not None:
+                self.on_message(self, None, message)
+        return 0
@@ -0,0 +1,232 @@
+""" Stand-in for the pigpio module, simulating the panel LED matrix """
+
+import collections
+import sys
+
+INPUT = 0
+OUTPUT = 1
+
+
+class pulse:
+    """ Same layout as pigpio.pulse """
+
+    def __init__(self, gpio_on, gpio_off, delay):
+        self.gpio_on = gpio_on
+        self.gpio_off = gpio_off
+        self.delay = delay
+
+
+class pi:
+    """ Records calls and keeps waves and GPIO levels in memory """
+
+    def __init__(self, host='localhost', port=8888):
+        self.connected = True
+        self.calls = collections.Counter()
+
+        self._levels = 0
+        self._modes = {}
+        self._pending = []
+        self._waves = {}
+        self._next = 0
+
+        # what is currently transmitted
+        self._repeat = None
+        self._chain = None
+
+    def _call(self, name):
+        self.calls[name] += 1
+
+    @property
+    def round_trips(self):
+        return sum(self.calls.values())
+
+    # plain GPIO
+
+    def set_mode(self, gpio, mode):
+        self._call('set_mode')
+        self._modes[gpio] = mode
+        return 0
+
+    def write(self, gpio, level):
+        self._call('write')
+        if level:
+            self._levels |= 1 << gpio
+        else:
+            self._levels &= ~(1 << gpio)
+        return 0
+
+    def read(self, gpio):
+        self._call('read')
+        return (self._levels >> gpio) & 1
+
+    def set_bank_1(self, bits):
+        self._call('set_bank_1')
+        self._levels |= bits
+        return 0
+
+    def clear_bank_1(self, bits):
+        self._call('clear_bank_1')
+        self._levels &= ~bits
+        return 0
+
+    def read_bank_1(self):
+        self._call('read_bank_1')
+        return self._levels
+
+    # waves
+
+    def wave_clear(self):
+        self._call('wave_clear')
+        self._pending = []
+        self._waves = {}
+        return 0
+
+    def wave_add_generic(self, pulses):
+        self._call('wave_add_generic')
+        self._pending.extend(pulses)
+        return len(self._pending)
+
+    def wave_create(self):
+        self._call('wave_create')
+        id = self._next
+        self._next += 1
+        self._waves[id] = [(p.gpio_on, p.gpio_off, p.delay) for p in self._pending]
+        self._pending = []
+        return id
+
+    def wave_delete(self, wave):
+        self._call('wave_delete')
+        if wave in self.timeline():
+            raise RuntimeError(f'deleting transmitted wave {wave}')
+        self._waves.pop(wave, None)
+        return 0
+
+    def wave_get_cbs(self):
+        self._call('wave_get_cbs')
+
+        # pigpio needs roughly two control blocks per pulse
+        return 2 * len(self._waves.get(self._next - 1, []))
+
+    def wave_get_micros(self):
+        self._call('wave_get_micros')
+        return sum(delay for (_, _, delay) in self._waves.get(self._next - 1, []))
+
+    def wave_send_repeat(self, wave):
+        self._call('wave_send_repeat')
+        self._repeat = wave
+        self._chain = None
+        return len(self._waves[wave])
+
+    def wave_send_once(self, wave):
+        self._call('wave_send_once')
+        self._repeat = None
+        self._chain = [wave]
+        return len(self._waves[wave])
+
+    def wave_chain(self, data):
+        self._call('wave_chain')
+        self._repeat = None
+        self._chain = list(data)
+        return 0
+
+    def wave_tx_stop(self):
+        self._call('wave_tx_stop')
+        self._repeat = None
+        self._chain = None
+        return 0
+
+    def wave_tx_busy(self):
+        self._call('wave_tx_busy')
+        return int(self._repeat is not None or self._chain is not None)
+
+    def stop(self):
+        self.connected = False
+
+    # simulation
+
+    @property
+    def memory(self):
+        """ Pulses held by all created waves """
+        return sum(len(pulses) for pulses in self._waves.values())
+
+    def timeline(self):
+        """ Sequence of waves transmitted (first pass of endless loops) """
+
+        if self._repeat is not None:
+            return [self._repeat]
+        if self._chain is None:
+            return []
+
+        return _flatten(self._chain)
+
+    def duty(self, rows, cols, waves=None):
+        """ Duty cycle of every LED (row active low, col active high) """
+
+        waves = self.timeline() if waves is None else waves
+        lit = collections.Counter()
+        total = 0
+        levels = self._levels
+
+        for wave in waves:
+            for (on, off, delay) in self._waves.get(wave, []):
+                levels = (levels | on) & ~off
+                total += delay
+                for row in rows:
+                    if levels >> row & 1:
+                        continue
+                    for col in cols:
+                        if levels >> col & 1:
+                            lit[(row, col)] += delay
+
+        return {
+            (row, col): lit[(row, col)] / total if total else 0.0
+            for row in rows
+            for col in cols
+        }
+
+
+def _flatten(data):
+    """ Expand a wave chain into waves (endless loops are played once) """
+
+    def expand(index):
+        waves = []
+        while index < len(data):
+            if data[index] != 255:
+                waves.append(data[index])
+                index += 1
+                continue
+
+            command = data[index + 1]
+            if command == 0:
+                (body, repeat, index) = expand(index + 2)
+                waves.extend(body * repeat)
+            elif command == 1:
+                repeat = data[index + 2] + 256 * data[index + 3]
+                return (waves, repeat, index + 4)
+            elif command == 2:
+                index += 4
+            elif command == 3:
+                return (waves, 1, index + 2)
+        return (waves, 1, index)
+
+    return expand(0)[0]
+
+
+def render(duty, rows, cols):
+    """ Draw duty cycles as text (one line per row) """
+
+    shades = ' .:-=+*#%@'
+    return '\n'.join(
+        ''.join(
+            shades[min(int(duty[(row, col)] * len(rows) * len(shades)),
+                       len(shades) - 1)]
+            for col in cols)
+        for row in rows)
+
+
+def install():
+    """ Register this module as pigpio (before importing components) """
+
+    module = sys.modules[__name__]
+    sys.modules['pigpio'] = module
+    return module
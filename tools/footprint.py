@@ -0,0 +1,468 @@
+""" Memory and CPU footprint of the full service on fake hardware """
+
+from tools import fakepi
+
+# components import pigpio, the fake has to be registered first
+fakepi.install()
+
+from core.gpio import Gpio
+from core.model import State, Queue
+from core.service import Service
+from core.types import Commands
+from core import pins
+
+import argparse
+import importlib
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+
+# metrics compared against the baseline (absolute slack of noisy small values)
+Metrics = {
+    'rss_kb': 2048,
+    'cpu_percent': 1.0,
+    'cpu_us_per_event': 20.0,
+    'switches_per_second': 20.0,
+    'threads': 0,
+    'traced_peak_kb': 64,
+    'retained_kb': 16,
+    'retained_bytes_per_event': 16.0,
+}
+
+Scenarios = ['idle_off', 'idle_on', 'knob_storm', 'ir_storm', 'api_flood']
+
+# Raspberry Pi libraries imported by the components (and names they use), the
+# harness injects FakeAdc, FakeIr and the fake pigpio instead of calling them
+Hardware = {
+    'evdev': ['InputDevice'],
+    'board': ['SCL', 'SDA'],
+    'busio': ['I2C'],
+    'RPi': [],
+    'RPi.GPIO': [
+        'BCM', 'IN', 'OUT', 'RISING', 'BOTH', 'setmode', 'setup', 'input',
+        'add_event_detect', 'remove_event_detect'],
+    'adafruit_ads1x15': [],
+    'adafruit_ads1x15.ads1015': ['ADS1015', 'P0'],
+    'adafruit_ads1x15.analog_in': ['AnalogIn'],
+}
+
+Baseline = os.path.join(os.path.dirname(__file__), 'footprint.json')
+
+
+def _unavailable(*args, **kwargs):
+    raise RuntimeError('hardware is not available in the footprint harness')
+
+
+def install():
+    """ Register stand-ins of missing hardware libraries, returns their names """
+
+    installed = []
+    for name, attributes in Hardware.items():
+        try:
+            importlib.import_module(name)
+            continue
+        except (ImportError, RuntimeError):
+            # RPi.GPIO refuses to import on other machines
+            pass
+
+        module = types.ModuleType(name)
+        for attribute in attributes:
+            setattr(module, attribute, _unavailable)
+        sys.modules[name] = module
+        (parent, _, child) = name.rpartition('.')
+        if parent:
+            setattr(sys.modules[parent], child, module)
+        installed.append(name)
+    return installed
+
+
+class Harness:
+    """ Service of the primary device wired to fake hardware """
+
+    def __init__(self, port):
+        from tools.replay import FakeIr
+        from components.Z906.controller import Controller
+        from components.Z906.panel import Panel
+        from components.ramp import Ramps
+        from components.reconciler import Reconciler
+        from components.timers import Timers
+        from components.control import Control
+
+        self.pi = Gpio(fakepi.pi())
+        self.state = State()
+        self.queue = Queue()
+        self.service = Service(self.state, self.queue, name='footprint')
+
+        state = self.state
+        queue = self.queue
+        register = self.service.register
+        register(Timers(self.pi, state, queue))
+        register(Control(
+            self.pi, state, queue,
+            os.path.join(tempfile.mkdtemp(), 'z906.sock')))
+        register(Controller(self.pi, state, queue, port))
+        register(Panel(self.pi, state, queue))
+        register(Ramps(self.pi, state, queue))
+        register(Reconciler(self.pi, state, queue))
+
+        # hardware inputs read from fakes
+        self.lirc = self._lirc(FakeIr())
+        self.inputs = self._inputs()
+        self.app = self._api()
+
+    def _lirc(self, device):
+        from components.Z906.lirc import Lirc
+
+        lirc = Lirc(self.pi, self.state, self.queue, device=device)
+        self.service.register(lirc)
+        return lirc
+
+    def _inputs(self):
+        """ Inputs without hardware setup (see tools.replay) """
+
+        from components.Z906.inputs import Inputs
+        from tools.replay import FakeAdc
+
+        inputs = Inputs.__new__(Inputs)
+        super(Inputs, inputs).__init__(
+            self.pi, self.state, self.queue, Inputs.IdleInterval)
+        inputs.callbacks = {}
+        inputs.levels = {pins.POTI_1: 0, pins.POTI_2: 0}
+        inputs.buttons = FakeAdc()
+        inputs._setup_buttons()
+        self.service.register(inputs)
+        return inputs
+
+    def _api(self):
+        import flask
+        from components.api import Api
+
+        app = flask.Flask('footprint')
+        self.service.register(Api(self.pi, self.state, self.queue, app))
+        return app
+
+    def power_on(self, timeout=10.0):
+        self.queue.enqueue(Commands.TurnOn)
+        deadline = time.monotonic() + timeout
+        while not self.state.ready:
+            if time.monotonic() > deadline:
+                raise TimeoutError('device did not become ready')
+            time.sleep(0.01)
+
+    def settle(self, timeout=2.0):
+        deadline = time.monotonic() + timeout
+        while not self.queue.drained and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+
+def _paced(duration, rate, step):
+    """ Call step at the given rate (as fast as possible if None) """
+
+    events = 0
+    start = time.monotonic()
+    end = start + duration
+    while True:
+        now = time.monotonic()
+        if now >= end:
+            return events
+        if rate is not None:
+            delay = start + events / rate - now
+            if delay > 0:
+                time.sleep(delay)
+        step(events)
+        events += 1
+
+
+def idle_off(harness, duration, rate):
+    time.sleep(duration)
+    return 0
+
+
+def idle_on(harness, duration, rate):
+    time.sleep(duration)
+    return 0
+
+
+def knob_storm(harness, duration, rate):
+    """ Rotary detents, direction changes every 20 steps """
+
+    inputs = harness.inputs
+
+    def detent(index):
+        (first, second) = (pins.POTI_2, pins.POTI_1)
+        if (index // 20) % 2:
+            (first, second) = (pins.POTI_1, pins.POTI_2)
+        inputs._tick(first, 1)
+        inputs._tick(second, 1)
+        inputs._tick(second, 0)
+        inputs._tick(first, 0)
+
+    return _paced(duration, rate, detent)
+
+
+def ir_storm(harness, duration, rate):
+    """ Held volume keys (repeat codes), direction changes every 20 codes """
+
+    from core.config import Config
+
+    codes = Config.Defaults['ir']['codes']
+    lirc = harness.lirc
+
+    def code(index):
+        lirc._dispatch(codes[
+            'volume_down' if (index // 20) % 2 else 'volume_up'])
+
+    return _paced(duration, rate, code)
+
+
+def api_flood(harness, duration, rate):
+    """ Dashboards polling /state and /health (Flask test client) """
+
+    client = harness.app.test_client()
+    paths = ['/state', '/state', '/state', '/health']
+
+    def poll(index):
+        response = client.get(paths[index % len(paths)])
+        if response.status_code != 200:
+            raise RuntimeError(f'{response.request.path}: {response.status}')
+
+    return _paced(duration, rate, poll)
+
+
+# scenario -> (function, device on)
+Runs = {
+    'idle_off': (idle_off, False),
+    'idle_on': (idle_on, True),
+    'knob_storm': (knob_storm, True),
+    'ir_storm': (ir_storm, True),
+    'api_flood': (api_flood, True),
+}
+
+
+def _rss_kb():
+    with open('/proc/self/statm') as file:
+        pages = int(file.read().split()[1])
+    return pages * os.sysconf('SC_PAGE_SIZE') // 1024
+
+
+def _threads():
+    with open('/proc/self/status') as file:
+        for line in file:
+            if line.startswith('Threads:'):
+                return int(line.split()[1])
+
+
+def child(scenario, port, duration, rate, traced):
+    """ Run a single scenario in this process """
+
+    stand_ins = install()
+    (run, powered) = Runs[scenario]
+    harness = Harness(port)
+
+    harness.service.start()
+    if powered:
+        harness.power_on()
+    harness.settle()
+
+    # let start-up allocations, lazy imports and caches settle
+    run(harness, 0.5, rate)
+    harness.settle()
+
+    if traced:
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        (start, _) = tracemalloc.get_traced_memory()
+
+        events = run(harness, duration, rate)
+        harness.settle()
+
+        (_, peak) = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+        # allocations still alive afterwards (growth of queues, leaks)
+        ignored = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__)]
+        retained = [
+            stat for stat in after.filter_traces(ignored).compare_to(
+                before.filter_traces(ignored), 'filename')
+            if stat.size_diff > 0]
+        size = sum(stat.size_diff for stat in retained)
+        blocks = sum(stat.count_diff for stat in retained)
+        results = {
+            'traced_peak_kb': (peak - start) / 1024,
+            'retained_kb': size / 1024,
+            'retained_bytes_per_event': size / events if events else None,
+            'retained_blocks_per_event': blocks / events if events else None,
+            'retained_top': [
+                f'{stat.traceback[0].filename}: {stat.size_diff} B'
+                for stat in retained[:3]],
+        }
+
+    else:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        start = time.perf_counter()
+
+        events = run(harness, duration, rate)
+        threads = _threads()
+        harness.settle()
+
+        elapsed = time.perf_counter() - start
+        current = resource.getrusage(resource.RUSAGE_SELF)
+        cpu = (current.ru_utime - usage.ru_utime) + \
+            (current.ru_stime - usage.ru_stime)
+        voluntary = current.ru_nvcsw - usage.ru_nvcsw
+        involuntary = current.ru_nivcsw - usage.ru_nivcsw
+        results = {
+            'events': events,
+            'seconds': elapsed,
+            'rss_kb': _rss_kb(),
+            'rss_peak_kb': current.ru_maxrss,
+            'threads': threads,
+            'cpu_percent': cpu / elapsed * 100,
+            'cpu_us_per_event': cpu / events * 1e6 if events else None,
+            'voluntary_switches': voluntary,
+            'involuntary_switches': involuntary,
+            'switches_per_second': (voluntary + involuntary) / elapsed,
+        }
+
+    harness.service.stop()
+    results['stand_ins'] = stand_ins
+    return results
+
+
+def _platform():
+    return {
+        'machine': platform.machine(),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def measure(scenario, duration, rate, traced):
+    """ Run a scenario in a fresh process against an emulated unit """
+
+    from tools.emulator import Emulator
+
+    emulator = Emulator()
+    emulator.start()
+    try:
+        command = [
+            sys.executable, '-m', 'tools.footprint', scenario,
+            '--child', emulator.port, '--duration', str(duration)]
+        if rate is not None:
+            command += ['--rate', str(rate)]
+        if traced:
+            command.append('--traced')
+
+        output = subprocess.run(
+            command, check=True, stdout=subprocess.PIPE, text=True).stdout
+        return json.loads(output.splitlines()[-1])
+    finally:
+        emulator.stop()
+
+
+def compare(results, baseline, threshold):
+    """ Metrics above the baseline by more than the threshold (and slack) """
+
+    regressions = []
+    for scenario, metrics in results.items():
+        reference = baseline.get(scenario)
+        if reference is None:
+            continue
+        if metrics.get('stand_ins') != reference.get('stand_ins'):
+            logging.warning(f'{scenario}: different libraries than baseline')
+
+        for name, slack in Metrics.items():
+            value = metrics.get(name)
+            expected = reference.get(name)
+            if value is None or expected is None:
+                continue
+            if value > expected * (1 + threshold) + slack:
+                regressions.append(
+                    f'{scenario} {name}: {value:.1f} (baseline {expected:.1f})')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Memory and CPU footprint on fake hardware')
+    parser.add_argument(
+        'scenarios', nargs='*', metavar='scenario',
+        help=f'any of {", ".join(Scenarios)} (default: all)')
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument(
+        '--rate', type=float, default=None,
+        help='events per second of storms (default: knob 200, IR 50, API unlimited)')
+    parser.add_argument('--baseline', default=Baseline)
+    parser.add_argument(
+        '--save', action='store_true', help='write results as new baseline')
+    parser.add_argument(
+        '--threshold', type=float, default=0.2,
+        help='allowed relative regression (default 20 %%)')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--traced', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    scenarios = args.scenarios or Scenarios
+    for scenario in scenarios:
+        if scenario not in Scenarios:
+            parser.error(f'unknown scenario {scenario}')
+
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.child is not None:
+        print(json.dumps(child(
+            scenarios[0], args.child, args.duration, args.rate,
+            args.traced)))
+        return
+
+    rates = {'knob_storm': 200.0, 'ir_storm': 50.0}
+    results = {}
+    for scenario in scenarios:
+        rate = args.rate if args.rate is not None else rates.get(scenario)
+        results[scenario] = measure(scenario, args.duration, rate, False)
+        traced = measure(scenario, args.duration, rate, True)
+        results[scenario].update({
+            name: value for name, value in traced.items()
+            if name != 'stand_ins'})
+        print(f'{scenario}: {json.dumps(results[scenario])}')
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+    # scenarios run now replace theirs, others are kept
+    if args.save or baseline is None:
+        with open(args.baseline, 'w') as file:
+            json.dump({
+                **(baseline or {}), **results, 'platform': _platform()},
+                file, indent=2)
+        print(f'baseline written to {args.baseline}')
+        return
+
+    if baseline.get('platform') != _platform():
+        logging.warning(
+            f'baseline recorded on {baseline.get("platform")}, compare with care')
+    regressions = compare(results, baseline, args.threshold)
+    for regression in regressions:
+        print(f'regression: {regression}')
+    if regressions:
+        sys.exit(1)
+    print(f'no regressions against {args.baseline}')
+
+
+if __name__ == '__main__':
+    main()
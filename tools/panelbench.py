@@ -0,0 +1,164 @@
+from tools import fakepi
+
+# components import pigpio, the fake has to be registered first
+fakepi.install()
+
+from core.gpio import Gpio
+from core.model import State, Queue
+from core.types import Speakers, Stage
+from components.Z906.panel import Panel
+from components.Z906 import animations
+
+import argparse
+import json
+import time
+
+
+def _panel(max_volume=43):
+    pi = fakepi.pi()
+    state = State(max_volume)
+    state._stage = Stage.Ready
+    return (pi, state, Panel(Gpio(pi), state, Queue()))
+
+
+def _calls(pi, before):
+    return {
+        name: count - before.get(name, 0)
+        for name, count in pi.calls.items()
+        if count != before.get(name, 0)
+    }
+
+
+def duty(pi):
+    """ Simulated duty cycle of every panel LED """
+    return pi.duty(Panel.Rows, Panel.Cols)
+
+
+def render(pi):
+    return fakepi.render(duty(pi), Panel.Rows, Panel.Cols)
+
+
+def create(iterations):
+    """ Wave creation throughput over a volume sweep """
+
+    (pi, state, panel) = _panel()
+    before = dict(pi.calls)
+
+    start = time.perf_counter()
+    for index in range(iterations):
+        state._volumes[Speakers.Master] = index % (state.max_volume + 1)
+        pi.wave_delete(panel.create_wave(state))
+    elapsed = time.perf_counter() - start
+
+    return {
+        'waves_per_second': iterations / elapsed,
+        'pulses': panel.statistics['pulses'],
+        'calls_per_wave': {
+            name: count / iterations
+            for name, count in _calls(pi, before).items()
+        },
+    }
+
+
+def update(iterations):
+    """ Full update throughput (static state) over a volume sweep """
+
+    (pi, state, panel) = _panel()
+    panel.update()
+    before = dict(pi.calls)
+
+    start = time.perf_counter()
+    for index in range(iterations):
+        # stay below the limit, reaching it would flash
+        state._volumes[Speakers.Master] = 1 + index % (state.max_volume - 1)
+        panel.update()
+    elapsed = time.perf_counter() - start
+
+    return {
+        'updates_per_second': iterations / elapsed,
+        'round_trips_per_update': sum(_calls(pi, before).values()) / iterations,
+        'waves_held': len(pi._waves),
+    }
+
+
+def power():
+    """ Round trips to set up and power down the panel """
+
+    (pi, state, panel) = _panel()
+    setup = pi.round_trips
+
+    panel.update()
+    before = pi.round_trips
+    state._stage = Stage.Off
+    panel.update()
+
+    return {
+        'setup': setup,
+        'power_down': pi.round_trips - before,
+    }
+
+
+def bar(volume):
+    """ Check the simulated volume bar against the expected levels """
+
+    (pi, state, panel) = _panel()
+    state._volumes[Speakers.Master] = volume
+    panel.update()
+
+    leds = duty(pi)
+    errors = []
+    for index, led in enumerate(animations.VolumeBar):
+        value = min(max(volume / 4.0 - 10 + index, 0.0), 1.0)
+        expected = (value * value if value > 0.01 else 0.0) / len(Panel.Rows)
+        if abs(leds[led] - expected) > 1.0 / Panel.Slot:
+            errors.append((index, round(leds[led], 4), round(expected, 4)))
+
+    return {'volume': volume, 'errors': errors, 'panel': render(pi)}
+
+
+def animation():
+    """ Waves and chain used to play animations """
+
+    results = {}
+    for name, setup in [
+            ('blink', lambda state: setattr(state, '_mute', True)),
+            ('flash', lambda state: state._volumes.update({
+                Speakers.Master: state.max_volume})),
+            ('spinner', lambda state: setattr(state, '_stage', Stage.Powered))]:
+
+        (pi, state, panel) = _panel()
+        state._volumes[Speakers.Master] = state.max_volume // 2
+        panel.update()
+        before = dict(pi.calls)
+
+        setup(state)
+        panel.update()
+        results[name] = {
+            'waves': len(pi.timeline()),
+            'pulses_held': pi.memory,
+            'calls': _calls(pi, before),
+        }
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Panel benchmark on fake GPIO')
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--volume', type=int, default=30)
+    args = parser.parse_args()
+
+    print(json.dumps(create(args.iterations), indent=2))
+    print(json.dumps(update(args.iterations), indent=2))
+    print(json.dumps(animation(), indent=2))
+    print(json.dumps(power(), indent=2))
+
+    result = bar(args.volume)
+    print(result['panel'])
+    print(f'volume {result["volume"]}: {len(result["errors"])} mismatches')
+    for error in result['errors']:
+        print(f'  led {error[0]}: {error[1]} (expected {error[2]})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+from core.gpio import Gpio
+from core.model import State, Queue
+from core.service import Service
+from core import trace
+
+import argparse
+import json
+import logging
+import struct
+import threading
+import time
+
+
+class FakeSerial:
+    """ Serial port fed from a trace """
+
+    port = 'replay'
+
+    def __init__(self, timeout=0.05):
+        self._timeout = timeout
+        self._buffer = bytearray()
+        self._condition = threading.Condition()
+        self._cancelled = False
+        self.written = bytearray()
+
+    @property
+    def pending(self):
+        return len(self._buffer)
+
+    def feed(self, data):
+        with self._condition:
+            self._buffer += data
+            self._condition.notify_all()
+
+    def read(self, size=1):
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._buffer or self._cancelled, self._timeout)
+            self._cancelled = False
+
+            data = bytes(self._buffer[:size])
+            del self._buffer[:size]
+            return data
+
+    def write(self, data):
+        self.written += data
+        return len(data)
+
+    def cancel_read(self):
+        with self._condition:
+            self._cancelled = True
+            self._condition.notify_all()
+
+
+class FakeIr:
+    """ IR device without events (replayed codes are dispatched directly) """
+
+    def read_one(self):
+        return None
+
+
+class FakePi:
+    """ GPIO daemon stand-in that ignores all calls """
+
+    connected = True
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: 0
+
+
+class FakeAdc:
+    """ Analog input returning replayed voltages """
+    voltage = 3.3
+
+
+class Replay:
+    """ Feeds a trace through the real components """
+
+    def __init__(self, path):
+        self._path = path
+        self._serial = FakeSerial()
+        self._expected = bytearray()
+        self._skipped = {}
+        self._count = 0
+
+        self._state = State()
+        self._queue = Queue()
+        self._service = Service(self._state, self._queue, name='replay')
+        self._lirc = None
+        self._inputs = None
+        self._client = None
+
+        pi = Gpio(FakePi())
+        from components.Z906.controller import Controller
+        self._controller = Controller(
+            pi, self._state, self._queue, self._serial, None)
+        self._service.register(self._controller)
+
+        # optional components (their dependencies may be missing)
+        try:
+            from components.Z906.lirc import Lirc
+            self._lirc = Lirc(pi, self._state, self._queue, device=FakeIr())
+            self._service.register(self._lirc)
+        except ImportError as e:
+            logging.warning(f'replaying without IR: {e}')
+
+        try:
+            self._inputs = self._replay_inputs(pi)
+            self._service.register(self._inputs)
+        except (ImportError, RuntimeError) as e:
+            logging.warning(f'replaying without inputs: {e}')
+
+        try:
+            import flask
+            from components.api import Api
+            app = flask.Flask('replay')
+            self._service.register(Api(pi, self._state, self._queue, app))
+            self._client = app.test_client()
+        except ImportError as e:
+            logging.warning(f'replaying without API: {e}')
+
+        self._handlers = {
+            trace.Kind.SerialIn: self._serial_in,
+            trace.Kind.SerialOut: self._serial_out,
+            trace.Kind.Ir: self._ir,
+            trace.Kind.Voltage: self._voltage,
+            trace.Kind.Rotary: self._rotary,
+            trace.Kind.Api: self._api,
+        }
+
+    def _replay_inputs(self, pi):
+        """ Inputs component without hardware setup """
+
+        from components.Z906.inputs import Inputs
+
+        inputs = Inputs.__new__(Inputs)
+        super(Inputs, inputs).__init__(
+            pi, self._state, self._queue, Inputs.IdleInterval)
+        inputs.callbacks = {}
+        inputs.levels = {}
+        inputs.buttons = FakeAdc()
+        inputs._setup_buttons()
+
+        # polls are driven by the trace
+        inputs.asleep = True
+        return inputs
+
+    def _skip(self, kind):
+        self._skipped[kind.name] = self._skipped.get(kind.name, 0) + 1
+
+    def _serial_in(self, payload):
+        self._serial.feed(payload)
+
+    def _serial_out(self, payload):
+        self._expected += payload
+
+    def _ir(self, payload):
+        if self._lirc is None:
+            return self._skip(trace.Kind.Ir)
+        (code,) = struct.unpack('<I', payload)
+        self._lirc._dispatch(code)
+
+    def _voltage(self, payload):
+        if self._inputs is None:
+            return self._skip(trace.Kind.Voltage)
+        (self._inputs.buttons.voltage,) = struct.unpack('<f', payload)
+        self._inputs.poll()
+
+    def _rotary(self, payload):
+        if self._inputs is None:
+            return self._skip(trace.Kind.Rotary)
+        (channel, level) = struct.unpack('<BB', payload)
+        self._inputs._tick(channel, level)
+
+    def _api(self, payload):
+        request = json.loads(payload)
+        if self._client is None or request['path'] == '/trace':
+            return self._skip(trace.Kind.Api)
+        self._client.open(
+            request['path'], method=request['method'], json=request['body'])
+
+    def _settle(self, timeout=1.0):
+        """ Let the service process everything fed so far """
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if not self._serial.pending and self._queue.drained:
+                return
+            time.sleep(0.0005)
+
+    def run(self, speed=1.0):
+        """ Replay at the given speed (0 replays as fast as possible) """
+
+        self._service.start()
+
+        # traces may start while the device is already on
+        for worker in self._controller.workers:
+            worker.start()
+
+        start = time.monotonic()
+        for (timestamp, kind, payload) in trace.read(self._path):
+
+            if speed > 0:
+                delay = start + timestamp / speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+            self._handlers[kind](payload)
+            self._count += 1
+
+            if speed <= 0:
+                self._settle()
+
+        self._settle()
+        elapsed = time.monotonic() - start
+        self._service.stop()
+
+        # compare generated serial output with the recorded one
+        written = bytes(self._serial.written)
+        expected = bytes(self._expected)
+        mismatch = None
+        if written != expected:
+            mismatch = next(
+                (index for index, (a, b) in enumerate(zip(written, expected))
+                 if a != b),
+                min(len(written), len(expected)))
+
+        return {
+            'records': self._count,
+            'elapsed': elapsed,
+            'records_per_second': self._count / max(elapsed, 1e-9),
+            'skipped': self._skipped,
+            'written': len(written),
+            'expected': len(expected),
+            'mismatch': mismatch,
+            'volumes': {
+                speakers.name: volume
+                for speakers, volume in self._state.volumes.items()
+            },
+            'input': int(self._state.input),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a recorded trace')
+    parser.add_argument('path')
+    parser.add_argument(
+        '--speed', type=float, default=1.0,
+        help='replay speed factor (0 replays as fast as possible)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    print(json.dumps(Replay(args.path).run(args.speed), indent=2))
+
+
+if __name__ == '__main__':
+    main()